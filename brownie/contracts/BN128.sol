@@ -85,4 +85,49 @@ contract BN128 {
         }
         require(success, "elliptic curve multiplication failed");
     }
+
+    // top bit of a compressed point, x < FIELD_MODULUS < 2**254 leaves it free
+    uint256 constant PARITY_BIT = 1 << 255;
+
+    function bn128_compress(uint256[2] memory point)
+    internal pure returns (uint256) {
+        // encodes P as x | (y & 1) << 255
+        return point[0] | ((point[1] & 1) << 255);
+    }
+
+    function bn128_decompress(uint256 compressed)
+    internal view returns (bool valid, uint256[2] memory point) {
+        // recovers y as the square root of x**3 + 3 whose parity matches the top bit,
+        // valid is false if x is not the x-coordinate of a point on the curve
+        uint256 x = compressed & (PARITY_BIT - 1);
+        if (x >= FIELD_MODULUS) return (false, point);
+
+        uint256 y2 = addmod(mulmod(x, mulmod(x, x, FIELD_MODULUS), FIELD_MODULUS), 3, FIELD_MODULUS);
+        // FIELD_MODULUS = 3 mod 4, so y2**((FIELD_MODULUS + 1) / 4) is a square root if y2 has one
+        uint256 y = bn128_modexp(y2, (FIELD_MODULUS + 1) / 4);
+        if (mulmod(y, y, FIELD_MODULUS) != y2) return (false, point);
+
+        // y is never 0, the curve has no point of order 2
+        if ((y & 1) != (compressed >> 255)) y = FIELD_MODULUS - y;
+        point[0] = x;
+        point[1] = y;
+        valid = true;
+    }
+
+    function bn128_modexp(uint256 base, uint256 exponent)
+    internal view returns (uint256 result) {
+        // computes base**exponent mod FIELD_MODULUS
+        uint256[6] memory input = [uint256(32), 32, 32, base, exponent, FIELD_MODULUS];
+        uint256[1] memory output;
+
+        bool success;
+        assembly {
+            // 0x05     id of precompiled bigModExp contract
+            // 192      size of call parameters, the lengths of base, exponent and modulus followed by their values
+            // 32       size of call return value
+            success := staticcall(not(0), 0x05, input, 192, output, 32)
+        }
+        require(success, "modular exponentiation failed");
+        result = output[0];
+    }
 }
@@ -27,7 +27,8 @@ contract DAODutchAuction is BN128, Encryption {
     // Timestamp after which bidding is over
     uint256 public bidClosingTime;
 
-    // Keep track of number of bidders, needed for an all bid reveal step
+    // Keep track of number of bidders, needed for an all bid reveal step. Only an address's first bid
+    // counts, a later one replaces it, so this is also the number of entries in the reveal order
     uint256 public bidCount = 0;
 
     // Map of msg.sender to locked ETH
@@ -37,20 +38,41 @@ contract DAODutchAuction is BN128, Encryption {
     mapping(address => Bid) public bids;
 
     // Result tracking for on-chain decryption of results (not always needed)
-    mapping(address => address[]) public postedBids;
+    mapping(address => RevealProgress) public revealProgress;
     mapping(address => Result) public results;
     address public resultSubmitter;
     address public votesToken;
 
-    event BidSubmitted(address bidder, uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256[2] bidderPublicKey);
+    // Optimistic settlement: a proposer posts the result with a bond and a Merkle root over the reveal
+    // order, which can be disputed one entry at a time during the challenge period
+    uint256 public constant SETTLEMENT_BOND = 1 ether;
+    uint256 public constant CHALLENGE_PERIOD = 1 days;
+    // Time each side of a dispute has to answer the other
+    uint256 public constant RESPONSE_PERIOD = 1 hours;
+    Proposal public proposal;
+    Dispute public dispute;
+
+    // bidderPublicKey is compressed, see bidCompressed
+    event BidSubmitted(address bidder, uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256 bidderPublicKey, bytes32 commitment);
     event PublicKeySet(address auctioneer);
     event PrivateKeyRevealed(address auctioneer);
-
+    event SettlementProposed(address proposer, uint256 maxPrice, uint256 totalBid, bytes32 root);
+    event SettlementChallenged(address challenger, uint256 index);
+    event LeafOpened(
+        uint256 index, address bidder, uint256 bidAmount, uint256 maxPrice, bool valid,
+        uint256 resultMaxPrice, uint256 resultTotalBid, bytes32[] proof
+    );
+    event SettlementRejected(address challenger);
+    event ChallengeRejected(address challenger);
+    // withdrawMany left recipient unpaid, it has no bid or rejected the ETH. Its locked ETH stays withdrawable
+    event WithdrawalSkipped(address recipient);
+
+    // A committed bid is decrypted like any other, its commitment is then checked against the decrypted values
     struct Bid {
-        address sender;
         uint256 encryptedBidAmount;
         uint256 encryptedMaxPrice;
-        uint256[2] bidderPublicKey;
+        uint256 bidderPublicKey;    // compressed, decompressed when the bid is decrypted
+        bytes32 commitment;
     }
 
     struct Result {
@@ -58,6 +80,42 @@ contract DAODutchAuction is BN128, Encryption {
         uint256 totalBid;   // TODO: This storage variable is unecessary, but it makes the logic easier
     }
 
+    struct Proposal {
+        address proposer;
+        uint64 proposedAt;
+        bytes32 root;
+        uint256 maxPrice;
+        uint256 totalBid;
+    }
+
+    // The challenger requests leaves one at a time, the proposer opens each with a Merkle proof
+    struct Dispute {
+        address challenger;
+        uint64 deadline;
+        bool proposerTurn;
+        uint16 requests;    // leaves requested so far, at most maxLeafRequests()
+        uint256 index;
+    }
+
+    // Entry at index of the reveal order, with the running result revealAllBids has after it
+    struct SettlementLeaf {
+        uint256 index;
+        address bidder;
+        uint256 bidAmount;
+        uint256 maxPrice;
+        bool valid;
+        uint256 resultMaxPrice;
+        uint256 resultTotalBid;
+    }
+
+    // Last bid posted by a submitter, carried between revealAllBids calls so it is never decrypted twice
+    struct RevealProgress {
+        address lastBidder;
+        uint88 count;
+        bool lastValid;
+        uint256 lastMaxPrice;
+    }
+
     constructor(address[] memory _auctioneers, uint256 _bidClosingTime) {
         address prevAddr = address(0);
         for (uint256 i = 0; i < _auctioneers.length; i++) {
@@ -76,14 +134,56 @@ contract DAODutchAuction is BN128, Encryption {
         return result[0];
     }
 
-    function _decryptBid(Bid memory _bid) internal returns (uint256 bidAmount, uint256 maxPrice) {
-        uint256 symKey = _sharedKey(_bid.bidderPublicKey);
-        bidAmount = decrypt(_bid.encryptedBidAmount, symKey);
-        maxPrice = decrypt(_bid.encryptedMaxPrice, symKey);
+    // Both values are encrypted with the same key stream, so it is hashed once
+    function _decryptBidWith(
+        uint256[2] memory publicKey,
+        uint256 encryptedBidAmount,
+        uint256 encryptedMaxPrice,
+        uint256 secretKey
+    ) internal returns (uint256 symKey, uint256 bidAmount, uint256 maxPrice) {
+        symKey = bn128_multiply([publicKey[0], publicKey[1], secretKey])[0];
+        uint256 keyStream = uint256(keccak256(abi.encodePacked(symKey)));
+        bidAmount = encryptedBidAmount ^ keyStream;
+        maxPrice = encryptedMaxPrice ^ keyStream;
     }
 
-    function getBidderPublicKey(address bidder) external view returns (uint256[2] memory) {
-        return bids[bidder].bidderPublicKey;
+    // Decrypted values of a bid. A committed bid whose commitment, keccak256(abi.encode(bidAmount, maxPrice,
+    // salt)) salted with the x coordinate of the shared key, doesn't match its decrypted values is invalid,
+    // so a bad commitment is refunded in full and can't hold up settlement. Bids are always decrypted: a
+    // plaintext opening's salt can't be tied to the shared key without the ecMul it would save, and an
+    // opening under a salt of the bidder's choosing would give the bid a second outcome
+    function _decryptBid(
+        address bidder,
+        uint256 secretKey
+    ) internal returns (bool exists, uint256 bidAmount, uint256 maxPrice) {
+        // A memory copy reads all four slots at once and keeps _decryptBid clear of stack too deep
+        Bid memory storedBid = bids[bidder];
+        if (storedBid.bidderPublicKey == 0) return (false, 0, 0);
+
+        (bool validKey, uint256[2] memory publicKey) = bn128_decompress(storedBid.bidderPublicKey);
+        // A bid amount above the max price, a bid that can't be decrypted is invalid
+        if (!validKey) return (true, 1, 0);
+
+        uint256 symKey;
+        (symKey, bidAmount, maxPrice) = _decryptBidWith(
+            publicKey, storedBid.encryptedBidAmount, storedBid.encryptedMaxPrice, secretKey
+        );
+        if (storedBid.commitment != 0 && keccak256(abi.encode(bidAmount, maxPrice, symKey)) != storedBid.commitment) {
+            return (true, 1, 0);
+        }
+        return (true, bidAmount, maxPrice);
+    }
+
+    function getBidderPublicKey(address bidder) external view returns (uint256[2] memory point) {
+        (, point) = bn128_decompress(bids[bidder].bidderPublicKey);
+    }
+
+    function postedBidCount(address submitter) external view returns (uint256) {
+        return revealProgress[submitter].count;
+    }
+
+    function lastPostedBid(address submitter) external view returns (address) {
+        return revealProgress[submitter].lastBidder;
     }
 
     function getIndex(address auctioneer) external view returns (uint256) {
@@ -155,168 +255,398 @@ contract DAODutchAuction is BN128, Encryption {
 
     // Can be called more than 1 time technically
     function bid(uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256[2] memory _publicKey) public payable {
+        bid(encryptedBidAmount, encryptedMaxPrice, _publicKey, bytes32(0));
+    }
+
+    // With a non-zero commitment the bid is only valid if its decrypted values match it
+    function bid(
+        uint256 encryptedBidAmount,
+        uint256 encryptedMaxPrice,
+        uint256[2] memory _publicKey,
+        bytes32 commitment
+    ) public payable {
+        // Check that the public key of the bidder is valid
+        require(bn128_is_on_curve(_publicKey), "Invalid public key");
+
+        _bid(encryptedBidAmount, encryptedMaxPrice, bn128_compress(_publicKey), commitment);
+    }
+
+    // Takes the public key compressed to x | (y & 1) << 255, which saves the calldata of y. It is only
+    // decompressed when the bid is decrypted, a bid whose key is not on the curve then counts as invalid
+    function bidCompressed(uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256 _publicKey) public payable {
+        bidCompressed(encryptedBidAmount, encryptedMaxPrice, _publicKey, bytes32(0));
+    }
+
+    function bidCompressed(
+        uint256 encryptedBidAmount,
+        uint256 encryptedMaxPrice,
+        uint256 _publicKey,
+        bytes32 commitment
+    ) public payable {
+        // A stored key of 0 marks an address without a bid, no point on the curve has x = 0
+        require(_publicKey != 0, "Invalid public key");
+
+        _bid(encryptedBidAmount, encryptedMaxPrice, _publicKey, commitment);
+    }
+
+    function _bid(uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256 compressedKey, bytes32 commitment) internal {
         require(isBiddingOpen(), "Bidding is not open");
         require(!hasBiddingClosed(), "Bidding has closed");
 
         // Lock ETH towards bid
         lockEth();
 
-        // Check that the public key of the bidder is valid
-        require(bn128_is_on_curve(_publicKey), "Invalid public key");
-
-        // Save bid and increment counter
-        bids[msg.sender] = Bid(msg.sender, encryptedBidAmount, encryptedMaxPrice, _publicKey);
-        bidCount += 1;
+        // Save bid and increment counter, a stored key of 0 marks an address without a bid
+        if (bids[msg.sender].bidderPublicKey == 0) bidCount += 1;
+        bids[msg.sender] = Bid(encryptedBidAmount, encryptedMaxPrice, compressedKey, commitment);
         
-        emit BidSubmitted(msg.sender, encryptedBidAmount, encryptedMaxPrice, _publicKey);
+        emit BidSubmitted(msg.sender, encryptedBidAmount, encryptedMaxPrice, compressedKey, commitment);
     }
 
     // Can be called more than 1 time
     function lockEth() public payable {
+        // Bid validity depends on lockedEth, it must not change while results are computed
+        require(revealedKeys == 0, "Bids are being revealed");
         lockedEth[msg.sender] += msg.value;
     }
 
     // Function that reveals all bids, sorted by valid(ordered by maxPrice descending, then address), then invalid bids ordered by address
     // Since only 1 bid can be saved per address, ordering by maxPrice or validity then address will guarantee no duplicates
-    // TODO: instead perhaps let bidders include a hash their decrypted values, so 2xSLOAD + decryption doesn't need to happen...
+    // Each bid is decrypted once, the previous bid's max price and validity are carried in memory and, between
+    // calls, in revealProgress. Running state is written back to storage once per call.
     function revealAllBids(address[] memory bidders) public {
         // Ensure no one has completed result
         require(resultSubmitter == address(0), "Result already generated");
 
         // If bidders is empty, reset the buffers
         if (bidders.length == 0) {
-            delete postedBids[msg.sender];
-            results[msg.sender] = Result(0,0);
+            delete revealProgress[msg.sender];
+            delete results[msg.sender];
             return;
         }
 
-        // Check results
-        // Bids need to be in decreasing order by maxPrice then for invalid bids only address
-        Bid memory currentBid;
-        Bid memory nextBid;
+        require(revealedKeys == auctioneers.length, "Master private key not set");
+        uint256 secretKey = masterSecretKey;
 
-        // If bids already posted, use latest as current
-        if (postedBids[msg.sender].length > 0) {
-            currentBid = bids[postedBids[msg.sender][postedBids[msg.sender].length - 1]];
-        }
+        RevealProgress memory progress = revealProgress[msg.sender];
+        Result memory currentResult = results[msg.sender];
+        require(progress.count + bidders.length <= bidCount, "More bids posted than submitted");
 
         // For each bidder presented
         for (uint256 i = 0; i < bidders.length; i++) {
+            address bidder = bidders[i];
+            (bool exists, uint256 nextBidAmount, uint256 nextBidMaxPrice) = _decryptBid(bidder, secretKey);
+            require(exists, "Invalid bid");
+
+            // Bid Amount cannot exceed max price or lockedEth
+            bool nextBidValid = nextBidAmount <= nextBidMaxPrice && nextBidAmount <= lockedEth[bidder];
 
-            // Get the next bid
-            nextBid = bids[bidders[i]];
+            // If a bid was posted before, compare with nextBid, verify follows protocol
+            if (progress.count > 0) {
+                if (nextBidValid) {
+                    // Valid bids must come first and be adjacent
+                    require(progress.lastValid, "Valid bid incorrectly ordered");
 
-            // This prob not needed
-            require(nextBid.sender == bidders[i], "Invalid bid");
+                    // While next bid still valid max price must be in descending order
+                    require(progress.lastMaxPrice >= nextBidMaxPrice, "Results must be in order of decreasing max price");
 
-            // Assert public key has been set
-            require(nextBid.bidderPublicKey[0] != 0, "Invalid bid");
+                    // If compared bids have same maxPrice, addresses must be in descending order
+                    if (progress.lastMaxPrice == nextBidMaxPrice) {
+                      require(progress.lastBidder > bidder, "Valid Bid: sender incorrectly ordered");
+                    }
+                } else if (!progress.lastValid) {
+                    // If both bids are invalid, senders must be in descending order
+                    require(progress.lastBidder > bidder, "Invalid Bid: sender incorrectly ordered");
+                }
+            }
 
-            bool currentBidValid = true;
-            bool nextBidValid = true;
+            currentResult = _nextResult(currentResult, progress.count == 0, nextBidValid, nextBidAmount, nextBidMaxPrice);
 
-            (uint256 nextBidAmount, uint256 nextBidMaxPrice) = _decryptBid(nextBid);
+            // Whether valid or invalid, we assume nextBid was ordered appropriately and check it on next iteration
+            progress.lastBidder = bidder;
+            progress.lastValid = nextBidValid;
+            progress.lastMaxPrice = nextBidMaxPrice;
+            progress.count += 1;
+        }
 
-            // Bid Amount cannot exceed max price
-            if (nextBidAmount > nextBidMaxPrice) {
-                nextBidValid = false;
-            }
-            // Bid Amount cannot exceed lockedEth
-            if (nextBidValid && nextBidAmount > lockedEth[nextBid.sender]) {
-                nextBidValid = false;
+        // Result becomes final once all bids accounted for
+        if (progress.count == bidCount) {
+            _finalize(msg.sender, _finalResult(currentResult));
+        } else {
+            results[msg.sender] = currentResult;
+        }
+        revealProgress[msg.sender] = progress;
+    }
+
+    // Running result after one more bid in reveal order, a bid's validity and decrypted values given
+    function _nextResult(
+        Result memory currentResult,
+        bool first,
+        bool valid,
+        uint256 bidAmount,
+        uint256 maxPrice
+    ) internal pure returns (Result memory) {
+        Result memory nextResult = Result(currentResult.maxPrice, currentResult.totalBid);
+
+        // If first valid bid, set maxPrice = current max
+        if (valid && first) {
+            nextResult.maxPrice = maxPrice;
+            nextResult.totalBid = bidAmount;
+        } else if (   // Else, if the next bid is valid and maxPrice same, increment totalBid
+            valid && nextResult.maxPrice == maxPrice
+        ) {
+
+            nextResult.totalBid += bidAmount;
+        } else if (   // Else if next bid valid and maxPrice different, IFF currentResult.totalBid < currentResult.maxPrice
+            valid && nextResult.maxPrice != maxPrice
+        ) {
+            // As long as total bid has not exceeded or equal maxPrice, we keep going
+            if (nextResult.totalBid < nextResult.maxPrice) {
+                nextResult.maxPrice = maxPrice;
+                nextResult.totalBid += bidAmount;
             }
+        }
+        return nextResult;
+    }
 
-            // If currentBid is set, compare with nextBid, verify follows protocol
-            if (currentBid.bidderPublicKey[0] != 0) {
-                (uint256 currentBidAmount, uint256 currentBidMaxPrice) = _decryptBid(currentBid);
+    // Result once all bids are accounted for
+    function _finalResult(Result memory currentResult) internal pure returns (Result memory) {
+        // TODO: Add reserve scenario
 
-                // Check if bids are valid
+        // handle case where maxPrice isn't exceeded, maxPrice becomes the total amount bid
+        if (currentResult.totalBid < currentResult.maxPrice) {
+            return Result(currentResult.totalBid, currentResult.totalBid);
+        }
+        return currentResult;
+    }
 
-                // Bid Amount cannot exceed max price
-                if (currentBidAmount > currentBidMaxPrice) {
-                    currentBidValid = false;
-                }
+    function _finalize(address submitter, Result memory finalResult) internal {
+        // Auction is finalized
+        results[submitter] = finalResult;
+        resultSubmitter = submitter;
 
-                // Bid Amount cannot exceed lockedEth
-                if (currentBidValid && currentBidAmount > lockedEth[currentBid.sender]) {
-                    currentBidValid = false;
-                }
+        // TODO here: (1) Create a DAO with maxPrice shares (2) Send maxPrice funds there
+        votesToken = address(new ERC20PresetFixedSupply("DAOVotes", "DAO", finalResult.maxPrice, address(this)));
+    }
+
+    function proposeSettlement(uint256 maxPrice, uint256 totalBid, bytes32 root) external payable {
+        require(resultSubmitter == address(0), "Result already generated");
+        require(revealedKeys == auctioneers.length, "Master private key not set");
+        require(bidCount > 0, "No bids");
+        require(proposal.proposer == address(0), "Settlement already proposed");
+        require(msg.value == SETTLEMENT_BOND, "Bond required");
 
-                // Valid bids must come first and be adjacent
-                if (nextBidValid) require(currentBidValid, "Valid bid incorrectly ordered");
+        proposal = Proposal(msg.sender, uint64(block.timestamp), root, maxPrice, totalBid);
+        emit SettlementProposed(msg.sender, maxPrice, totalBid, root);
+    }
 
-                // Raise exception if submitted in wrong order
-                if (nextBidValid) {
-                    // While next bid still valid max price must be in descending order
-                    require(currentBidMaxPrice >= nextBidMaxPrice, "Results must be in order of decreasing max price");
+    // Leaves a challenger may request in one dispute, ceil(log2(bidCount)) + 1: the last leaf, then a
+    // bisection down to an adjacent pair. After that they must prove their claim or lose it on timeout
+    function maxLeafRequests() public view returns (uint256 requests) {
+        requests = 1;
+        for (uint256 n = bidCount - 1; n > 0; n >>= 1) {
+            requests += 1;
+        }
+    }
 
-                    // If compared bids have same maxPrice, addresses must be in descending orderj
-                    if (currentBidMaxPrice == nextBidMaxPrice) {
-                      require(currentBid.sender > nextBid.sender , "Valid Bid: sender incorrectly ordered");
-                    }
-                } else {
-                    // If nextBid is invalid
-                    // If currentBid is also invalid, senders must be in descending order
-                    if (currentBidValid == false) {
-                      require(currentBid.sender > nextBid.sender, "Invalid Bid: sender incorrectly ordered");
-                    }
-                }
+    // Starts a dispute, or requests the next leaf of the caller's dispute
+    function challengeSettlement(uint256 index) external payable {
+        require(proposal.proposer != address(0), "No settlement proposed");
+        require(index < bidCount, "Index out of range");
 
-            }
+        if (dispute.challenger == address(0)) {
+            require(block.timestamp < proposal.proposedAt + CHALLENGE_PERIOD, "Challenge period over");
+            require(msg.value == SETTLEMENT_BOND, "Bond required");
+            dispute.challenger = msg.sender;
+        } else {
+            require(dispute.challenger == msg.sender, "Dispute in progress");
+            require(!dispute.proposerTurn, "Waiting for the proposer");
+            require(block.timestamp <= dispute.deadline, "Response period over");
+            require(msg.value == 0, "Bond already posted");
+            require(dispute.requests < maxLeafRequests(), "Leaf request limit reached");
+        }
 
-            // Whether or not current bid is set, we assume nextBid, valid or invalid
-            //  was ordered appropriately and check it on next iteraiton
-
-            // Add nextBid.sender to postedBids
-            postedBids[msg.sender].push(nextBid.sender);
-            currentBid = nextBid;
-
-            Result memory currentResult = results[msg.sender];
-
-            // If first valid bid, set maxPrice = current max
-            if (nextBidValid && postedBids[msg.sender].length == 1) {
-                currentResult.maxPrice = nextBidMaxPrice;
-                currentResult.totalBid = nextBidAmount;
-            } else if (   // Else, if the next bid is valid and maxPrice same, increment totalBid
-                nextBidValid && currentResult.maxPrice == nextBidMaxPrice
-            ) {
-
-                currentResult.totalBid += nextBidAmount;
-            } else if (   // Else if next bid valid and maxPrice different, IFF currentResult.totalBid < currentResult.maxPrice
-                nextBidValid && currentResult.maxPrice != nextBidMaxPrice
-            ) {
-                // As long as total bid has not exceeded or equal maxPrice, we keep going
-                if (currentResult.totalBid < currentResult.maxPrice) {
-                    currentResult.maxPrice = nextBidMaxPrice;
-                    currentResult.totalBid += nextBidAmount;
-                }
-            }
+        dispute.requests += 1;
+        dispute.index = index;
+        dispute.proposerTurn = true;
+        dispute.deadline = uint64(block.timestamp + RESPONSE_PERIOD);
+        emit SettlementChallenged(msg.sender, index);
+    }
 
-            // Update result
-            results[msg.sender] = currentResult;
+    function openLeaf(SettlementLeaf memory leaf, bytes32[] memory proof) external {
+        require(dispute.proposerTurn, "No leaf requested");
+        require(block.timestamp <= dispute.deadline, "Response period over");
+        require(leaf.index == dispute.index, "Wrong leaf");
+        require(_verifyLeaf(leaf, proof), "Invalid proof");
+
+        dispute.proposerTurn = false;
+        dispute.deadline = uint64(block.timestamp + RESPONSE_PERIOD);
+        emit LeafOpened(
+            leaf.index, leaf.bidder, leaf.bidAmount, leaf.maxPrice, leaf.valid,
+            leaf.resultMaxPrice, leaf.resultTotalBid, proof
+        );
+    }
 
-            // Result becomes final once all bids accounted for
-            if (postedBids[msg.sender].length == bidCount) {
-                // Auction is finalized
+    // Proves that entry doesn't follow prev (unused for the first entry) the way revealAllBids would:
+    // it isn't a bid with these decrypted values, breaks the reveal order or has the wrong running result
+    function proveInvalidEntry(
+        SettlementLeaf memory prev,
+        bytes32[] memory prevProof,
+        SettlementLeaf memory entry,
+        bytes32[] memory proof
+    ) external {
+        _verifyAdjacent(prev, prevProof, entry, proof);
+        require(!_followsFrom(prev, entry), "Entry is valid");
+
+        _rejectSettlement(msg.sender);
+    }
 
-                // TODO: Add reserve scenario
+    // Whether entry is what revealAllBids computes for its bidder after prev. Kept out of proveInvalidEntry,
+    // whose arguments and proofs leave too few stack slots for these locals
+    function _followsFrom(
+        SettlementLeaf memory prev,
+        SettlementLeaf memory entry
+    ) internal returns (bool) {
+        (bool exists, uint256 bidAmount, uint256 maxPrice, bool valid) = _revealBid(entry.bidder);
+        if (!exists || entry.bidAmount != bidAmount || entry.maxPrice != maxPrice || entry.valid != valid) return false;
+
+        Result memory expected = _nextResult(
+            Result(prev.resultMaxPrice, prev.resultTotalBid), entry.index == 0, valid, bidAmount, maxPrice
+        );
+        if (entry.resultMaxPrice != expected.maxPrice || entry.resultTotalBid != expected.totalBid) return false;
+        return entry.index == 0 || _ranksBefore(prev.valid, prev.maxPrice, prev.bidder, valid, maxPrice, entry.bidder);
+    }
 
-                // handle case where maxPrice isn't exceeded
-                if (currentResult.totalBid < currentResult.maxPrice) {
+    // Proves that omitted ranks between prev and entry, so the reveal order leaves it out
+    function proveOmission(
+        SettlementLeaf memory prev,
+        bytes32[] memory prevProof,
+        SettlementLeaf memory entry,
+        bytes32[] memory proof,
+        address omitted
+    ) external {
+        _verifyAdjacent(prev, prevProof, entry, proof);
+
+        (bool exists, , uint256 maxPrice, bool valid) = _revealBid(omitted);
+        require(exists, "Invalid bid");
+        require(
+            (entry.index == 0 || _ranksBefore(prev.valid, prev.maxPrice, prev.bidder, valid, maxPrice, omitted))
+                && _ranksBefore(valid, maxPrice, omitted, entry.valid, entry.maxPrice, entry.bidder),
+            "Bid not omitted"
+        );
+
+        _rejectSettlement(msg.sender);
+    }
 
-                    // maxPrice becomes the total amount bid
-                    currentResult.maxPrice = currentResult.totalBid;
+    // Proves that the running result of the last entry doesn't give the proposed result
+    function proveWrongResult(SettlementLeaf memory last, bytes32[] memory proof) external {
+        require(last.index + 1 == bidCount && _verifyLeaf(last, proof), "Invalid proof");
+        Result memory finalResult = _finalResult(Result(last.resultMaxPrice, last.resultTotalBid));
+        require(finalResult.maxPrice != proposal.maxPrice || finalResult.totalBid != proposal.totalBid, "Result is valid");
 
-                }
+        _rejectSettlement(msg.sender);
+    }
 
-                results[msg.sender] = currentResult;
-                resultSubmitter = msg.sender;
+    // Whoever missed their response deadline loses the dispute and their bond, a challenger who used up
+    // their leaf requests has RESPONSE_PERIOD after the last opened leaf to prove their claim
+    function resolveTimeout() external {
+        require(dispute.challenger != address(0), "No dispute");
+        require(block.timestamp > dispute.deadline, "Response period not over");
 
-                // TODO here: (1) Create a DAO with maxPrice shares (2) Send maxPrice funds there
-                votesToken = address(new ERC20PresetFixedSupply("DAOVotes", "DAO", currentResult.maxPrice, address(this)));
+        if (dispute.proposerTurn) {
+            _rejectSettlement(dispute.challenger);
+        } else {
+            address challenger = dispute.challenger;
+            delete dispute;
+            // A dispute opened late in the challenge period and left to time out would otherwise lock out
+            // everyone else, so at least RESPONSE_PERIOD remains to open the next one
+            if (proposal.proposedAt + CHALLENGE_PERIOD < block.timestamp + RESPONSE_PERIOD) {
+                proposal.proposedAt = uint64(block.timestamp + RESPONSE_PERIOD - CHALLENGE_PERIOD);
             }
+            _sendEth(proposal.proposer, SETTLEMENT_BOND);
+            emit ChallengeRejected(challenger);
         }
+    }
 
+    function finalizeSettlement() external {
+        require(proposal.proposer != address(0), "No settlement proposed");
+        require(dispute.challenger == address(0), "Settlement disputed");
+        require(block.timestamp >= proposal.proposedAt + CHALLENGE_PERIOD, "Challenge period not over");
+
+        Proposal memory settled = proposal;
+        delete proposal;
+        // revealAllBids may have finalized in the meantime, the bond is returned either way
+        if (resultSubmitter == address(0)) {
+            _finalize(settled.proposer, Result(settled.maxPrice, settled.totalBid));
+        }
+        _sendEth(settled.proposer, SETTLEMENT_BOND);
+    }
+
+    // Decrypted values and validity of a bid, as revealAllBids computes them
+    function _revealBid(address bidder) internal returns (bool exists, uint256 bidAmount, uint256 maxPrice, bool valid) {
+        (exists, bidAmount, maxPrice) = _decryptBid(bidder, masterSecretKey);
+        valid = exists && bidAmount <= maxPrice && bidAmount <= lockedEth[bidder];
+    }
+
+    // Whether bid a comes strictly before bid b in the order revealAllBids enforces
+    function _ranksBefore(
+        bool aValid, uint256 aMaxPrice, address a, bool bValid, uint256 bMaxPrice, address b
+    ) internal pure returns (bool) {
+        if (aValid != bValid) return aValid;
+        if (aValid && aMaxPrice != bMaxPrice) return aMaxPrice > bMaxPrice;
+        return a > b;
+    }
+
+    // Leaves are padded to a power of two with zero hashes, the proof length fixes the tree depth
+    function _verifyLeaf(SettlementLeaf memory leaf, bytes32[] memory proof) internal view returns (bool) {
+        require(proposal.proposer != address(0), "No settlement proposed");
+
+        uint256 depth = 0;
+        while ((1 << depth) < bidCount) depth++;
+        if (leaf.index >= bidCount || proof.length != depth) return false;
+
+        bytes32 node = keccak256(abi.encode(leaf));
+        uint256 position = leaf.index;
+        for (uint256 i = 0; i < depth; i++) {
+            node = (position & 1) == 0 ? keccak256(abi.encodePacked(node, proof[i])) : keccak256(abi.encodePacked(proof[i], node));
+            position >>= 1;
+        }
+        return node == proposal.root;
+    }
+
+    function _verifyAdjacent(
+        SettlementLeaf memory prev,
+        bytes32[] memory prevProof,
+        SettlementLeaf memory entry,
+        bytes32[] memory proof
+    ) internal view {
+        require(_verifyLeaf(entry, proof), "Invalid proof");
+        if (entry.index == 0) {
+            // The first entry starts from an empty result
+            prev.resultMaxPrice = 0;
+            prev.resultTotalBid = 0;
+        } else {
+            require(prev.index + 1 == entry.index && _verifyLeaf(prev, prevProof), "Invalid proof");
+        }
+    }
+
+    // The proposer's bond goes to beneficiary, a challenger in a dispute gets their own bond back
+    function _rejectSettlement(address beneficiary) internal {
+        address challenger = dispute.challenger;
+        delete proposal;
+        delete dispute;
+
+        if (challenger != address(0)) _sendEth(challenger, SETTLEMENT_BOND);
+        _sendEth(beneficiary, SETTLEMENT_BOND);
+        emit SettlementRejected(beneficiary);
+    }
+
+    function _sendEth(address recipient, uint256 amount) internal {
+        require(_trySendEth(recipient, amount), "Failed to send Ether");
+    }
+
+    function _trySendEth(address recipient, uint256 amount) internal returns (bool success) {
+        (success, ) = recipient.call{value: amount}("");
     }
 
     // Optional, withdraw to an address
@@ -328,14 +658,40 @@ contract DAODutchAuction is BN128, Encryption {
         // TODO: If auctoin expired and masterPrivateKey doesn't match masterPublicKey, abort aucton. Let user withdraw all funds
         require(resultSubmitter != address(0), "Auction not final");
 
+        require(_payout(recipient, results[resultSubmitter], votesToken, masterSecretKey), "Failed to send Ether");
+    }
+
+    // Pays out every recipient in one call, recipients with no ETH locked (already paid) are skipped. A
+    // recipient without a bid or that rejects the ETH is skipped with WithdrawalSkipped, the others are paid
+    function withdrawMany(address[] memory recipients) external {
+        require(resultSubmitter != address(0), "Auction not final");
+
+        // Read once for the whole batch
         Result memory result = results[resultSubmitter];
+        address token = votesToken;
+        uint256 secretKey = masterSecretKey;
+
+        for (uint256 i = 0; i < recipients.length; i++) {
+            address recipient = recipients[i];
+            if (lockedEth[recipient] == 0) continue;
+            if (
+                bids[recipient].bidderPublicKey == 0 ||
+                !_payout(recipient, result, token, secretKey)
+            ) emit WithdrawalSkipped(recipient);
+        }
+    }
 
+    // Returns false, leaving lockedEth and the votes tokens untouched, if recipient rejects the ETH
+    function _payout(
+        address recipient,
+        Result memory result,
+        address token,
+        uint256 secretKey
+    ) internal returns (bool) {
         uint256 ethRefund = lockedEth[recipient];
 
-        Bid memory userBid = bids[recipient];
-        require(userBid.bidderPublicKey[0] != 0, "Bid does not exist");
-
-        (uint256 bidAmount, uint256 maxPrice) = _decryptBid(userBid);
+        (bool exists, uint256 bidAmount, uint256 maxPrice) = _decryptBid(recipient, secretKey);
+        require(exists, "Bid does not exist");
 
         // Clear this out first
         lockedEth[recipient] = 0;
@@ -343,18 +699,18 @@ contract DAODutchAuction is BN128, Encryption {
         // If bid invalid (amount greater than bidder maxPrice, maxPrice less than result max, or bidAmount greater than locked ETH)
         // Return all ETH
         if (bidAmount > maxPrice || maxPrice < result.maxPrice || bidAmount > ethRefund) {
-            (bool success, ) = recipient.call{value: ethRefund}("");
-            require(success, "Failed to send Ether");
+            if (_trySendEth(recipient, ethRefund)) return true;
         } else {
-            ethRefund = ethRefund - bidAmount * result.maxPrice / result.totalBid;
             uint256 tokenShares = bidAmount * result.maxPrice / result.totalBid;
-
-            (bool success, ) = recipient.call{value: ethRefund}("");
-            require(success, "Failed to send Ether");
-
-            // Send votes tokens
-            ERC20PresetFixedSupply(votesToken).transfer(recipient, tokenShares);
+            if (_trySendEth(recipient, ethRefund - tokenShares)) {
+                // Send votes tokens
+                ERC20PresetFixedSupply(token).transfer(recipient, tokenShares);
+                return true;
+            }
         }
+
+        lockedEth[recipient] = ethRefund;
+        return false;
     }
   
     // TODO: use challenge/response period instead
@@ -0,0 +1,12 @@
+// SPDX-License-Identifier: UNLICENSED
+
+pragma solidity 0.8.17;
+
+import "./DAODutchAuction.sol";
+
+// Test helper: a bidder without receive or fallback, so every ETH transfer to it fails
+contract RejectingBidder {
+    function bid(DAODutchAuction auction, uint256 encryptedBidAmount, uint256 encryptedMaxPrice, uint256 publicKey) external payable {
+        auction.bidCompressed{value: msg.value}(encryptedBidAmount, encryptedMaxPrice, publicKey);
+    }
+}
@@ -0,0 +1,20 @@
+from autobid import NonceManager
+
+ADDRESS = "0x%040x" % 1
+
+
+def test_released_nonces_are_reused():
+    nonces = NonceManager()
+    # Seeded as if the node had reported a pending count of 5
+    nonces.nonces[ADDRESS] = 5
+    assert [nonces.next(ADDRESS) for _ in range(3)] == [5, 6, 7]
+
+    # The last nonce handed out is taken back, earlier ones fill their gap before new nonces
+    nonces.release(ADDRESS, 7)
+    nonces.release(ADDRESS, 5)
+    assert [nonces.next(ADDRESS) for _ in range(3)] == [5, 7, 8]
+
+    # Without a cached nonce the next one comes from the node again
+    nonces.release(ADDRESS, 6)
+    nonces.resync(ADDRESS)
+    assert ADDRESS not in nonces.nonces and ADDRESS not in nonces.released
@@ -0,0 +1,120 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+from web3.providers import IPCProvider, WebsocketProvider
+
+import client
+import profiling
+from client import PooledHTTPProvider, batch_request, configure, make_provider, web3
+
+
+class StandInNode(BaseHTTPRequestHandler):
+    """ Answers eth_blockNumber and eth_chainId, failing the first `failures` requests with a 503
+    """
+    failures = 0
+    requests_seen = 0
+
+    def do_POST(self):
+        cls = type(self)
+        cls.requests_seen += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if cls.failures:
+            cls.failures -= 1
+            self.send_response(503)
+            self.end_headers()
+            return
+
+        results = {"eth_blockNumber": "0x2a", "eth_chainId": "0x539"}
+        if isinstance(body, list):
+            payload = [{"jsonrpc": "2.0", "id": r["id"], "result": results.get(r["method"])} for r in reversed(body)]
+        else:
+            payload = {"jsonrpc": "2.0", "id": body["id"], "result": results.get(body["method"])}
+
+        data = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in_node(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInNode)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    StandInNode.failures = 0
+    StandInNode.requests_seen = 0
+    monkeypatch.setattr(client, "RETRY_BACKOFF", 0)
+    previous_provider = web3.provider
+    configure(f"http://127.0.0.1:{server.server_address[1]}")
+
+    yield StandInNode
+
+    web3.provider = previous_provider
+    server.shutdown()
+    server.server_close()
+
+
+def test_make_provider(monkeypatch):
+    assert isinstance(make_provider("http://127.0.0.1:8545"), PooledHTTPProvider)
+    assert isinstance(make_provider("wss://node.example:8546"), WebsocketProvider)
+    assert isinstance(make_provider("/tmp/geth.ipc"), IPCProvider)
+
+    monkeypatch.setenv("WEB3_PROVIDER_URI", "http://127.0.0.1:9545")
+    assert make_provider().endpoint_uri == "http://127.0.0.1:9545"
+
+
+def test_reads_are_retried(stand_in_node):
+    stand_in_node.failures = 2
+    assert web3.eth.block_number == 42
+    assert stand_in_node.requests_seen == 3
+
+    stand_in_node.failures = client.MAX_RETRIES + 1
+    with pytest.raises(requests.HTTPError):
+        web3.eth.block_number
+
+
+def test_writes_are_not_retried(stand_in_node):
+    stand_in_node.failures = 1
+    with pytest.raises(requests.HTTPError):
+        web3.eth.send_raw_transaction("0x00")
+    assert stand_in_node.requests_seen == 1
+
+
+def test_batch_request_over_pooled_session(stand_in_node):
+    stand_in_node.failures = 1
+    responses = batch_request([("eth_blockNumber", []), ("eth_chainId", []), ("eth_blockNumber", [])])
+    assert [response["result"] for response in responses] == ["0x2a", "0x539", "0x2a"]
+    assert stand_in_node.requests_seen == 2
+
+
+def test_profiling(stand_in_node, tmp_path, capsys):
+    trace_path = str(tmp_path / "trace.json")
+    profiling.enable(trace_path)
+    try:
+        web3.eth.block_number
+        batch_request([("eth_blockNumber", []), ("eth_call", [{"to": "0x" + "11" * 20, "data": "0xdeadbeef"}, "latest"])])
+        profiling.timed("crypto")(lambda: None)()
+    finally:
+        profiling.finish()
+
+    assert profiling._timings[("rpc", "eth_blockNumber")][0] == 2
+    assert profiling._timings[("rpc", "eth_call")][0] == 1
+    # Unknown selectors are reported as is
+    assert profiling._timings[("contract", "0xdeadbeef")][0] == 1
+    assert profiling._timings[("crypto", "<lambda>")][0] == 1
+    assert "eth_blockNumber" in capsys.readouterr().out
+    with open(trace_path) as f:
+        assert len(json.load(f)["traceEvents"]) == 5
+
+    # Nothing is recorded once profiling is off
+    web3.eth.block_number
+    assert profiling._timings[("rpc", "eth_blockNumber")][0] == 2
@@ -0,0 +1,152 @@
+import pytest
+
+from crypto import CURVE_ORDER, FIELD_MODULUS, G1, Z1, add, multiply, multiply_g1, normalize, random_scalar
+from crypto import compress_point, decompress_point
+from crypto import multi_scalar_multiply, sum_points
+from crypto import dleq, dleq_verify, dleq_verify_batch, encrypt
+from crypto import bid_commitment, bulk_ecdh, keccak, point_from_affine, symmetric_key
+from bidder import EncryptedBid, decrypt_bid_values, prove_decryptions, verify_decryptions
+from bidder import UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE
+
+
+def test_multiply_g1():
+    scalars = [0, 1, 2, 255, 256, 2 ** 64 - 1, CURVE_ORDER - 1, CURVE_ORDER, CURVE_ORDER + 7]
+    scalars += [random_scalar() for _ in range(20)]
+    for scalar in scalars:
+        assert normalize(multiply_g1(scalar)) == normalize(multiply(G1, scalar % CURVE_ORDER))
+
+
+def test_multi_scalar_multiply():
+    # Straus below the Pippenger threshold and buckets above it
+    for count in [1, 3, 10, 100]:
+        points = [multiply_g1(random_scalar()) for _ in range(count)]
+        scalars = [random_scalar() for _ in range(count)]
+        if count >= 10:
+            points[1], points[2] = Z1, points[3]
+            scalars[0], scalars[4] = 0, -5
+
+        expected = Z1
+        for point, scalar in zip(points, scalars):
+            expected = add(expected, multiply(point, scalar % CURVE_ORDER))
+        assert normalize(multi_scalar_multiply(points, scalars)) == normalize(expected)
+
+    point = multiply_g1(7)
+    assert normalize(multi_scalar_multiply([point, point], [3, CURVE_ORDER - 3])) == normalize(Z1)
+
+
+def test_sum_points():
+    scalars = [random_scalar() for _ in range(5)]
+    assert normalize(sum_points(multiply_g1(k) for k in scalars)) == normalize(multiply_g1(sum(scalars)))
+
+
+def test_bulk_ecdh():
+    scalar = random_scalar()
+    points = [tuple(int(v) for v in normalize(multiply_g1(random_scalar()))) for _ in range(10)]
+    points[3] = (0, 0)
+
+    shared = bulk_ecdh(points, scalar)
+    assert shared[3] == (0, 0)
+    for point, shared_point in zip(points, shared):
+        if point != (0, 0):
+            assert shared_point[0] == symmetric_key(point_from_affine(point), scalar)
+            assert shared_point == tuple(int(v) for v in normalize(multiply(point_from_affine(point), scalar)))
+
+    assert bulk_ecdh(points[:2], 0) == [(0, 0), (0, 0)]
+    assert bulk_ecdh(points[:2], CURVE_ORDER + 1) == points[:2]
+
+
+def test_point_compression():
+    for _ in range(20):
+        point = tuple(int(v) for v in normalize(multiply_g1(random_scalar())))
+        compressed = compress_point(point)
+        assert compressed >> 255 == point[1] & 1
+        assert decompress_point(compressed) == point
+        # The negated point only differs in the parity bit
+        assert decompress_point(compressed ^ 1 << 255) == (point[0], FIELD_MODULUS - point[1])
+
+    # 4 ** 3 + 3 is not a square, x = FIELD_MODULUS is out of range
+    assert decompress_point(4) is None
+    assert decompress_point(FIELD_MODULUS) is None
+
+
+def test_dleq_verify_batch():
+    proofs = []
+    for _ in range(6):
+        alpha = random_scalar()
+        x2 = multiply_g1(random_scalar())
+        y1, y2 = multiply_g1(alpha), multiply(x2, alpha)
+        proofs.append((G1, y1, x2, y2) + dleq(G1, y1, x2, y2, alpha))
+
+    assert dleq_verify_batch(proofs) == [True] * 6
+
+    proofs[1] = proofs[1][:5] + ((proofs[1][5] + 1) % CURVE_ORDER,)
+    proofs[4] = proofs[4][:3] + (multiply_g1(5),) + proofs[4][4:]
+    assert dleq_verify_batch(proofs) == [dleq_verify(*proof) for proof in proofs]
+    assert dleq_verify_batch(proofs) == [True, False, True, True, False, True]
+
+
+def test_decryption_proofs():
+    master_private_key = random_scalar()
+    master_public_key = tuple(int(v) for v in normalize(multiply_g1(master_private_key)))
+
+    encrypted_bids = []
+    for index in range(3):
+        bidder_private_key = random_scalar()
+        x, y = normalize(multiply_g1(bidder_private_key))
+        sym_key = int(normalize(multiply(multiply_g1(master_private_key), bidder_private_key))[0])
+        bidder = "0x%040x" % (index + 1)
+        encrypted_bids.append(EncryptedBid(bidder, encrypt(10 + index, sym_key), encrypt(20 + index, sym_key), (int(x), int(y))))
+
+    proofs = prove_decryptions(encrypted_bids, master_private_key)
+    revealed = verify_decryptions(encrypted_bids, master_public_key, proofs)
+    assert [(bid.bid_amount, bid.max_price) for bid in revealed] == [(10, 20), (11, 21), (12, 22)]
+
+    proofs[1].shared_key = tuple(int(v) for v in normalize(multiply_g1(1)))
+    with pytest.raises(Exception, match=encrypted_bids[1].bidder):
+        verify_decryptions(encrypted_bids, master_public_key, proofs)
+
+
+def test_bid_commitments():
+    master_private_key = random_scalar()
+
+    encrypted_bids = []
+    for index in range(3):
+        bidder_private_key = random_scalar()
+        x, y = normalize(multiply_g1(bidder_private_key))
+        sym_key = int(normalize(multiply(multiply_g1(master_private_key), bidder_private_key))[0])
+        # The first bid isn't committed. The third is encrypted under a salt of the bidder's choosing and
+        # commits to it, its commitment opens against its ciphertexts but not against its decryption
+        salt = sym_key + index // 2
+        commitment = bid_commitment(10 + index, 20 + index, salt) if index else None
+        bidder = "0x%040x" % (index + 1)
+        encrypted_bids.append(EncryptedBid(bidder, encrypt(10 + index, salt), encrypt(20 + index, salt), (int(x), int(y)), commitment))
+
+    revealed = decrypt_bid_values(encrypted_bids, master_private_key)
+    assert [(bid.bid_amount, bid.max_price) for bid in revealed[:2]] == [(10, 20), (11, 21)]
+    # A commitment that doesn't match the decrypted values is an invalid bid, as on chain
+    assert (revealed[2].bid_amount, revealed[2].max_price) == (UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE)
+
+    # keccak256(abi.encode(bidAmount, maxPrice, salt)) hashes three 32 byte words
+    assert bid_commitment(1, 2, 3) == bytes(keccak(b"".join(value.to_bytes(32, "big") for value in (1, 2, 3))))
+
+
+def test_undecryptable_bid():
+    master_private_key = random_scalar()
+    bidder_private_key = random_scalar()
+    x, y = normalize(multiply_g1(bidder_private_key))
+    sym_key = int(normalize(multiply(multiply_g1(master_private_key), bidder_private_key))[0])
+
+    # The indexer keeps keys that are not on the curve as (compressed key, 0)
+    encrypted_bids = [
+        EncryptedBid("0x%040x" % 1, encrypt(10, sym_key), encrypt(20, sym_key), (int(x), int(y))),
+        EncryptedBid("0x%040x" % 2, encrypt(10, sym_key), encrypt(20, sym_key), (4, 0)),
+    ]
+    valid, undecryptable = decrypt_bid_values(encrypted_bids, master_private_key)
+    assert (valid.bid_amount, valid.max_price) == (10, 20)
+    assert (undecryptable.bid_amount, undecryptable.max_price) == (UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE)
+
+    # Decryption proofs skip it, it is invalid without one
+    proofs = prove_decryptions(encrypted_bids, master_private_key)
+    assert [proof.bidder for proof in proofs] == [valid.bidder]
+    master_public_key = tuple(int(v) for v in normalize(multiply_g1(master_private_key)))
+    assert verify_decryptions(encrypted_bids, master_public_key, proofs) == [valid, undecryptable]
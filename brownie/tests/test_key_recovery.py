@@ -1,9 +1,26 @@
+import dataclasses
+import pytest
+from hexbytes import HexBytes
 from random import randrange
 
-from brownie import web3, TestERC20
-from bidder import generate_bidders, decrypt_bids, get_all_bids, rank_bid_result
+from brownie import accounts, chain, reverts, web3, RejectingBidder, TestERC20
+from bidder import generate_bidders, decrypt_bids, decrypt_bid_values, get_all_bids, rank_bid_result
+from bidder import derive_master_private_key, auctioneers as bidder_auctioneers
+from bidder import UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE
+from client import batch_call
+from contracts import DAODutchAuction
+from web3.exceptions import ContractLogicError
+from autobid import read_bids, submit_bids
+from accounts import MAX_ACCOUNTS, get_account, get_mnemonic
+from indexer import BidIndexer
+from monitor import AuctionMonitor
+from optimistic import MerkleTree, SettlementChallenger, SettlementProposer, compute_leaves, next_result, propose_settlement
+from report import payout_rows, reconcile, write_report
+from settlement import FINALIZE_GAS, ZERO_ADDRESS, resume_index, submit_reveal, submit_withdrawals
 from crypto import G1, normalize, multiply
 from crypto import symmetric_key_2D, generate_keypair
+from crypto import symmetric_key, point_from_affine, encrypt, compress_point, decompress_point, bid_commitment
+from crypto import share_secret, verify_share, verify_shares
 
 def test_key_recovery(dao_dutch_auction, auctioneers):
     print('Dutch auction', dao_dutch_auction)
@@ -83,8 +100,8 @@ def test_bidding(dao_dutch_auction, auctioneers):
 
     # decrypt bids and verify
     sym_key = bidder.get_sym_key()
-    bid_amount = dao_dutch_auction.decrypt(active_bid[1], sym_key)
-    max_price = dao_dutch_auction.decrypt(active_bid[2], sym_key)
+    bid_amount = dao_dutch_auction.decrypt(active_bid[0], sym_key)
+    max_price = dao_dutch_auction.decrypt(active_bid[1], sym_key)
     assert bid_amount == bidder.bid_amount
     assert max_price == bidder.max_price
     print(get_all_bids(dao_dutch_auction.address))
@@ -191,3 +208,680 @@ def test_randomized_bids(dao_dutch_auction, auctioneers):
         print("vote balance", votes_token.balanceOf(bidder.account.address))
 
     print("total vote balance", votes_token.balanceOf(dao_dutch_auction.address))
+
+
+def test_local_decryption(dao_dutch_auction, auctioneers):
+    # Set public keys
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 5)
+    for bidder in bidders:
+        max_price = randrange(1, 1000000)
+        bid_amount = randrange(0, max_price)
+        bidder.bid(bid_amount, max_price, bid_amount)
+
+    # Set private key
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    master_secret_key = dao_dutch_auction.masterSecretKey()
+    encrypted_bids = get_all_bids(dao_dutch_auction.address)
+    local_bids = decrypt_bid_values(encrypted_bids, master_secret_key)
+
+    for enc_bid, local_bid in zip(encrypted_bids, local_bids):
+        sym_key = dao_dutch_auction._sharedKey.call(enc_bid.bidder_public_key)
+        assert symmetric_key(point_from_affine(enc_bid.bidder_public_key), master_secret_key) == sym_key
+        assert local_bid.bid_amount == dao_dutch_auction.decrypt(enc_bid.encrypted_bid_amount, sym_key)
+        assert local_bid.max_price == dao_dutch_auction.decrypt(enc_bid.encrypted_max_price, sym_key)
+        assert encrypt(local_bid.bid_amount, sym_key) == dao_dutch_auction.encrypt(local_bid.bid_amount, sym_key)
+
+    assert decrypt_bids(dao_dutch_auction.address, local=True) == decrypt_bids(dao_dutch_auction.address)
+
+
+def test_local_master_key_recovery(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    private_keys = [a.private_key for a in auctioneers]
+    master_private_key = derive_master_private_key(dao_dutch_auction.address, private_keys)
+
+    # 2-of-4 sharing of the same master key
+    indices = list(range(1, len(auctioneers) + 1))
+    shares, commitments = share_secret(master_private_key, indices, 1)
+    assert verify_shares(shares, commitments)
+    assert all(verify_share(j, s_ij, commitments) for j, s_ij in shares.items())
+    assert derive_master_private_key(dao_dutch_auction.address, {j: shares[j] for j in indices[:2]}) == master_private_key
+
+    shares[indices[0]] += 1
+    assert not verify_shares(shares, commitments)
+    with pytest.raises(Exception):
+        derive_master_private_key(dao_dutch_auction.address, private_keys[1:])
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    assert dao_dutch_auction.masterSecretKey() == master_private_key
+
+
+def test_bid_indexer(dao_dutch_auction, auctioneers, tmp_path):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 3)
+    for bidder in bidders:
+        bidder.bid(1000, 2000, 1000)
+
+    db_path = str(tmp_path / "bids.sqlite")
+    indexer = BidIndexer(dao_dutch_auction.address, db_path)
+    assert indexer.sync() == 3
+    indexer.close()
+
+    # Rebid, only the new block is scanned and the last bid per bidder is kept
+    bidders[0].bid(1500, 3000, 1000)
+    indexer = BidIndexer(dao_dutch_auction.address, db_path)
+    assert indexer.sync() == 1
+
+    indexed_bids = indexer.bids()
+    assert len(indexed_bids) == 3
+    for bid in indexed_bids:
+        on_chain_bid = dao_dutch_auction.bids(bid.bidder)
+        assert bid.encrypted_bid_amount == on_chain_bid[0]
+        assert bid.encrypted_max_price == on_chain_bid[1]
+        assert list(bid.bidder_public_key) == list(dao_dutch_auction.getBidderPublicKey(bid.bidder))
+
+    assert indexer.sync() == 0
+
+
+def test_batch_call(dao_dutch_auction, auctioneers):
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    calls = [contract.functions.auctioneers(i) for i in range(len(auctioneers) + 1)]
+
+    assert batch_call(calls[:-1]) == [a.address for a in auctioneers]
+    assert batch_call(calls, allow_failure=True)[-1] is None
+    with pytest.raises(ContractLogicError):
+        batch_call(calls)
+
+    assert bidder_auctioneers(dao_dutch_auction.address) == [a.address for a in auctioneers]
+
+
+def test_chunked_reveal(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 12)
+    for bidder in bidders:
+        max_price = randrange(1, 1000000)
+        bid_amount = randrange(0, max_price)
+        bidder.bid(bid_amount, max_price, randrange(0, bid_amount * 2 + 1), skip_assertions=True)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    result = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    bidder_addrs = [bid.bidder for bid in result.ordered_bids]
+    submitter = auctioneers[0].address
+
+    # Partial reveal, as left behind by a crashed run
+    dao_dutch_auction.revealAllBids(bidder_addrs[:5], {"from": submitter})
+
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    assert resume_index(contract, bidder_addrs, submitter) == 5
+
+    single_gas = contract.functions.revealAllBids(bidder_addrs[5:6]).estimateGas({"from": submitter})
+    submission = submit_reveal(contract, bidder_addrs, submitter, gas_budget=single_gas * 4 + FINALIZE_GAS)
+    assert len(submission.receipts) > 1
+    assert (submission.sent, submission.skipped, submission.reset) == (len(bidder_addrs) - 5, 5, False)
+
+    (realized_price, total_bid) = dao_dutch_auction.results(submitter)
+    assert realized_price == result.realized_price
+    assert total_bid == result.total_bid
+    assert dao_dutch_auction.resultSubmitter() == submitter
+
+
+# Marginal revealAllBids gas per bid, by opcode costs: five cold SLOADs (the bid's four slots and its
+# locked ETH, 10.5k), the ecMul (6k) and modexp (1.35k) precompiles and a keccak, about 20k. Decrypting
+# each bid twice and pushing it to storage came to about 55k. Estimates, not measured with solc 0.8.17
+MAX_REVEAL_GAS_PER_BID = 25000
+
+
+def test_reveal_gas_per_bid(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 16)
+    for bidder in bidders:
+        max_price = randrange(1, 1000000)
+        bid_amount = randrange(0, max_price)
+        bidder.bid(bid_amount, max_price, randrange(0, bid_amount * 2 + 1), skip_assertions=True)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    result = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    bidder_addrs = [bid.bidder for bid in result.ordered_bids]
+    submitter = auctioneers[0].address
+
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    single_gas = contract.functions.revealAllBids(bidder_addrs[:1]).estimateGas({"from": submitter})
+    chunk_gas = contract.functions.revealAllBids(bidder_addrs[:9]).estimateGas({"from": submitter})
+    gas_per_bid = (chunk_gas - single_gas) / 8
+    print("revealAllBids gas per bid", gas_per_bid)
+    assert gas_per_bid < MAX_REVEAL_GAS_PER_BID
+
+    # Ordering state carries over between chunks
+    dao_dutch_auction.revealAllBids(bidder_addrs[:7], {"from": submitter})
+    assert resume_index(contract, bidder_addrs, submitter) == 7
+    dao_dutch_auction.revealAllBids(bidder_addrs[7:], {"from": submitter})
+
+    (realized_price, total_bid) = dao_dutch_auction.results(submitter)
+    assert realized_price == result.realized_price
+    assert total_bid == result.total_bid
+    assert dao_dutch_auction.resultSubmitter() == submitter
+
+
+# Gas a commitment adds to each revealed bid, by opcode costs: the keccak over three words and its
+# memory, about 100. Not measured, no solc 0.8.17 build was available
+MAX_COMMITMENT_CHECK_GAS = 500
+
+
+def test_committed_bids(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    # The first 10 bids are committed and have the highest max prices, so they are revealed first
+    bidders = generate_bidders(dao_dutch_auction.address, 17)
+    for index, bidder in enumerate(bidders[:16]):
+        bidder.bid(index + 1, 10 ** 6 - index, 10 ** 5, skip_assertions=True, commit=index < 10)
+
+    # The last bid is encrypted under a salt of the bidder's choosing and commits to it. Its commitment
+    # opens against its ciphertexts, but decryption with the shared key doesn't match it, so it is invalid
+    bad_bidder = bidders[16]
+    salt = bad_bidder.get_sym_key() + 1
+    bad_bidder.contract.functions.bidCompressed(
+        encrypt(1, salt), encrypt(10 ** 7, salt), compress_point(normalize(bad_bidder.public_key)),
+        bid_commitment(1, 10 ** 7, salt),
+    ).transact({"value": 10 ** 5, "from": bad_bidder.account.address})
+
+    enc_bids = get_all_bids(dao_dutch_auction.address)
+    assert [bool(bid.commitment) for bid in enc_bids] == [True] * 10 + [False] * 6 + [True]
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    dec_bids = decrypt_bids(dao_dutch_auction.address, local=True)
+    result = rank_bid_result(dao_dutch_auction.address, dec_bids)
+    bidder_addrs = [bid.bidder for bid in result.ordered_bids]
+    assert bidder_addrs[16] == bad_bidder.account.address
+    assert (result.ordered_bids[16].bid_amount, result.ordered_bids[16].max_price) == (
+        UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE
+    )
+    submitter = auctioneers[0].address
+
+    # Committed bids are decrypted like any other, checking the commitment adds a keccak over three words
+    contract = DAODutchAuction(dao_dutch_auction.address)
+
+    def reveal_gas_per_bid(chunk):
+        single_gas = contract.functions.revealAllBids(chunk[:1]).estimateGas({"from": submitter})
+        chunk_gas = contract.functions.revealAllBids(chunk).estimateGas({"from": submitter})
+        return (chunk_gas - single_gas) / (len(chunk) - 1)
+
+    committed_gas = reveal_gas_per_bid(bidder_addrs[:6])
+    uncommitted_gas = reveal_gas_per_bid(bidder_addrs[10:16])
+    print("revealAllBids gas per bid committed", committed_gas, "uncommitted", uncommitted_gas)
+    assert committed_gas < MAX_REVEAL_GAS_PER_BID
+    assert abs(committed_gas - uncommitted_gas) < MAX_COMMITMENT_CHECK_GAS
+
+    # An honest proposal lists the bad bid as invalid, and that entry can't be disputed
+    leaves = compute_leaves(dao_dutch_auction.address, bids=dec_bids)
+    assert not leaves[16].valid
+    propose_settlement(dao_dutch_auction.address, submitter, leaves)
+    tree = MerkleTree(leaves)
+    with reverts("Entry is valid"):
+        dao_dutch_auction.proveInvalidEntry(
+            dataclasses.astuple(leaves[15]), tree.proof(15), dataclasses.astuple(leaves[16]), tree.proof(16),
+            {"from": auctioneers[1].address},
+        )
+
+    submit_reveal(contract, bidder_addrs, submitter)
+    (realized_price, total_bid) = dao_dutch_auction.results(submitter)
+    assert realized_price == result.realized_price
+    assert total_bid == result.total_bid
+
+    dao_dutch_auction.withdrawTo(bidder_addrs[0], {"from": submitter})
+    votes_token = TestERC20.at(dao_dutch_auction.votesToken())
+    assert votes_token.balanceOf(bidder_addrs[0]) == result.ordered_bids[0].bid_amount * realized_price // total_bid
+
+    # Refunded in full, without votes tokens
+    balance = web3.eth.get_balance(bad_bidder.account.address)
+    dao_dutch_auction.withdrawTo(bad_bidder.account.address, {"from": submitter})
+    assert web3.eth.get_balance(bad_bidder.account.address) == balance + 10 ** 5
+    assert votes_token.balanceOf(bad_bidder.account.address) == 0
+
+
+def test_withdraw_many(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    # Every third bid locks less than its bid amount and is refunded, every second one is committed
+    bidders = generate_bidders(dao_dutch_auction.address, 12)
+    for index, bidder in enumerate(bidders):
+        bidder.bid(1000 + index, 10 ** 6, 500 if index % 3 == 0 else 2000, skip_assertions=True, commit=index % 2 == 1)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    dec_bids = decrypt_bids(dao_dutch_auction.address, local=True)
+    result = rank_bid_result(dao_dutch_auction.address, dec_bids)
+    submitter = auctioneers[0].address
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    submit_reveal(contract, [bid.bidder for bid in result.ordered_bids], submitter)
+    expected = {row.bidder: row for row in payout_rows(dao_dutch_auction.address)}
+
+    # Paid on their own first, the batches skip them
+    recipients = [bidder.account.address for bidder in bidders]
+    dao_dutch_auction.withdrawTo(recipients[0], {"from": submitter})
+
+    individual_gas = sum(
+        contract.functions.withdrawTo(recipient).estimateGas({"from": submitter})
+        for recipient in recipients[1:]
+    )
+    submission = submit_withdrawals(contract, recipients, submitter, gas_budget=400000)
+    assert len(submission.receipts) > 1
+    assert (submission.sent, submission.skipped, submission.unpaid) == (len(recipients) - 1, 1, [])
+    batched_gas = submission.gas_used
+    print("withdrawal gas individually", individual_gas, "batched", batched_gas)
+    assert batched_gas < individual_gas
+
+    votes_token = TestERC20.at(dao_dutch_auction.votesToken())
+    for recipient in recipients:
+        assert dao_dutch_auction.lockedEth(recipient) == 0
+        assert votes_token.balanceOf(recipient) == expected[recipient].token_shares
+
+    # Everyone is paid, reruns send nothing and a repeated batch doesn't revert
+    assert submit_withdrawals(contract, recipients, submitter).receipts == []
+    dao_dutch_auction.withdrawMany(recipients, {"from": submitter})
+
+
+def test_withdraw_many_skips(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 3)
+    for bidder in bidders:
+        bidder.bid(1000, 10 ** 6, 2000, skip_assertions=True)
+    # A contract that rejects its refund, and an address that locked ETH without bidding
+    rejecting = accounts[0].deploy(RejectingBidder)
+    rejecting.bid(dao_dutch_auction.address, encrypt(100, 1), encrypt(1000, 1), 4, {"from": accounts[0], "value": 200})
+    no_bid = accounts[9]
+    dao_dutch_auction.lockEth({"from": no_bid, "value": 300})
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    result = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    submitter = auctioneers[0].address
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    submit_reveal(contract, [bid.bidder for bid in result.ordered_bids], submitter)
+
+    recipients = [bidders[0].account.address, rejecting.address, no_bid.address, bidders[1].account.address]
+    tx = dao_dutch_auction.withdrawMany(recipients, {"from": submitter})
+    assert [event["recipient"] for event in tx.events["WithdrawalSkipped"]] == [rejecting.address, no_bid.address]
+    assert [dao_dutch_auction.lockedEth(recipient) for recipient in recipients] == [0, 200, 300, 0]
+    assert TestERC20.at(dao_dutch_auction.votesToken()).balanceOf(bidders[1].account.address) > 0
+
+    with reverts("Failed to send Ether"):
+        dao_dutch_auction.withdrawTo(rejecting.address, {"from": submitter})
+    with reverts("Bid does not exist"):
+        dao_dutch_auction.withdrawTo(no_bid.address, {"from": submitter})
+    # submit_withdrawals retries them and reports them as unpaid
+    assert submit_withdrawals(contract, recipients, submitter).unpaid == [rejecting.address, no_bid.address]
+
+
+# A bid writes its ciphertexts and its compressed public key to three new storage slots, the
+# sender and both key coordinates took two more. By opcode costs: 21k base, about 2k calldata, 22.1k
+# for each new slot including locked ETH (88.4k), 2.1k to check for an earlier bid and 2.9k to
+# count it, and 2k for the log, about 118k for an address's first bid where five slots came to
+# about 162k. Estimates, not measured with solc 0.8.17
+MAX_BID_GAS = 140000
+# BidSubmitted data with the compressed key: bidder, two ciphertexts, key and commitment. A full key
+# took a sixth word, 256 gas of log data per bid
+BID_LOG_WORDS = 5
+
+
+def test_compressed_public_keys(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    contract = DAODutchAuction(dao_dutch_auction.address)
+    bidders = generate_bidders(dao_dutch_auction.address, 4)
+    # The first bid also pays for initializing bidCount
+    bidders[3].bid(100, 1000, 200)
+
+    # The full key is checked and compressed on chain, Bidder.bid sends it compressed
+    sym_key = bidders[0].get_sym_key()
+    public_key = [int(v) for v in normalize(bidders[0].public_key)]
+    full_bid = contract.functions.bid(encrypt(100, sym_key), encrypt(1000, sym_key), public_key)
+    full_receipt = web3.eth.wait_for_transaction_receipt(full_bid.transact({"from": bidders[0].account.address, "value": 200}))
+    compressed_receipt = web3.eth.wait_for_transaction_receipt(bidders[1].bid(100, 1000, 200))
+
+    print("bid gas full key", full_receipt["gasUsed"], "compressed", compressed_receipt["gasUsed"])
+    assert compressed_receipt["gasUsed"] < full_receipt["gasUsed"] < MAX_BID_GAS
+    # Both store and emit the compressed key
+    for receipt in (full_receipt, compressed_receipt):
+        assert len(HexBytes(receipt["logs"][0]["data"])) == BID_LOG_WORDS * 32
+
+    for bidder in bidders[:2]:
+        public_key = tuple(int(v) for v in normalize(bidder.public_key))
+        assert tuple(dao_dutch_auction.getBidderPublicKey(bidder.account.address)) == public_key
+        assert decompress_point(compress_point(public_key)) == public_key
+
+    # A key that is not on the curve is only caught at reveal, the bid is invalid and refunded
+    undecryptable = bidders[2].account.address
+    assert decompress_point(4) is None
+    tx_hash = contract.functions.bidCompressed(encrypt(100, 1), encrypt(1000, 1), 4).transact({"from": undecryptable, "value": 200})
+    web3.eth.wait_for_transaction_receipt(tx_hash)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    dec_bids = decrypt_bids(dao_dutch_auction.address, local=True)
+    undecryptable_bid = next(bid for bid in dec_bids if bid.bidder == undecryptable)
+    assert (undecryptable_bid.bid_amount, undecryptable_bid.max_price) == (UNDECRYPTABLE_BID_AMOUNT, UNDECRYPTABLE_MAX_PRICE)
+    # Decrypting through the contract skips the key instead of sending it to bn128_multiply
+    assert decrypt_bids(dao_dutch_auction.address) == dec_bids
+
+    result = rank_bid_result(dao_dutch_auction.address, dec_bids)
+    submitter = auctioneers[0].address
+    submit_reveal(contract, [bid.bidder for bid in result.ordered_bids], submitter)
+    assert tuple(dao_dutch_auction.results(submitter)) == (result.realized_price, result.total_bid)
+
+    balance = web3.eth.get_balance(undecryptable)
+    dao_dutch_auction.withdrawTo(undecryptable, {"from": submitter})
+    assert web3.eth.get_balance(undecryptable) == balance + 200
+    assert TestERC20.at(dao_dutch_auction.votesToken()).balanceOf(undecryptable) == 0
+
+
+def test_bulk_autobid(dao_dutch_auction, auctioneers, tmp_path):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bids_file = tmp_path / "bids.txt"
+    bids_file.write_text("".join(f"0.{i + 1}, 1, 0.5\n" for i in range(10)))
+
+    # Two bids per account exercise the local nonce tracking
+    stats = submit_bids(dao_dutch_auction.address, read_bids(str(bids_file), 5), in_flight=4)
+    assert stats.confirmed == 10
+    assert stats.failed == 0
+    # A later bid replaces an account's earlier one
+    assert dao_dutch_auction.bidCount() == 5
+    assert len(get_all_bids(dao_dutch_auction.address)) == 5
+
+
+def test_local_encryption(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    master_public_key = [dao_dutch_auction.masterPublicKey(0), dao_dutch_auction.masterPublicKey(1)]
+
+    for bidder in generate_bidders(dao_dutch_auction.address, 3):
+        bid_amount = randrange(0, 10 ** 18)
+        max_price = randrange(bid_amount, 10 ** 19)
+        bidder.bid(bid_amount, max_price, bid_amount)
+
+        contract_sym_key = dao_dutch_auction.bn128_multiply.call([master_public_key[0], master_public_key[1], bidder.private_key])[0]
+        assert bidder.get_sym_key() == contract_sym_key
+
+        active_bid = dao_dutch_auction.bids(bidder.account.address)
+        assert active_bid[0] == dao_dutch_auction.encrypt(bid_amount, contract_sym_key)
+        assert active_bid[1] == dao_dutch_auction.encrypt(max_price, contract_sym_key)
+
+
+def test_parallel_bidder_generation():
+    sequential = generate_bidders(ZERO_ADDRESS, 6)
+    parallel = generate_bidders(ZERO_ADDRESS, 6, workers=2)
+
+    assert [b.account.address for b in parallel] == [b.account.address for b in sequential]
+    for bidder in parallel:
+        assert normalize(multiply(G1, bidder.private_key)) == normalize(bidder.public_key)
+
+
+def test_account_derivation():
+    for index in [0, 1, 20, 99]:
+        expected = web3.eth.account.from_mnemonic(get_mnemonic(), account_path=f"m/44'/60'/0'/0/{index}")
+        assert get_account(index).address == expected.address
+        assert get_account(index).key == expected.key
+
+    with pytest.raises(Exception, match="account limit"):
+        get_account(MAX_ACCOUNTS)
+
+
+def test_auction_monitor(dao_dutch_auction, auctioneers):
+    monitor = AuctionMonitor(dao_dutch_auction.address)
+    monitor.poll_once()
+    assert monitor.stats.bid_count == 0
+
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 3)
+    for bidder in bidders:
+        bidder.bid(10 ** 17, 10 ** 18, 2 * 10 ** 17)
+    bidders[0].bid(10 ** 17, 10 ** 18, 10 ** 17)
+
+    assert monitor.poll_once()
+    assert monitor.stats.bid_count == 4
+    assert monitor.stats.locked_wei == 7 * 10 ** 17
+    assert monitor.stats.public_keys_set == len(auctioneers)
+    assert monitor.stats.private_keys_revealed == 0
+    assert monitor.stats.bids_per_block == 1.0
+    assert not monitor.poll_once()
+
+    # Settlement bonds are held by the auction but not locked by bidders
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+    propose_settlement(dao_dutch_auction.address, auctioneers[0].address, compute_leaves(dao_dutch_auction.address))
+    bond = dao_dutch_auction.SETTLEMENT_BOND()
+    dao_dutch_auction.challengeSettlement(0, {"from": auctioneers[1].address, "value": bond})
+    assert web3.eth.get_balance(dao_dutch_auction.address) == 7 * 10 ** 17 + 2 * bond
+    assert monitor.poll_once()
+    assert monitor.stats.locked_wei == 7 * 10 ** 17
+
+
+def test_settlement_report(dao_dutch_auction, auctioneers, tmp_path):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 6)
+    for bidder in bidders:
+        max_price = randrange(1, 10 ** 18)
+        bid_amount = randrange(0, max_price)
+        bidder.bid(bid_amount, max_price, randrange(0, bid_amount * 2 + 1), skip_assertions=True)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    result = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    dao_dutch_auction.revealAllBids([bid.bidder for bid in result.ordered_bids], {"from": auctioneers[0].address})
+    settlement_block = web3.eth.block_number
+
+    # Half of the bidders withdraw before the report is written
+    for bidder in bidders[:3]:
+        dao_dutch_auction.withdraw({"from": bidder.account.address})
+
+    report_path = tmp_path / "report.csv"
+    assert write_report(payout_rows(dao_dutch_auction.address, block_identifier=settlement_block), report_path) == 6
+    assert list(reconcile(dao_dutch_auction.address, report_path)) == []
+
+    votes_token = TestERC20.at(dao_dutch_auction.votesToken())
+    votes_token_balance = votes_token.balanceOf(bidders[0].account.address)
+    rows = {row.bidder: row for row in payout_rows(dao_dutch_auction.address, block_identifier=settlement_block)}
+    assert rows[bidders[0].account.address].token_shares == votes_token_balance
+
+
+def test_optimistic_settlement(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 10)
+    for bidder in bidders:
+        max_price = randrange(1, 10 ** 18)
+        bid_amount = randrange(0, max_price)
+        bidder.bid(bid_amount, max_price, randrange(0, bid_amount * 2 + 1), skip_assertions=True)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    leaves = compute_leaves(dao_dutch_auction.address)
+    proposer_address, challenger_address = auctioneers[0].address, auctioneers[1].address
+
+    # A proposal inflating one valid bid, with running results consistent with the inflated amount
+    forged = [dataclasses.replace(leaf) for leaf in leaves]
+    target = next(index for index, leaf in enumerate(forged) if leaf.valid)
+    forged[target].bid_amount += 1
+    result = (forged[target - 1].result_max_price, forged[target - 1].result_total_bid) if target else (0, 0)
+    for index in range(target, len(forged)):
+        leaf = forged[index]
+        result = next_result(result, index == 0, leaf.valid, leaf.bid_amount, leaf.max_price)
+        leaf.result_max_price, leaf.result_total_bid = result
+
+    receipt = propose_settlement(dao_dutch_auction.address, proposer_address, forged)
+    # Proposing only stores the result and the root, whatever the number of bids
+    assert receipt["gasUsed"] < 150000
+
+    proposer = SettlementProposer(dao_dutch_auction.address, proposer_address, forged)
+    challenger = SettlementChallenger(dao_dutch_auction.address, challenger_address, leaves)
+    challenger_balance = web3.eth.get_balance(challenger_address)
+    while challenger.step():
+        proposer.step()
+
+    assert dao_dutch_auction.proposal()[0] == ZERO_ADDRESS
+    bond = dao_dutch_auction.SETTLEMENT_BOND()
+    # Gained the proposer's bond, less gas
+    assert web3.eth.get_balance(challenger_address) > challenger_balance + bond // 2
+
+    # The honest proposal is left alone and finalizes after the challenge period
+    propose_settlement(dao_dutch_auction.address, proposer_address, leaves)
+    proposer = SettlementProposer(dao_dutch_auction.address, proposer_address, leaves)
+    assert not challenger.step()
+
+    # A challenger can't stall it: after ceil(log2(10)) + 1 leaves they must prove a claim or time out
+    griefer = auctioneers[2].address
+    assert dao_dutch_auction.maxLeafRequests() == 5
+    for request in range(5):
+        dao_dutch_auction.challengeSettlement(request, {"from": griefer, "value": bond if request == 0 else 0})
+        assert proposer.step()
+    with reverts("Leaf request limit reached"):
+        dao_dutch_auction.challengeSettlement(5, {"from": griefer})
+    chain.sleep(dao_dutch_auction.RESPONSE_PERIOD() + 1)
+    chain.mine()
+    assert proposer.step()
+    assert dao_dutch_auction.dispute()[0] == ZERO_ADDRESS
+
+    chain.sleep(dao_dutch_auction.CHALLENGE_PERIOD())
+    chain.mine()
+    assert not proposer.step()
+
+    ranked = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    assert dao_dutch_auction.resultSubmitter() == proposer_address
+    assert dao_dutch_auction.results(proposer_address) == (ranked.realized_price, ranked.total_bid)
+
+
+def test_optimistic_settlement_colluding_challenger(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    bidders = generate_bidders(dao_dutch_auction.address, 6)
+    for index, bidder in enumerate(bidders):
+        bidder.bid(1000 + index, 10 ** 6 + index, 2000, skip_assertions=True)
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    leaves = compute_leaves(dao_dutch_auction.address)
+    proposer_address, colluder, challenger_address = (a.address for a in auctioneers[:3])
+
+    # A proposal dropping the last bid's amount from the running result
+    forged = [dataclasses.replace(leaf) for leaf in leaves]
+    forged[-1].result_total_bid -= forged[-1].bid_amount
+    propose_settlement(dao_dutch_auction.address, proposer_address, forged)
+    proposer = SettlementProposer(dao_dutch_auction.address, proposer_address, forged)
+
+    # The colluder opens a dispute just before the challenge period ends, takes one leaf and lets it time out
+    bond = dao_dutch_auction.SETTLEMENT_BOND()
+    chain.sleep(dao_dutch_auction.CHALLENGE_PERIOD() - 60)
+    chain.mine()
+    dao_dutch_auction.challengeSettlement(0, {"from": colluder, "value": bond})
+    assert proposer.step()
+    chain.sleep(dao_dutch_auction.RESPONSE_PERIOD() + 1)
+    chain.mine()
+
+    # The challenge period is long over, but closing the colluder's dispute leaves time for another
+    challenger = SettlementChallenger(dao_dutch_auction.address, challenger_address, leaves)
+    with reverts("Settlement disputed"):
+        dao_dutch_auction.finalizeSettlement({"from": proposer_address})
+    while challenger.step():
+        proposer.step()
+
+    assert not challenger.challenge_period_over
+    assert dao_dutch_auction.proposal()[0] == ZERO_ADDRESS
+    assert dao_dutch_auction.resultSubmitter() == ZERO_ADDRESS
+
+
+def test_rebids(dao_dutch_auction, auctioneers):
+    for a in auctioneers:
+        npk = list(normalize(a.public_key))
+        dao_dutch_auction.setPublicKey(a.index, [int(npk[0]), int(npk[1])], {"from": a.address})
+
+    # The first bidder bids again, replacing their first bid
+    bidders = generate_bidders(dao_dutch_auction.address, 4)
+    for index, bidder in enumerate(bidders):
+        bidder.bid(1000 + index, 10 ** 6 + index, 2000, skip_assertions=True)
+    bidders[0].bid(1500, 10 ** 6 + 10, 2000, skip_assertions=True)
+    assert dao_dutch_auction.bidCount() == 4
+
+    for a in auctioneers:
+        dao_dutch_auction.revealPrivateKey(a.index, a.private_key, {"from": a.address})
+
+    # Every index a challenger may request has a leaf, so the honest proposer can open the last one
+    leaves = compute_leaves(dao_dutch_auction.address)
+    assert len(leaves) == 4
+    assert dao_dutch_auction.maxLeafRequests() == 3
+    proposer_address, challenger_address = auctioneers[0].address, auctioneers[1].address
+    propose_settlement(dao_dutch_auction.address, proposer_address, leaves)
+    proposer = SettlementProposer(dao_dutch_auction.address, proposer_address, leaves)
+
+    bond = dao_dutch_auction.SETTLEMENT_BOND()
+    with reverts("Index out of range"):
+        dao_dutch_auction.challengeSettlement(4, {"from": challenger_address, "value": bond})
+    dao_dutch_auction.challengeSettlement(3, {"from": challenger_address, "value": bond})
+    assert proposer.step()
+    assert dao_dutch_auction.dispute()[2] is False
+
+    # The last leaf reaches proveWrongResult, which finds the result valid
+    with reverts("Result is valid"):
+        dao_dutch_auction.proveWrongResult(
+            dataclasses.astuple(leaves[3]), MerkleTree(leaves).proof(3), {"from": challenger_address}
+        )
+
+    # The on-chain reveal finalizes once every bidder is posted
+    result = rank_bid_result(dao_dutch_auction.address, decrypt_bids(dao_dutch_auction.address, local=True))
+    submitter = auctioneers[2].address
+    submit_reveal(DAODutchAuction(dao_dutch_auction.address), [bid.bidder for bid in result.ordered_bids], submitter)
+    assert dao_dutch_auction.resultSubmitter() == submitter
+    assert dao_dutch_auction.results(submitter) == (result.realized_price, result.total_bid)
@@ -0,0 +1,45 @@
+import random
+
+from web3 import Web3
+
+from bidder import RevealedBid, rank_bids
+from optimistic import MerkleTree, final_result, leaf_hash, settlement_leaves
+
+
+def random_bids(count):
+    bids = []
+    locked_eth = {}
+    for _ in range(count):
+        max_price = random.randint(1, 1000)
+        bid_amount = random.randint(0, max_price if random.random() < 0.8 else 2 * max_price)
+        bidder = Web3.toChecksumAddress("0x%040x" % random.getrandbits(160))
+        bids.append(RevealedBid(bidder, max_price, bid_amount))
+        locked_eth[bidder] = max(0, bid_amount + random.randint(-50, 200))
+    return bids, locked_eth
+
+
+def test_settlement_leaves_match_rank_bids():
+    for count in [1, 2, 7, 16]:
+        for _ in range(20):
+            bids, locked_eth = random_bids(count)
+            leaves = settlement_leaves(bids, locked_eth)
+            ranked = rank_bids(bids, locked_eth)
+
+            assert [leaf.bidder for leaf in leaves] == [bid.bidder for bid in ranked.ordered_bids]
+            last = leaves[-1]
+            assert final_result((last.result_max_price, last.result_total_bid)) == (ranked.realized_price, ranked.total_bid)
+
+
+def test_merkle_proofs():
+    # _verifyLeaf: the bit of the index at each level says which side the node is on
+    for count in [1, 2, 5, 8]:
+        leaves = settlement_leaves(*random_bids(count))
+        tree = MerkleTree(leaves)
+        for leaf in leaves:
+            node, position = leaf_hash(leaf), leaf.index
+            proof = tree.proof(leaf.index)
+            assert len(proof) == (count - 1).bit_length()
+            for sibling in proof:
+                node = bytes(Web3.keccak(node + sibling if position % 2 == 0 else sibling + node))
+                position //= 2
+            assert node == tree.root
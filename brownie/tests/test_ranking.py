@@ -0,0 +1,42 @@
+from bidder import RevealedBid, rank_bids
+
+
+def test_rank_bids_ordering():
+    bids = [
+        RevealedBid("0x" + "11" * 20, 100, 50),
+        RevealedBid("0x" + "33" * 20, 100, 40),
+        RevealedBid("0x" + "22" * 20, 300, 20),
+        RevealedBid("0x" + "44" * 20, 10, 20),   # bid amount exceeds max price
+        RevealedBid("0x" + "55" * 20, 500, 80),  # bid amount exceeds locked eth
+    ]
+    locked_eth = {bid.bidder: bid.bid_amount for bid in bids}
+    locked_eth["0x" + "55" * 20] = 79
+
+    result = rank_bids(bids, locked_eth)
+
+    assert [bid.bidder[2:4] for bid in result.ordered_bids] == ["22", "33", "11", "55", "44"]
+    assert result.realized_price == 100
+    assert result.total_bid == 110
+
+    # Running total never reaches a max price, so the total bid is realized
+    result = rank_bids(bids[2:], locked_eth)
+    assert result.realized_price == 20
+    assert result.total_bid == 20
+
+
+def test_rank_bids_clearing_price():
+    bids = [
+        RevealedBid("0x" + "11" * 20, 100, 60),
+        RevealedBid("0x" + "22" * 20, 100, 30),
+        RevealedBid("0x" + "33" * 20, 100, 10),
+        RevealedBid("0x" + "44" * 20, 90, 90),
+        RevealedBid("0x" + "55" * 20, 150, 10),
+    ]
+    locked_eth = {bid.bidder: bid.bid_amount for bid in bids}
+
+    result = rank_bids(bids, locked_eth)
+
+    # Total reaches 100 inside the 100 price group, the whole group is included
+    assert result.realized_price == 100
+    assert result.total_bid == 110
+    assert rank_bids([], {}).total_bid == 0
@@ -0,0 +1,34 @@
+import pytest
+
+from bidder import RevealedBid
+from report import PayoutRow, payout, read_report, write_report
+
+
+ROWS = [
+    PayoutRow("0x%040x" % 1, 3 * 10 ** 30, 4 * 10 ** 30, 5 * 10 ** 30, True, 2 * 10 ** 30, 3 * 10 ** 30),
+    PayoutRow("0x%040x" % 2, 10, 5, 20, False, 0, 20),
+]
+
+
+def test_payout():
+    bid = RevealedBid("0x%040x" % 1, 100, 40)
+    assert payout(bid, 50, 80, 120) == (True, 40 * 80 // 120, 50 - 40 * 80 // 120)
+    # Locked less than the bid, max price under the realized price
+    assert payout(bid, 30, 80, 120) == (False, 0, 30)
+    assert payout(bid, 50, 101, 120) == (False, 0, 50)
+
+    # withdrawTo divides by the total bid and reverts, invalid bids are still refunded
+    zero_bid = RevealedBid("0x%040x" % 2, 100, 0)
+    with pytest.raises(Exception, match=zero_bid.bidder):
+        payout(zero_bid, 50, 0, 0)
+    assert payout(bid, 30, 0, 0) == (False, 0, 30)
+
+
+@pytest.mark.parametrize("name", ["report.csv", "report.parquet"])
+def test_report_round_trip(tmp_path, name):
+    if name.endswith(".parquet"):
+        pytest.importorskip("pyarrow")
+    path = tmp_path / name
+    # Generators are streamed, not materialized
+    assert write_report(iter(ROWS), path) == len(ROWS)
+    assert list(read_report(path)) == ROWS
@@ -0,0 +1,73 @@
+from settlement import plan_chunks, resume_index
+
+BASE_GAS = 50000
+
+
+def chunk_gas(costs):
+    return lambda chunk: BASE_GAS + sum(costs[item] for item in chunk)
+
+
+def assert_chunks_fit(items, estimate, chunks, gas_budget, final_reserve=0):
+    assert [item for chunk, _ in chunks for item in chunk] == items
+    for index, (chunk, gas_limit) in enumerate(chunks):
+        reserve = final_reserve if index == len(chunks) - 1 else 0
+        assert estimate(chunk) + reserve <= gas_limit <= gas_budget
+
+
+def test_plan_chunks_probes_the_whole_list():
+    # Cheap entries first, as when undecryptable bids or refunds lead the list
+    items = list(range(400))
+    costs = [2000 if item < 100 else 20000 for item in items]
+    estimate = chunk_gas(costs)
+    chunks = plan_chunks(items, estimate, 1000000, 100000)
+    assert len(chunks) > 1
+    assert_chunks_fit(items, estimate, chunks, 1000000, 100000)
+
+
+def test_plan_chunks_small_list():
+    items = list(range(5))
+    estimate = chunk_gas([20000] * 5)
+    assert plan_chunks(items, estimate, 1000000) == [(items, int(estimate(items) * 1.2))]
+    assert plan_chunks([], estimate, 1000000) == []
+
+
+def test_plan_chunks_flat_estimates():
+    # Estimates that don't grow with the chunk still give a positive per-entry gas and bounded chunks
+    items = list(range(1000))
+    chunks = plan_chunks(items, lambda chunk: BASE_GAS, 1000000)
+    assert [item for chunk, _ in chunks for item in chunk] == items
+    assert all(gas_limit <= 1000000 for _, gas_limit in chunks)
+    assert len(chunks) > 1
+
+
+class StandInCall:
+    def __init__(self, value):
+        self.value = value
+
+    def call(self):
+        return self.value
+
+
+class StandInReveal:
+    """ Stands in for the contract, with entries already posted by a submitter
+    """
+
+    def __init__(self, posted):
+        self.functions = self
+        self.posted = posted
+
+    def postedBidCount(self, sender):
+        return StandInCall(len(self.posted))
+
+    def lastPostedBid(self, sender):
+        return StandInCall(self.posted[-1])
+
+
+def test_resume_index():
+    ordered = ["0x%040x" % index for index in range(5, 0, -1)]
+    assert resume_index(StandInReveal([]), ordered, None) == 0
+    assert resume_index(StandInReveal(ordered[:3]), ordered, None) == 3
+    assert resume_index(StandInReveal(ordered), ordered, None) == 5
+    # Posted by an earlier run over a different ranking
+    assert resume_index(StandInReveal(ordered[1:4]), ordered, None) is None
+    assert resume_index(StandInReveal(ordered + ["0x%040x" % 9]), ordered, None) is None
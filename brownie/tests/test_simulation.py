@@ -0,0 +1,68 @@
+import random
+
+import numpy as np
+
+from bidder import RevealedBid, rank_bids
+from simulation import AuctionBook, simulate_auctions
+
+
+def random_auction(count, scale):
+    max_prices = [random.choice([random.randint(0, scale), random.randint(0, 10) * scale // 10]) for _ in range(count)]
+    bid_amounts = [random.randint(0, 2 * price if random.random() < 0.2 else price) // max(1, count // 4) for price in max_prices]
+    locked_eth = [max(0, amount + random.randint(-scale // 50, scale // 10)) for amount in bid_amounts]
+    return bid_amounts, max_prices, locked_eth
+
+
+def ranked(bid_amounts, max_prices, locked_eth):
+    bids = [RevealedBid("0x%040x" % (i + 1), price, amount) for i, (amount, price) in enumerate(zip(bid_amounts, max_prices))]
+    return rank_bids(bids, {bid.bidder: locked for bid, locked in zip(bids, locked_eth)})
+
+
+def test_simulate_auctions_matches_rank_bids():
+    # int64 path for small values, object arrays for wei amounts
+    for scale in [1000, 10 ** 21]:
+        auctions = [random_auction(8, scale) for _ in range(50)]
+        result = simulate_auctions(*[[auction[i] for auction in auctions] for i in range(3)])
+
+        for index, (bid_amounts, max_prices, locked_eth) in enumerate(auctions):
+            expected = ranked(bid_amounts, max_prices, locked_eth)
+            assert result.realized_price[index] == expected.realized_price
+            assert result.total_bid[index] == expected.total_bid
+
+            for amount, price, locked, shares, refund in zip(
+                bid_amounts, max_prices, locked_eth, result.shares[index], result.refunds[index]
+            ):
+                # withdrawTo payout
+                if amount > price or price < expected.realized_price or amount > locked:
+                    assert (shares, refund) == (0, locked)
+                else:
+                    assert shares == amount * expected.realized_price // expected.total_bid
+                    assert refund == locked - shares
+
+
+def test_simulate_auctions_mask():
+    mask = np.array([[True, True, False], [True, False, False]])
+    result = simulate_auctions([[5, 3, 7], [4, 9, 9]], [[10, 6, 7], [9, 9, 9]], [[5, 3, 7], [4, 9, 9]], mask)
+
+    assert list(result.realized_price) == [6, 4]
+    assert list(result.total_bid) == [8, 4]
+    assert list(result.refunds[0]) == [5 - 5 * 6 // 8, 3 - 3 * 6 // 8, 0]
+
+
+def test_auction_book_what_if():
+    for _ in range(100):
+        bid_amounts, max_prices, locked_eth = random_auction(random.randint(0, 10), 1000)
+        book = AuctionBook(bid_amounts, max_prices, locked_eth)
+
+        expected = ranked(bid_amounts, max_prices, locked_eth)
+        assert (book.result().realized_price, book.result().total_bid) == (expected.realized_price, expected.total_bid)
+
+        for index in range(len(bid_amounts)):
+            without = book.without_bid(index)
+            expected = ranked(*[values[:index] + values[index + 1:] for values in (bid_amounts, max_prices, locked_eth)])
+            assert (without.realized_price, without.total_bid) == (expected.realized_price, expected.total_bid)
+
+        new_amounts, new_prices, new_locked = random_auction(1, 1000)
+        with_bid = book.with_bid(new_amounts[0], new_prices[0], new_locked[0])
+        expected = ranked(bid_amounts + new_amounts, max_prices + new_prices, locked_eth + new_locked)
+        assert (with_bid.realized_price, with_bid.total_bid) == (expected.realized_price, expected.total_bid)
@@ -1,17 +1,75 @@
 from client import web3
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+import hashlib
+import hmac
 import os
+
+from eth_account.hdaccount import seed_from_mnemonic
+from eth_account.hdaccount.deterministic import Node, SoftNode, derive_child_key
+from eth_keys import keys
+
+from parallel import chunked_map
+
 script_dir = os.path.dirname(__file__)
 relative_path = "../scripts/mnemonic.txt"
 full_path = os.path.join(script_dir, relative_path)
 
-mnemonic = ""
+# Accounts are m/44'/60'/0'/0/{index} for index below MAX_ACCOUNTS, which can be raised
+# with the MAX_ACCOUNTS environment variable
+MAX_ACCOUNTS = int(os.environ.get("MAX_ACCOUNTS", 100))
+ACCOUNT_PARENT_PATH = "m/44'/60'/0'/0"
+# Number of derived accounts kept in memory
+ACCOUNT_CACHE_SIZE = 4096
+SECP256K1_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+
+
+@lru_cache(maxsize=None)
+def get_mnemonic() -> str:
+    with open(full_path) as f:
+        return f.readlines()[0].rstrip()
+
+
+@lru_cache(maxsize=None)
+def _parent_node() -> Tuple[bytes, bytes, bytes]:
+    """ Private key, chain code and compressed public key of the account parent node
 
-MAX_ACCOUNTS = 100
+        Derived once, so the mnemonic is only stretched once and every account costs a
+        single HMAC and one public key computation for its address.
+    """
+    seed = seed_from_mnemonic(get_mnemonic(), "")
+    master_node = hmac.new(b"Bitcoin seed", seed, hashlib.sha512).digest()
+    key, chain_code = master_node[:32], master_node[32:]
+    for node in ACCOUNT_PARENT_PATH.split("/")[1:]:
+        key, chain_code = derive_child_key(key, chain_code, Node.decode(node))
+    return key, chain_code, keys.PrivateKey(key).public_key.to_compressed_bytes()
 
-with open(full_path) as f:
-    mnemonic = f.readlines()[0].rstrip()
 
+def _child_key(index: int) -> bytes:
+    """ BIP32 soft child derivation from the cached parent public key
+    """
+    parent_key, chain_code, parent_public_key = _parent_node()
+    child = hmac.new(chain_code, parent_public_key + index.to_bytes(4, "big"), hashlib.sha512).digest()
+    tweak = int.from_bytes(child[:32], "big")
+    child_key = (tweak + int.from_bytes(parent_key, "big")) % SECP256K1_N
+    if tweak >= SECP256K1_N or child_key == 0:
+        # Invalid child, negligible odds, skipped the way eth_account does
+        return derive_child_key(parent_key, chain_code, SoftNode(index))[0]
+    return child_key.to_bytes(32, "big")
+
+
+@lru_cache(maxsize=ACCOUNT_CACHE_SIZE)
 def get_account(index: int):
     if index >= MAX_ACCOUNTS:
         raise Exception("Index exceeds account limit")
-    return web3.eth.account.from_mnemonic(mnemonic, account_path=f"m/44'/60'/0'/0/{index}")
+    return web3.eth.account.from_key(_child_key(index))
+
+
+def _account_keys(indices: Sequence[int]) -> List[bytes]:
+    return [bytes(get_account(index).key) for index in indices]
+
+
+def derive_accounts(indices: Sequence[int], workers: int = 1) -> List:
+    """ Accounts for all indices, derived in a process pool when workers > 1
+    """
+    return [web3.eth.account.from_key(key) for key in chunked_map(_account_keys, indices, workers)]
@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List
+
+from accounts import get_account
+from bidder import Bidder
+from client import web3
+
+# Gas limit headroom over the estimate of the first bid
+BID_GAS_MARGIN = 1.25
+# Print a progress line every this many confirmed bids
+REPORT_EVERY = 1000
+
+
+@dataclass
+class BidSpec:
+    account_index: int
+    bid_amount: int
+    max_price: int
+    locked_wei: int
+
+
+@dataclass
+class PipelineStats:
+    submitted: int = 0
+    confirmed: int = 0
+    failed: int = 0
+    started: float = field(default_factory=time.perf_counter)
+    latencies: List[float] = field(default_factory=list)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def bids_per_second(self) -> float:
+        return self.confirmed / self.elapsed if self.elapsed else 0.0
+
+    def latency_percentile(self, percentile: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+
+    def summary(self) -> str:
+        return (
+            f"{self.confirmed} confirmed, {self.failed} failed in {self.elapsed:.1f}s "
+            f"({self.bids_per_second:.1f} bids/s), confirmation latency "
+            f"p50 {self.latency_percentile(0.5):.2f}s p95 {self.latency_percentile(0.95):.2f}s"
+        )
+
+
+def read_bids(path, account_count) -> Iterator[BidSpec]:
+    """ Streams "bid_amount_eth, max_price_eth, send_eth" lines, assigning accounts round robin
+    """
+    with open(path) as f:
+        for index, bidline in enumerate(f):
+            if not bidline.strip():
+                continue
+            bid_data = [bid.strip() for bid in bidline.split(",")]
+            yield BidSpec(
+                index % account_count,
+                web3.toWei(bid_data[0], "ether"),
+                web3.toWei(bid_data[1], "ether"),
+                web3.toWei(bid_data[2], "ether"),
+            )
+
+
+class NonceManager:
+    """ Hands out consecutive nonces per account, only asking the node once per account
+
+        A nonce whose transaction never reached the node is released and handed out again, so
+        failed bids leave no gap that would hold up the account's later transactions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nonces: Dict[str, int] = {}
+        self.released: Dict[str, List[int]] = {}
+
+    def next(self, address) -> int:
+        with self.lock:
+            released = self.released.get(address)
+            if released:
+                return heapq.heappop(released)
+            if address not in self.nonces:
+                self.nonces[address] = web3.eth.get_transaction_count(address, "pending")
+            nonce = self.nonces[address]
+            self.nonces[address] += 1
+            return nonce
+
+    def release(self, address, nonce):
+        """ Returns a nonce that was not sent for reuse
+        """
+        with self.lock:
+            if self.nonces.get(address) == nonce + 1:
+                self.nonces[address] = nonce
+            else:
+                heapq.heappush(self.released.setdefault(address, []), nonce)
+
+    def resync(self, address):
+        """ Forgets the account's next nonce, the next one is read from the node's pending count
+        """
+        with self.lock:
+            self.nonces.pop(address, None)
+            self.released.pop(address, None)
+
+
+class BidPipeline:
+    """ Signs bids locally and keeps up to in_flight transactions pending at once
+    """
+
+    def __init__(self, contract_address, in_flight=32, accounts=None):
+        self.contract_address = contract_address
+        self.in_flight = in_flight
+        self.accounts = accounts or {}
+        self.nonces = NonceManager()
+        self.stats = PipelineStats()
+
+        self.chain_id = web3.eth.chain_id
+        self.gas_price = web3.eth.gas_price
+        self.gas = None
+        self.gas_lock = threading.Lock()
+
+    def _send(self, spec: BidSpec):
+        account = self.accounts.get(spec.account_index) or get_account(spec.account_index)
+        bid_function = Bidder(account, self.contract_address).bid_function(spec.bid_amount, spec.max_price, spec.locked_wei)
+
+        transaction = {"from": account.address, "value": spec.locked_wei}
+        with self.gas_lock:
+            if self.gas is None:
+                self.gas = int(bid_function.estimateGas(transaction) * BID_GAS_MARGIN)
+
+        nonce = self.nonces.next(account.address)
+        transaction.update({
+            "nonce": nonce,
+            "gas": self.gas,
+            "gasPrice": self.gas_price,
+            "chainId": self.chain_id,
+        })
+        try:
+            signed = account.sign_transaction(bid_function.buildTransaction(transaction))
+        except Exception:
+            self.nonces.release(account.address, nonce)
+            raise
+
+        sent_at = time.perf_counter()
+        try:
+            tx_hash = web3.eth.send_raw_transaction(signed.rawTransaction)
+        except ValueError:
+            # Rejected by the node, the nonce is still free
+            self.nonces.release(account.address, nonce)
+            raise
+        except Exception:
+            # The transaction may or may not have reached the node, only its pending count can tell
+            self.nonces.resync(account.address)
+            raise
+        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+        return receipt, time.perf_counter() - sent_at
+
+    async def _submit(self, spec: BidSpec, slots: asyncio.Semaphore):
+        loop = asyncio.get_running_loop()
+        self.stats.submitted += 1
+        try:
+            receipt, latency = await loop.run_in_executor(None, self._send, spec)
+            if receipt["status"] == 1:
+                self.stats.confirmed += 1
+                self.stats.latencies.append(latency)
+            else:
+                self.stats.failed += 1
+        except Exception as e:
+            self.stats.failed += 1
+            print(f"Bid from account #{spec.account_index} failed: {e}")
+        finally:
+            slots.release()
+
+        if self.stats.confirmed and self.stats.confirmed % REPORT_EVERY == 0:
+            print(self.stats.summary())
+
+    async def run(self, bid_specs: Iterator[BidSpec]) -> PipelineStats:
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.in_flight))
+
+        slots = asyncio.Semaphore(self.in_flight)
+        pending = set()
+        for spec in bid_specs:
+            await slots.acquire()
+            task = asyncio.create_task(self._submit(spec, slots))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        if pending:
+            await asyncio.wait(pending)
+        return self.stats
+
+
+def submit_bids(contract_address, bid_specs: Iterator[BidSpec], in_flight=32, accounts=None) -> PipelineStats:
+    """ accounts optionally maps account indices to already derived accounts
+    """
+    return asyncio.run(BidPipeline(contract_address, in_flight, accounts).run(bid_specs))
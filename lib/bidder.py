@@ -1,25 +1,60 @@
-from collections import defaultdict
+from bisect import bisect_left
 from dataclasses import dataclass
-from typing import List, Tuple
+from itertools import accumulate
+from typing import Dict, List, Optional, Tuple
 
-from crypto import generate_keypair, normalize
+from crypto import PointG1, generate_keypair, normalize, point_from_affine, symmetric_key
+from crypto import multiply_g1, recover_secret, sum_scalars
+from crypto import G1, bid_commitment, bulk_ecdh, compress_point, dleq, dleq_verify_batch
+from crypto import decrypt as decrypt_value, encrypt as encrypt_value
 from contracts import DAODutchAuction
-from client import web3
-from web3.exceptions import ContractLogicError
+from client import web3, batch_call
+from profiling import timed
+
+# Number of auctioneers(i) lookups probed per batch
+AUCTIONEER_PAGE_SIZE = 16
+# Values revealAllBids gives a bid whose public key is not on the curve, a bid amount above the
+# max price so the bid is invalid
+UNDECRYPTABLE_BID_AMOUNT = 1
+UNDECRYPTABLE_MAX_PRICE = 0
+
 
 # TODO: cache this, move somewhere else?
+@timed("bidder")
 def auctioneers(contract_address):
+    contract = DAODutchAuction(contract_address)
     auctioneers = []
-    index = 0
     while True:
-        try:
-            next_address = DAODutchAuction(contract_address).functions.auctioneers(index).call()
-            index += 1
-        except ContractLogicError:
-            break
-        auctioneers.append(next_address)
+        index = len(auctioneers)
+        page = batch_call(
+            [contract.functions.auctioneers(i) for i in range(index, index + AUCTIONEER_PAGE_SIZE)],
+            allow_failure=True,
+        )
+        for next_address in page:
+            # auctioneers(i) reverts past the end of the array
+            if next_address is None:
+                return auctioneers
+            auctioneers.append(next_address)
+
+
+# Master public keys of auctions where every auctioneer has published, these never change
+_master_public_keys: Dict[str, Tuple[int, int]] = {}
+
+
+@timed("bidder")
+def master_public_key(contract_address) -> Tuple[int, int]:
+    if contract_address not in _master_public_keys:
+        contract = DAODutchAuction(contract_address)
+        pub_key_count, pubk_x, pubk_y = batch_call([
+            contract.functions.publishedKeys(),
+            contract.functions.masterPublicKey(0),
+            contract.functions.masterPublicKey(1),
+        ])
+        if pub_key_count != len(auctioneers(contract_address)):
+            raise Exception("Master public key incomplete")
+        _master_public_keys[contract_address] = (pubk_x, pubk_y)
 
-    return auctioneers
+    return _master_public_keys[contract_address]
 
 
 @dataclass
@@ -27,7 +62,10 @@ class EncryptedBid:
     bidder: str
     encrypted_bid_amount: int
     encrypted_max_price: int
+    # (compressed key, 0) if the key the bid was placed with is not on the curve
     bidder_public_key: Tuple[int, int]
+    # Set if the bid was placed with a commitment to its values
+    commitment: Optional[bytes] = None
 
 
 @dataclass
@@ -37,6 +75,14 @@ class RevealedBid:
     bid_amount: int
 
 
+@dataclass
+class DecryptionProof:
+    bidder: str
+    shared_key: Tuple[int, int]
+    challenge: int
+    response: int
+
+
 @dataclass
 class RankedBidResult:
     ordered_bids: List[RevealedBid]
@@ -45,7 +91,7 @@ class RankedBidResult:
 
 
 class Bidder:
-    def __init__(self, account, contract_address):
+    def __init__(self, account, contract_address, keypair=None):
         self.contract_address = contract_address
         self.locked_wei: int
         self.bid_amount: int
@@ -53,40 +99,46 @@ class Bidder:
 
         self.account = account
 
-        priv_k, pub_k = generate_keypair()
+        priv_k, pub_k = keypair if keypair else generate_keypair()
         self.private_key: int = priv_k
         self.public_key: PointG1 = pub_k
 
     def get_sym_key(self):
         mpubk = self.get_master_public_key()
-        sym_key = self.contract.functions.bn128_multiply([mpubk[0], mpubk[1], self.private_key]).call()[0]
-        return sym_key
+        return symmetric_key(point_from_affine(mpubk), self.private_key)
 
-    def bid(self, bid_amount: int, max_price: int, locked_wei: int, skip_assertions=False):
-        # Verify contract private key is valid, and extract that
+    def bid_function(self, bid_amount: int, max_price: int, locked_wei: int, commit=False):
+        """ Encrypts the bid values and returns the unsent bid() contract call
+
+            With commit the bid also carries a commitment salted with the shared key, the bid only counts
+            as valid if its decrypted values match it.
+        """
         self.bid_amount = bid_amount
         self.max_price = max_price
         self.locked_wei = locked_wei
 
+        # Encrypted locally, plaintext values never leave this process
+        sym_key = self.get_sym_key()
+        encrypted_bid_amount = encrypt_value(bid_amount, sym_key)
+        encrypted_max_price = encrypt_value(max_price, sym_key)
+
+        public_key = compress_point(normalize(self.public_key))
+        if commit:
+            commitment = bid_commitment(bid_amount, max_price, sym_key)
+            return self.contract.functions.bidCompressed(encrypted_bid_amount, encrypted_max_price, public_key, commitment)
+        return self.contract.functions.bidCompressed(encrypted_bid_amount, encrypted_max_price, public_key)
+
+    def bid(self, bid_amount: int, max_price: int, locked_wei: int, skip_assertions=False, commit=False):
+        # Verify contract private key is valid, and extract that
         if not skip_assertions:
             assert locked_wei <= web3.eth.get_balance(self.account.address)
             assert locked_wei >= bid_amount
 
-        sym_key = self.get_sym_key()
-
-        encrypted_bid_amount = self.contract.functions.encrypt(bid_amount, sym_key).call()
-        encrypted_max_price = self.contract.functions.encrypt(max_price, sym_key).call()
-
-        normal_pub_key = normalize(self.public_key)
-        return self.contract.functions.bid(encrypted_bid_amount, encrypted_max_price, [int(normal_pub_key[0]), int(normal_pub_key[1])]).transact({"value": locked_wei, "from": self.account.address})
+        bid_function = self.bid_function(bid_amount, max_price, locked_wei, commit)
+        return bid_function.transact({"value": locked_wei, "from": self.account.address})
 
     def get_master_public_key(self) -> Tuple[int, int]:
-        pub_key_count = self.contract.functions.publishedKeys().call()
-        if pub_key_count != len(auctioneers(self.contract.address)):
-            raise Exception("Master public key incomplete")
-        pubk_x = self.contract.functions.masterPublicKey(0).call()
-        pubk_y = self.contract.functions.masterPublicKey(1).call()
-        return (pubk_x, pubk_y)
+        return master_public_key(self.contract_address)
 
 
     @property
@@ -97,104 +149,273 @@ class Bidder:
         pass
 
 
-def generate_bidders(contract_address, count) -> List[Bidder]:
+def _affine_keypairs(items) -> List[Tuple[int, Tuple[int, int]]]:
+    keypairs = []
+    for _ in items:
+        private_key, public_key = generate_keypair()
+        x, y = normalize(public_key)
+        keypairs.append((private_key, (int(x), int(y))))
+    return keypairs
+
+
+def _bidder_keys(account_indices) -> List[Tuple[bytes, int, Tuple[int, int]]]:
     from accounts import get_account
-    return [Bidder(get_account(i + 20), contract_address) for i in range(count)]
+    keypairs = _affine_keypairs(account_indices)
+    return [(bytes(get_account(index).key),) + keypair for index, keypair in zip(account_indices, keypairs)]
 
 
-def get_all_bids(contract_address) -> List[EncryptedBid]:
-    contract = DAODutchAuction(contract_address)
-    filter_instance = contract.events.BidSubmitted.createFilter(fromBlock="0x0")
-    print('filter_instance', filter_instance)
-    results = []
-    # look up each adress 
-    bidders = set()
-    for log in filter_instance.get_all_entries():
-        bidders.add(log.args.bidder)
-
-
-    for bidder in bidders:
-        bid = contract.functions.bids(bidder).call()
-        bidder_public_key = contract.functions.getBidderPublicKey(bidder).call()
-
-        results.append(
-            EncryptedBid(
-                bidder,
-                bid[1],
-                bid[2],
-                bidder_public_key,
-            )
-        )
+@timed("bidder")
+def generate_keypairs(count, workers=1) -> List[Tuple[int, PointG1]]:
+    """ count fresh keypairs, generated in a process pool when workers > 1
+    """
+    from parallel import chunked_map
+    return [
+        (private_key, point_from_affine(public_key))
+        for private_key, public_key in chunked_map(_affine_keypairs, range(count), workers)
+    ]
 
-    return results
 
+@timed("bidder")
+def generate_bidders(contract_address, count, workers=1) -> List[Bidder]:
+    """ Bidders for accounts 20 to 20 + count in order, with workers > 1 the account
+        derivation and keypair generation run in a process pool
+    """
+    from parallel import chunked_map
+    return [
+        Bidder(web3.eth.account.from_key(account_key), contract_address, (private_key, point_from_affine(public_key)))
+        for account_key, private_key, public_key in chunked_map(_bidder_keys, range(20, 20 + count), workers)
+    ]
 
-def decrypt_bids(contract_address, auctioneer_priv_keys=None) -> List[RevealedBid]:
-    encrypted_bids: List[EncryptedBid] = get_all_bids(contract_address)
-    master_private_key = None
 
-    contract = DAODutchAuction(contract_address)
-    if not auctioneer_priv_keys:
-        priv_key_count = contract.functions.revealedKeys().call()
-        if priv_key_count != len(auctioneers(contract_address)):
-            raise Exception("Cannot derive master secret key")
-        master_private_key = contract.functions.masterSecretKey().call()
-    else:
-        # TODO: use specified private keys to generate master private key locally
-        pass
-    
+@timed("bidder")
+def get_all_bids(contract_address, db_path=":memory:") -> List[EncryptedBid]:
+    from indexer import BidIndexer
+    indexer = BidIndexer(contract_address, db_path)
+    indexer.sync()
+    bids = indexer.bids()
+    indexer.close()
+    return bids
+
+
+def _is_decryptable(enc_bid: EncryptedBid) -> bool:
+    # The indexer stores keys that are not on the curve as (compressed key, 0)
+    return enc_bid.bidder_public_key[1] != 0
+
+
+def _undecryptable_bid(enc_bid: EncryptedBid) -> RevealedBid:
+    return RevealedBid(enc_bid.bidder, UNDECRYPTABLE_MAX_PRICE, UNDECRYPTABLE_BID_AMOUNT)
+
+
+def _revealed_bid(enc_bid: EncryptedBid, sym_key: int, bid_amount: int, max_price: int) -> RevealedBid:
+    if not enc_bid.commitment:
+        return RevealedBid(enc_bid.bidder, max_price, bid_amount)
+    # Mirrors _decryptBid: a commitment that doesn't match the decrypted values makes the bid invalid
+    if bid_commitment(bid_amount, max_price, sym_key) != enc_bid.commitment:
+        return _undecryptable_bid(enc_bid)
+    return RevealedBid(enc_bid.bidder, max_price, bid_amount)
+
+
+@timed("bidder")
+def decrypt_bid_values(encrypted_bids: List[EncryptedBid], master_private_key: int) -> List[RevealedBid]:
+    """ Decrypts bids locally, mirroring _sharedKey and Encryption.decrypt on the contract
+    """
+    decryptable = [enc_bid for enc_bid in encrypted_bids if _is_decryptable(enc_bid)]
+    shared_keys = bulk_ecdh([enc_bid.bidder_public_key for enc_bid in decryptable], master_private_key)
+    sym_keys = {enc_bid.bidder: sym_key for enc_bid, (sym_key, _) in zip(decryptable, shared_keys)}
+
     results = []
     for enc_bid in encrypted_bids:
-        sym_key = contract.functions.bn128_multiply([enc_bid.bidder_public_key[0], enc_bid.bidder_public_key[1], master_private_key]).call()[0]
-        bid_amount = contract.functions.decrypt(enc_bid.encrypted_bid_amount, sym_key).call()
-        max_price = contract.functions.decrypt(enc_bid.encrypted_max_price, sym_key).call()
+        if enc_bid.bidder not in sym_keys:
+            results.append(_undecryptable_bid(enc_bid))
+            continue
+
+        sym_key = sym_keys[enc_bid.bidder]
+        bid_amount = decrypt_value(enc_bid.encrypted_bid_amount, sym_key)
+        max_price = decrypt_value(enc_bid.encrypted_max_price, sym_key)
 
-        results.append(RevealedBid(enc_bid.bidder, max_price, bid_amount))
+        results.append(_revealed_bid(enc_bid, sym_key, bid_amount, max_price))
 
     return results
 
 
-def rank_bid_result(contract_address, bids: List[RevealedBid]) -> list[RevealedBid]:
+@timed("bidder")
+def derive_master_private_key(contract_address, auctioneer_priv_keys) -> int:
+    """ Derives the master private key locally and checks it against the on-chain master public key
+
+        auctioneer_priv_keys is either the list of every auctioneer private key, or a dict of
+        index -> share with at least threshold + 1 shares of a t-of-n sharing
+    """
+    if isinstance(auctioneer_priv_keys, dict):
+        master_private_key = recover_secret(auctioneer_priv_keys)
+    else:
+        master_private_key = sum_scalars(auctioneer_priv_keys)
+
     contract = DAODutchAuction(contract_address)
-    bid_by_price = defaultdict(list)
+    master_public_key = tuple(batch_call([contract.functions.masterPublicKey(0), contract.functions.masterPublicKey(1)]))
+    derived_public_key = normalize(multiply_g1(master_private_key))
+    if (int(derived_public_key[0]), int(derived_public_key[1])) != master_public_key:
+        raise Exception("Auctioneer private keys do not match master public key")
 
-    for bid in bids:
-        bid_by_price[bid.max_price].append(bid)
+    return master_private_key
 
-    invalid_bids = []
-    valid_bids = []
 
-    # For each max_bid in reversed order
-    for key in reversed(sorted(bid_by_price.keys())):
-        # check if bid is valid
-        for bid in reversed(sorted(bid_by_price[key], key=lambda x: bytes.fromhex(x.bidder[2:]))):
-            lockedEth = contract.functions.lockedEth(bid.bidder).call()
-            if lockedEth < bid.bid_amount:
-                invalid_bids.append(bid)
-            elif bid.bid_amount > bid.max_price:
-                invalid_bids.append(bid)
-            else:
-                valid_bids.append(bid)
+@timed("bidder")
+def get_master_private_key(contract_address, auctioneer_priv_keys=None) -> int:
+    """ Master private key from the given auctioneer keys, or from the contract once all keys are revealed
+    """
+    if auctioneer_priv_keys:
+        return derive_master_private_key(contract_address, auctioneer_priv_keys)
+
+    contract = DAODutchAuction(contract_address)
+    priv_key_count, master_private_key = batch_call([
+        contract.functions.revealedKeys(),
+        contract.functions.masterSecretKey(),
+    ])
+    if priv_key_count != len(auctioneers(contract_address)):
+        raise Exception("Cannot derive master secret key")
+    return master_private_key
+
 
+@timed("bidder")
+def decrypt_bids(contract_address, auctioneer_priv_keys=None, local=False, db_path=":memory:") -> List[RevealedBid]:
+    encrypted_bids: List[EncryptedBid] = get_all_bids(contract_address, db_path)
+    master_private_key = get_master_private_key(contract_address, auctioneer_priv_keys)
+
+    contract = DAODutchAuction(contract_address)
+    if local:
+        return decrypt_bid_values(encrypted_bids, master_private_key)
+
+    # bn128_multiply reverts on a point that is not on the curve, those bids are invalid without a call
+    decryptable = [enc_bid for enc_bid in encrypted_bids if _is_decryptable(enc_bid)]
+    sym_keys = [
+        point[0] for point in batch_call([
+            contract.functions.bn128_multiply([enc_bid.bidder_public_key[0], enc_bid.bidder_public_key[1], master_private_key])
+            for enc_bid in decryptable
+        ])
+    ]
+    decrypted = batch_call([
+        contract.functions.decrypt(code, sym_key)
+        for enc_bid, sym_key in zip(decryptable, sym_keys)
+        for code in (enc_bid.encrypted_bid_amount, enc_bid.encrypted_max_price)
+    ])
+
+    revealed = {}
+    for index, (enc_bid, sym_key) in enumerate(zip(decryptable, sym_keys)):
+        bid_amount, max_price = decrypted[2 * index], decrypted[2 * index + 1]
+        revealed[enc_bid.bidder] = _revealed_bid(enc_bid, sym_key, bid_amount, max_price)
+
+    return [revealed.get(enc_bid.bidder) or _undecryptable_bid(enc_bid) for enc_bid in encrypted_bids]
+
+
+@timed("bidder")
+def prove_decryptions(encrypted_bids: List[EncryptedBid], master_private_key: int) -> List[DecryptionProof]:
+    """ Publishes the shared key of every bid with a DLEQ proof that it was derived with the
+        key behind the master public key, so anyone can check the decryption without the master private key
+
+        Bids whose key is not on the curve are invalid without decryption and get no proof.
+    """
+    master_public_key = multiply_g1(master_private_key)
+    decryptable = [enc_bid for enc_bid in encrypted_bids if _is_decryptable(enc_bid)]
+    shared_keys = bulk_ecdh([enc_bid.bidder_public_key for enc_bid in decryptable], master_private_key)
+
+    proofs = []
+    for enc_bid, shared_key in zip(decryptable, shared_keys):
+        bidder_public_key = point_from_affine(enc_bid.bidder_public_key)
+        challenge, response = dleq(
+            G1, master_public_key, bidder_public_key, point_from_affine(shared_key), master_private_key
+        )
+        proofs.append(DecryptionProof(enc_bid.bidder, shared_key, challenge, response))
+
+    return proofs
+
+
+@timed("bidder")
+def verify_decryptions(
+    encrypted_bids: List[EncryptedBid], master_public_key: Tuple[int, int], proofs: List[DecryptionProof]
+) -> List[RevealedBid]:
+    """ Checks all decryption proofs in one batch and returns the bids they decrypt
+
+        Raises if a bid has no proof or if any proof is invalid, naming the offending bidders. Bids
+        whose key is not on the curve need no proof, they are invalid as on chain.
+    """
+    decryptable = [enc_bid for enc_bid in encrypted_bids if _is_decryptable(enc_bid)]
+    proof_by_bidder = {proof.bidder: proof for proof in proofs}
+    missing = [enc_bid.bidder for enc_bid in decryptable if enc_bid.bidder not in proof_by_bidder]
+    if missing:
+        raise Exception(f"Missing decryption proofs for {', '.join(missing)}")
+
+    mpk = point_from_affine(master_public_key)
+    batch = []
+    for enc_bid in decryptable:
+        proof = proof_by_bidder[enc_bid.bidder]
+        batch.append((
+            G1, mpk, point_from_affine(enc_bid.bidder_public_key), point_from_affine(proof.shared_key),
+            proof.challenge, proof.response,
+        ))
+
+    invalid = [enc_bid.bidder for enc_bid, valid in zip(decryptable, dleq_verify_batch(batch)) if not valid]
+    if invalid:
+        raise Exception(f"Invalid decryption proofs for {', '.join(invalid)}")
 
-    last_max_price = 0
-    total_bid = 0
-    realized_max_price = 0
+    results = []
+    for enc_bid in encrypted_bids:
+        if not _is_decryptable(enc_bid):
+            results.append(_undecryptable_bid(enc_bid))
+            continue
+        sym_key = proof_by_bidder[enc_bid.bidder].shared_key[0]
+        bid_amount = decrypt_value(enc_bid.encrypted_bid_amount, sym_key)
+        max_price = decrypt_value(enc_bid.encrypted_max_price, sym_key)
+        results.append(_revealed_bid(enc_bid, sym_key, bid_amount, max_price))
 
-    for bid in valid_bids:
-        if realized_max_price and bid.max_price != realized_max_price:
-            break
+    return results
 
-        total_bid += bid.bid_amount
 
-        if total_bid >= bid.max_price:
-            realized_max_price = bid.max_price
+@timed("bidder")
+def rank_bids(bids: List[RevealedBid], locked_eth: Dict[str, int]) -> RankedBidResult:
+    """ Orders bids the way revealAllBids expects them and computes the auction result
+
+        Valid bids come first ordered by (max_price, address) descending, then invalid
+        bids by address descending. locked_eth maps each bidder to their lockedEth balance.
+    """
+    valid_bids = []
+    invalid_bids = []
+    for bid in bids:
+        if bid.bid_amount <= locked_eth[bid.bidder] and bid.bid_amount <= bid.max_price:
+            valid_bids.append(bid)
+        else:
+            invalid_bids.append(bid)
+
+    # Addresses fit in 160 bits, so a single integer key gives (max_price, address) ordering
+    valid_bids.sort(key=lambda bid: (bid.max_price << 160) | int(bid.bidder, 16), reverse=True)
+    invalid_bids.sort(key=lambda bid: int(bid.bidder, 16), reverse=True)
+
+    max_prices = [bid.max_price for bid in valid_bids]
+    totals = list(accumulate(bid.bid_amount for bid in valid_bids))
+
+    # totals rise while max prices fall, so the first bid where the running total reaches
+    # its max price can be found with a binary search
+    count = len(valid_bids)
+    clearing_index = bisect_left(range(count), True, key=lambda i: totals[i] >= max_prices[i])
+
+    if clearing_index < count:
+        realized_max_price = max_prices[clearing_index]
+        # Every bid at the clearing price is included
+        last_index = bisect_left(range(count), True, lo=clearing_index, key=lambda i: max_prices[i] < realized_max_price) - 1
+        total_bid = totals[last_index]
+    else:
+        realized_max_price = 0
+        total_bid = totals[-1] if totals else 0
 
     # If lowest max price not exceeded, total bid amount is realized
     if realized_max_price == 0:
         realized_max_price = total_bid
 
-    ordered_bids = valid_bids + list(reversed(sorted(invalid_bids, key=lambda x: bytes.fromhex(x.bidder[2:]))))
+    return RankedBidResult(valid_bids + invalid_bids, realized_max_price, total_bid)
+
 
-    #bids_filled_at_price = total_bids_at_price - (total_bid - realized_max_price)
-    return RankedBidResult(ordered_bids, realized_max_price, total_bid)
+@timed("bidder")
+def rank_bid_result(contract_address, bids: List[RevealedBid]) -> RankedBidResult:
+    contract = DAODutchAuction(contract_address)
+    bidders = [bid.bidder for bid in bids]
+    locked_eth = dict(zip(bidders, batch_call([contract.functions.lockedEth(bidder) for bidder in bidders])))
+    return rank_bids(bids, locked_eth)
@@ -1,21 +1,33 @@
+# Heavy modules (web3, py_ecc, contract artifacts) are imported inside the commands
+# that need them, so `--help` and argument errors don't pay for them
 import click
-from crypto import normalize, generate_keypair
-
-from accounts import get_account
-from contracts import DAODutchAuction, TestERC20
-from client import web3
-from bidder import Bidder, get_all_bids, decrypt_bids, rank_bid_result
 
 import os
 keys_dir = os.path.dirname(__file__)
 relative_path = "../keys/"
 full_path = os.path.join(keys_dir, relative_path)
 
+BID_INDEX_PATH = "./bid-index.sqlite"
+PROOFS_PATH = "./decryption-proofs.json"
+REPORT_PATH = "./settlement-report.csv"
+
 @click.group()
-def cli():
-    pass
+@click.option("--endpoint", help="Node http(s)/ws(s) URI or IPC path, defaults to $WEB3_PROVIDER_URI")
+@click.option("--profile", is_flag=True, help="Print time spent per RPC method, contract function, bidder step and crypto primitive")
+@click.option("--profile-out", help="Also write a cProfile dump, or a Chrome trace if the path ends in .json")
+@click.pass_context
+def cli(ctx, endpoint, profile, profile_out):
+    if endpoint:
+        from client import configure
+        configure(endpoint)
+    if profile or profile_out:
+        import profiling
+        profiling.enable(profile_out)
+        ctx.call_on_close(profiling.finish)
 
 def commit(deployed_auction, address, priv_pub):
+    from crypto import normalize, generate_keypair
+
     # generate keypair
     if priv_pub == None:
         priv_pub = {'priv': None, 'pub': None}
@@ -58,6 +70,8 @@ def reveal(deployed_auction, address, priv_pub):
 @click.option("-pr", "--privatekey", "private_key")
 @click.option("-pu", "--publickey", "public_key")
 def execute(contract_address, endpoint, address, private_key, public_key):
+    from contracts import DAODutchAuction
+
     deployed_auction = DAODutchAuction(contract_address)
     priv_pub = {'priv': private_key, 'pub': public_key}
     if endpoint == 'commit':
@@ -67,16 +81,178 @@ def execute(contract_address, endpoint, address, private_key, public_key):
 
 
 @cli.command()
-def solve():
+@click.option("--account-index", default=0, help="Account submitting the result")
+def solve(account_index):
+    """ Decrypts, ranks and reveals all bids without prompting, resuming any partial reveal """
+    from accounts import get_account
+    from bidder import decrypt_bids, rank_bid_result
+    from contracts import DAODutchAuction
+    from settlement import submit_reveal
+
     contract_address = load_contract_address()
     deployed_auction = DAODutchAuction(contract_address)
-    # deployed_auction.revealAllBids(addresses)
+
+    dec_bids = decrypt_bids(contract_address, local=True, db_path=BID_INDEX_PATH)
+    ranked_results = rank_bid_result(contract_address, dec_bids)
+    ordered_addrs = [bid.bidder for bid in ranked_results.ordered_bids]
+
+    sender_account = get_account(account_index)
+    echo_reveal(submit_reveal(deployed_auction, ordered_addrs, sender_account.address))
+
+    results = deployed_auction.functions.results(sender_account.address).call()
+    print(f"Realized price: {results[0]} wei")
+    print(f"Included bids: {results[1]} wei")
+
+
+@cli.command()
+@click.option("--account-index", default=0, help="Account proposing the result and posting the bond")
+@click.option("--interval", default=15.0, help="Seconds between checks for challenges")
+def propose(account_index, interval):
+    """ Proposes the locally computed result for optimistic settlement, answers challenges and finalizes it """
+    import time
+    from accounts import get_account
+    from contracts import DAODutchAuction
+    from optimistic import SettlementProposer, compute_leaves, final_result, propose_settlement
+    from settlement import ZERO_ADDRESS
+
+    contract_address = load_contract_address()
+    deployed_auction = DAODutchAuction(contract_address)
+    sender = get_account(account_index).address
+
+    leaves = compute_leaves(contract_address, BID_INDEX_PATH)
+    proposer = SettlementProposer(contract_address, sender, leaves)
+    if proposer.proposal()[0] == ZERO_ADDRESS:
+        propose_settlement(contract_address, sender, leaves)
+    realized_price, total_bid = final_result((leaves[-1].result_max_price, leaves[-1].result_total_bid))
+    print(f"Proposed realized price {realized_price} wei, total bid {total_bid} wei for {len(leaves)} bids")
+
+    while proposer.step():
+        time.sleep(interval)
+
+    if deployed_auction.functions.resultSubmitter().call() == sender:
+        print("Settlement finalized")
+    else:
+        print("Proposal is no longer pending")
+
+
+@cli.command()
+@click.option("--account-index", default=0, help="Account disputing proposals and posting the bond")
+@click.option("--interval", default=15.0, help="Seconds between checks for proposals and opened leaves")
+def challenger(account_index, interval):
+    """ Recomputes the result locally and disputes settlement proposals that differ from it """
+    import time
+    from accounts import get_account
+    from bidder import decrypt_bids
+    from contracts import DAODutchAuction
+    from optimistic import SettlementChallenger, compute_leaves
+    from settlement import ZERO_ADDRESS
+
+    contract_address = load_contract_address()
+    deployed_auction = DAODutchAuction(contract_address)
+
+    dec_bids = decrypt_bids(contract_address, local=True, db_path=BID_INDEX_PATH)
+    settlement_challenger = SettlementChallenger(
+        contract_address,
+        get_account(account_index).address,
+        compute_leaves(contract_address, bids=dec_bids),
+    )
+    realized_price, total_bid = settlement_challenger.expected_result()
+    print(f"Expecting realized price {realized_price} wei, total bid {total_bid} wei")
+
+    while deployed_auction.functions.resultSubmitter().call() == ZERO_ADDRESS:
+        period_over = settlement_challenger.challenge_period_over
+        settlement_challenger.step()
+        if settlement_challenger.challenge_period_over and not period_over:
+            click.echo("Challenge period is over, the differing proposal can no longer be disputed")
+        time.sleep(interval)
+    print("Auction settled")
+
+
+@cli.command()
+@click.option("--out", "proofs_path", default=PROOFS_PATH, help="File to write the proofs to")
+def prove_decryption(proofs_path):
+    """ Writes the shared key of every bid with a proof that it matches the master public key """
+    import json
+    from dataclasses import asdict
+    from bidder import get_all_bids, get_master_private_key, prove_decryptions
+
+    contract_address = load_contract_address()
+    enc_bids = get_all_bids(contract_address, BID_INDEX_PATH)
+    proofs = prove_decryptions(enc_bids, get_master_private_key(contract_address))
+
+    with open(proofs_path, "w") as f:
+        json.dump([asdict(proof) for proof in proofs], f)
+    print(f"Wrote {len(proofs)} decryption proofs to {proofs_path}")
+
+
+@cli.command()
+@click.option("--proofs", "proofs_path", default=PROOFS_PATH, help="File with the decryption proofs")
+def verify_proofs(proofs_path):
+    """ Verifies the decryption proof of every bid in the auction and prints the decrypted bids """
+    import json
+    from bidder import DecryptionProof, get_all_bids, master_public_key, verify_decryptions
+    from client import web3
+
+    contract_address = load_contract_address()
+    with open(proofs_path) as f:
+        proofs = [DecryptionProof(p["bidder"], tuple(p["shared_key"]), p["challenge"], p["response"]) for p in json.load(f)]
+
+    enc_bids = get_all_bids(contract_address, BID_INDEX_PATH)
+    dec_bids = verify_decryptions(enc_bids, master_public_key(contract_address), proofs)
+
+    for bid in dec_bids:
+        bid_amount_eth = web3.fromWei(bid.bid_amount, "ether")
+        max_price_eth = web3.fromWei(bid.max_price, "ether")
+        print(f"{bid.bidder}: bid amount {bid_amount_eth} ETH, max price {max_price_eth} ETH")
+    print(f"All {len(dec_bids)} decryption proofs are valid")
+
+
+@cli.command()
+@click.option("--interval", default=2.0, help="Seconds between polls when not subscribed")
+@click.option("--from-block", default=0, help="First block to aggregate events from")
+@click.option("--ws", "ws_uri", default=None, help="WebSocket endpoint to subscribe to, defaults to --endpoint if it is one")
+def monitor(interval, from_block, ws_uri):
+    """ Follows bids and key events live, printing running totals """
+    from monitor import AuctionMonitor
+
+    auction_monitor = AuctionMonitor(load_contract_address(), from_block)
+    try:
+        auction_monitor.run(interval, ws_uri)
+    except KeyboardInterrupt:
+        print(auction_monitor.stats.summary())
+
+
+@cli.command()
+@click.option("--out", "report_path", default=REPORT_PATH, help="Report file, written as Parquet if it ends in .parquet")
+@click.option("--block", default="latest", help="Block to read locked ETH at, the settlement block if bidders already withdrew")
+@click.option("--reconcile", "check", is_flag=True, help="Check the written report against the on-chain balances")
+def report(report_path, block, check):
+    """ Exports the token shares and ETH refund of every bid in the settled auction """
+    from report import payout_rows, reconcile, write_report
+
+    contract_address = load_contract_address()
+    block_identifier = int(block) if block.isdigit() else block
+    count = write_report(payout_rows(contract_address, BID_INDEX_PATH, block_identifier), report_path)
+    print(f"Wrote {count} payouts to {report_path}")
+
+    if check:
+        mismatches = 0
+        for mismatch in reconcile(contract_address, report_path):
+            print(mismatch)
+            mismatches += 1
+        print(f"{mismatches} mismatches with the chain")
 
 
 @cli.command()
 def get_bids():
+    from accounts import get_account
+    from bidder import get_all_bids, decrypt_bids, rank_bid_result
+    from client import web3
+    from contracts import DAODutchAuction
+    from settlement import submit_reveal
+
     contract_address = load_contract_address()
-    enc_bids = get_all_bids(contract_address)
+    enc_bids = get_all_bids(contract_address, BID_INDEX_PATH)
     for index, bid in enumerate(enc_bids):
         print(f"Bid #{index}:")
         print(f"Bidder: {bid.bidder}")
@@ -94,7 +270,7 @@ def get_bids():
     click.confirm("Master private key has been revealed... decrypt the bids?")
     
     # deployed_auction.revealAllBids(addresses)
-    dec_bids = decrypt_bids(contract_address)
+    dec_bids = decrypt_bids(contract_address, local=True, db_path=BID_INDEX_PATH)
 
     for index, bid in enumerate(dec_bids):
         print(f"Bid #{index}:")
@@ -110,7 +286,7 @@ def get_bids():
     ordered_addrs = [bid.bidder for bid in ranked_results.ordered_bids]
 
     sender_account = get_account(0)
-    deployed_auction.functions.revealAllBids(ordered_addrs).transact({"from": sender_account.address})
+    echo_reveal(submit_reveal(deployed_auction, ordered_addrs, sender_account.address))
 
     print("\nAuction results")
     results = deployed_auction.functions.results(sender_account.address).call()
@@ -123,9 +299,14 @@ def get_bids():
 @cli.command()
 @click.argument("address")
 def withdraw(address):
+    from accounts import get_account
+    from client import web3
+    from contracts import DAODutchAuction, TestERC20
+
     sender = get_account(99)
     contract_address = load_contract_address()
     deployed_contract = DAODutchAuction(contract_address)
+    address = web3.toChecksumAddress(address)
 
     click.prompt(f"Withdrawing funds for {address}. Continue?")
     current_balance = web3.eth.get_balance(address)
@@ -146,13 +327,42 @@ def withdraw(address):
     print(f"Rewarded {token_balance_eth} ETH worth of voting tokens")
 
 
+@cli.command()
+@click.option("--account-index", default=99, help="Account sending the withdrawMany transactions")
+def payout(account_index):
+    """ Pays out every indexed bidder that hasn't withdrawn yet, in gas-bounded withdrawMany batches """
+    from accounts import get_account
+    from bidder import get_all_bids
+    from contracts import DAODutchAuction
+    from settlement import submit_withdrawals
+
+    contract_address = load_contract_address()
+    deployed_auction = DAODutchAuction(contract_address)
+
+    enc_bids = get_all_bids(contract_address, BID_INDEX_PATH)
+    submission = submit_withdrawals(
+        deployed_auction, [enc_bid.bidder for enc_bid in enc_bids], get_account(account_index).address
+    )
+    click.echo(
+        f"Paid out {submission.sent} bidders in {len(submission.receipts)} transactions "
+        f"({submission.skipped} already paid), used {submission.gas_used} gas"
+    )
+    for recipient in submission.unpaid:
+        click.echo(f"Skipped {recipient}: no bid or ETH rejected, its ETH stays locked")
+
+
 
 @cli.command()
 @click.argument("auctioneer_count")
-def deploy(auctioneer_count):
-    auctioneers = []
-    for i in range(int(auctioneer_count)):
-        auctioneers.append(get_account(i).address)
+@click.option("--workers", default=1, help="Processes deriving auctioneer accounts and keys")
+def deploy(auctioneer_count, workers):
+    from accounts import derive_accounts
+    from bidder import generate_keypairs
+    from client import web3
+    from contracts import DAODutchAuction
+    from crypto import normalize
+
+    auctioneers = [account.address for account in derive_accounts(range(int(auctioneer_count)), workers)]
     auctioneers = sorted(auctioneers, key=lambda x: bytes.fromhex(x[2:]))
 
     for i, auctioneer in enumerate(auctioneers):
@@ -177,8 +387,7 @@ def deploy(auctioneer_count):
 
     auctioneer_keys = {}
 
-    for auctioneer in auctioneers:
-        priv, pub = generate_keypair()
+    for auctioneer, (priv, pub) in zip(auctioneers, generate_keypairs(len(auctioneers), workers)):
         auctioneer_keys[auctioneer] = {
             "priv": priv,
             "pub": pub
@@ -199,10 +408,26 @@ def deploy(auctioneer_count):
         deployed_auction.functions.revealPrivateKey(index, key).transact({"from": auctioneer})
 
 @cli.command()
-def autobid():
+@click.option("--bulk", is_flag=True, help="Stream bids without prompts, signing and sending them concurrently")
+@click.option("--file", "bids_file", default="preset-bids.txt", help="File with bid_amount, max_price, send_eth lines")
+@click.option("--in-flight", default=32, help="Maximum pending transactions in bulk mode")
+@click.option("--accounts", "account_count", default=100, help="Accounts to place bids from in bulk mode")
+@click.option("--workers", default=1, help="Processes deriving the bulk mode accounts")
+def autobid(bulk, bids_file, in_flight, account_count, workers):
+    from accounts import get_account
+
     contract_address = load_contract_address()
 
-    with open("preset-bids.txt") as f:
+    if bulk:
+        from accounts import derive_accounts
+        from autobid import read_bids, submit_bids
+
+        accounts = dict(enumerate(derive_accounts(range(account_count), workers)))
+        stats = submit_bids(contract_address, read_bids(bids_file, account_count), in_flight, accounts)
+        print(stats.summary())
+        return
+
+    with open(bids_file) as f:
         bidlines = f.readlines()
 
     print(f"Loaded {len(bidlines)} preset bids")
@@ -213,7 +438,11 @@ def autobid():
         place_bid(contract_address, account, bid_data[0], bid_data[1], bid_data[2])
 
 
-def place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth):
+def place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth, commit=False):
+    from bidder import Bidder
+    from client import web3
+    from crypto import normalize
+
     bid_amount = web3.toWei(bid_amount_eth, "ether")
     max_price = web3.toWei(max_price_eth, "ether")
     send_wei = web3.toWei(send_eth, "ether")
@@ -226,12 +455,14 @@ def place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth
     print(f"Bid amount:  {bid_amount_eth} ETH")
     print(f"ETH to send: {send_eth} ETH")
     click.confirm("Ready to place bid?")
-    bidder.bid(bid_amount, max_price, send_wei)
+    bidder.bid(bid_amount, max_price, send_wei, commit=commit)
     print(f"Bid sucessful")
 
     bid_data = bidder.contract.functions.bids(account.address).call()
-    print(f"Encrypted bid amount: {bid_data[1]}")
-    print(f"Encrypted max price:  {bid_data[2]}")
+    print(f"Encrypted bid amount: {bid_data[0]}")
+    print(f"Encrypted max price:  {bid_data[1]}")
+    if commit:
+        print(f"Commitment: {bid_data[3].hex()}")
 
 
 @cli.command()
@@ -239,10 +470,22 @@ def place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth
 @click.argument("bid_amount_eth")
 @click.argument("max_price_eth")
 @click.argument("send_eth")
-def bid(account_index, bid_amount_eth, max_price_eth, send_eth):
+@click.option("--commit", is_flag=True, help="Commit to the plaintext, the bid is only valid if it decrypts to it")
+def bid(account_index, bid_amount_eth, max_price_eth, send_eth, commit):
+    from accounts import get_account
+
     account = get_account(int(account_index))
     contract_address = load_contract_address()
-    place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth)
+    place_bid(contract_address, account, bid_amount_eth, max_price_eth, send_eth, commit)
+
+
+def echo_reveal(submission):
+    if submission.reset:
+        click.echo("Posted bids did not match the ordered bids, reset them")
+    click.echo(
+        f"Revealed {submission.sent} bids in {len(submission.receipts)} transactions "
+        f"({submission.skipped} already posted), used {submission.gas_used} gas"
+    )
 
 
 def load_contract_address() -> str:
@@ -1,4 +1,202 @@
+import asyncio
+import json
+import os
+import time
+from itertools import count
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+import requests
+from hexbytes import HexBytes
+from requests.adapters import HTTPAdapter
 from web3 import Web3
+from web3._utils.abi import get_abi_output_types, map_abi_data
+from web3._utils.normalizers import BASE_RETURN_NORMALIZERS
+from web3._utils.request import make_post_request
+from web3.exceptions import ContractLogicError
+from web3.providers import HTTPProvider, IPCProvider, WebsocketProvider
+from web3.providers.auto import AutoProvider
+from websockets.exceptions import ConnectionClosed
+
+import profiling
+
+# Node endpoint, an http(s):// or ws(s):// URI or an IPC socket path. When unset,
+# web3 auto-detects a local node
+PROVIDER_URI_ENV = "WEB3_PROVIDER_URI"
+# Seconds before a single request to the node times out
+REQUEST_TIMEOUT = 30
+# Kept-alive HTTP connections, enough for every bid in flight in autobid --bulk
+HTTP_POOL_SIZE = 64
+# Reads are retried on transport errors, waiting RETRY_BACKOFF * 2^attempt seconds in between
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.25
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Idempotent methods, safe to send again when the first attempt may have reached the node
+READ_METHODS = {
+    "eth_blockNumber", "eth_call", "eth_chainId", "eth_estimateGas", "eth_feeHistory", "eth_gasPrice",
+    "eth_getBalance", "eth_getBlockByHash", "eth_getBlockByNumber", "eth_getCode", "eth_getLogs",
+    "eth_getStorageAt", "eth_getTransactionByHash", "eth_getTransactionCount", "eth_getTransactionReceipt",
+    "eth_maxPriorityFeePerGas", "eth_syncing", "net_version", "web3_clientVersion",
+}
+
+# Maximum number of requests sent in a single JSON-RPC batch payload
+BATCH_SIZE = 500
+
+_request_ids = count()
+
+
+class PooledHTTPProvider(HTTPProvider):
+    """ HTTPProvider sharing one keep-alive session with a sized connection pool across all threads
+
+        web3's own session cache is per thread, so every worker thread would open its own connections.
+        Retries are left to retry_middleware.
+    """
+    _middlewares = ()
+
+    def __init__(self, endpoint_uri, pool_size=HTTP_POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        super().__init__(endpoint_uri, request_kwargs={"timeout": timeout})
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def post(self, data: bytes) -> bytes:
+        response = self.session.post(self.endpoint_uri, data=data, **self.get_request_kwargs())
+        response.raise_for_status()
+        return response.content
+
+    def make_request(self, method, params):
+        return self.decode_rpc_response(self.post(self.encode_rpc_request(method, params)))
+
+
+def make_provider(endpoint: Optional[str] = None):
+    """ Provider for endpoint, or for the WEB3_PROVIDER_URI environment variable if not given
+    """
+    endpoint = endpoint or os.environ.get(PROVIDER_URI_ENV)
+    if not endpoint:
+        return AutoProvider()
+    if endpoint.startswith(("http://", "https://")):
+        return PooledHTTPProvider(endpoint)
+    if endpoint.startswith(("ws://", "wss://")):
+        return WebsocketProvider(endpoint, websocket_timeout=REQUEST_TIMEOUT)
+    return IPCProvider(endpoint, timeout=REQUEST_TIMEOUT)
+
+
+def _is_transient(error: Exception) -> bool:
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUS_CODES
+    return isinstance(error, (
+        requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError, asyncio.TimeoutError, ConnectionClosed,
+    ))
+
+
+def with_retries(send: Callable[[], Any]) -> Any:
+    """ Calls send, retrying with exponential backoff while it fails with a transient transport error
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return send()
+        except Exception as e:
+            if attempt == MAX_RETRIES or not _is_transient(e):
+                raise
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
 
-web3 = Web3()
+def retry_middleware(make_request, w3):
+    def middleware(method, params):
+        if method not in READ_METHODS:
+            return make_request(method, params)
+        return with_retries(lambda: make_request(method, params))
+    return middleware
+
+
+web3 = Web3(make_provider())
+web3.middleware_onion.add(retry_middleware, "retry")
 web3.eth.account.enable_unaudited_hdwallet_features()
+
+
+def configure(endpoint: Optional[str] = None):
+    """ Points the shared web3 instance at endpoint, every module uses this instance
+    """
+    web3.provider = make_provider(endpoint)
+
+
+def _http_provider():
+    provider = web3.provider
+    if isinstance(provider, AutoProvider):
+        provider = provider._get_active_provider(use_cache=True)
+    return provider if isinstance(provider, HTTPProvider) else None
+
+
+def _post(provider, data: bytes) -> bytes:
+    if isinstance(provider, PooledHTTPProvider):
+        return provider.post(data)
+    return make_post_request(provider.endpoint_uri, data, **provider.get_request_kwargs())
+
+
+def batch_request(calls: Sequence[Tuple[str, list]]) -> List[dict]:
+    """ Sends (method, params) pairs as JSON-RPC batches, returns the raw responses in order
+
+        Providers without batch support get the calls one at a time.
+    """
+    provider = _http_provider()
+    if provider is None:
+        def send(method, params):
+            if method in READ_METHODS:
+                return with_retries(lambda: web3.provider.make_request(method, params))
+            return web3.provider.make_request(method, params)
+        return [profiling.traced_rpc(send, method, params) for method, params in calls]
+
+    responses = []
+    for start in range(0, len(calls), BATCH_SIZE):
+        payload = [
+            {"jsonrpc": "2.0", "method": method, "params": params, "id": next(_request_ids)}
+            for method, params in calls[start:start + BATCH_SIZE]
+        ]
+        data = json.dumps(payload).encode()
+        started = time.perf_counter()
+        if all(request["method"] in READ_METHODS for request in payload):
+            raw_response = with_retries(lambda: _post(provider, data))
+        else:
+            raw_response = _post(provider, data)
+        if profiling.ENABLED:
+            # One round trip for the whole batch, its time is split evenly across the requests
+            seconds = (time.perf_counter() - started) / len(payload)
+            for request in payload:
+                profiling.record_rpc(request["method"], request["params"], started, seconds)
+        decoded = json.loads(raw_response)
+        if isinstance(decoded, dict):
+            # Node rejected the batch as a whole
+            raise ValueError(decoded.get("error", decoded))
+        by_id = {response["id"]: response for response in decoded}
+        responses.extend(by_id[request["id"]] for request in payload)
+
+    return responses
+
+
+def batch_call(calls, block_identifier="latest", allow_failure=False) -> List[Any]:
+    """ Executes contract function calls, e.g. contract.functions.lockedEth(bidder),
+        with as few round trips as possible. Returns the decoded results in order.
+
+        With allow_failure, reverted calls return None instead of raising.
+    """
+    rpc_calls = [
+        ("eth_call", [{"to": call.address, "data": call._encode_transaction_data()}, block_identifier])
+        for call in calls
+    ]
+
+    results = []
+    for call, response in zip(calls, batch_request(rpc_calls)):
+        output_types = get_abi_output_types(call.abi)
+        data = HexBytes(response.get("result") or b"")
+        if "error" in response or (output_types and not data):
+            if allow_failure:
+                results.append(None)
+                continue
+            error = response.get("error", "execution reverted")
+            raise ContractLogicError(error.get("message") if isinstance(error, dict) else error)
+
+        decoded = map_abi_data(BASE_RETURN_NORMALIZERS, output_types, web3.codec.decode_abi(output_types, data))
+        results.append(decoded[0] if len(decoded) == 1 else list(decoded))
+
+    return results
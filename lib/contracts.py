@@ -1,17 +1,44 @@
 import json
 import os
-from web3 import Web3
+from functools import lru_cache
+
+from client import web3
 
 script_dir = os.path.dirname(__file__)
 relative_build_dir = "../brownie/build/contracts"
 
-# TODO: move these instances to a central location
-web3 = Web3()
-
 CONTRACT_NAMES = ["DAODutchAuction", "TestERC20"]
 
-for name in CONTRACT_NAMES:
+
+@lru_cache(maxsize=None)
+def contract_factory(name):
     artifact_path = os.path.join(script_dir, relative_build_dir, f"{name}.json")
     with open(artifact_path) as f:
         build_json = json.load(f)
-        globals()[name] = web3.eth.contract(abi=build_json["abi"], bytecode=build_json["bytecode"])
+        return web3.eth.contract(abi=build_json["abi"], bytecode=build_json["bytecode"])
+
+
+class LazyContract:
+    """ Stands in for a web3 contract factory until it is first used
+
+        The build artifact is only parsed on first access, and calling it with an
+        address returns a contract instance that is cached per address.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.instances = {}
+
+    def __call__(self, address):
+        instance = self.instances.get(address)
+        if instance is None:
+            instance = contract_factory(self.name)(address)
+            self.instances[address] = instance
+        return instance
+
+    def __getattr__(self, attr):
+        return getattr(contract_factory(self.name), attr)
+
+
+for name in CONTRACT_NAMES:
+    globals()[name] = LazyContract(name)
@@ -0,0 +1,178 @@
+import sqlite3
+from typing import Iterator, List
+
+from eth_utils import event_abi_to_log_topic
+
+from bidder import EncryptedBid
+from client import web3, batch_request
+from crypto import decompress_point
+from contracts import DAODutchAuction
+
+# Block ranges are grown while nodes answer quickly and shrunk when a request fails,
+# most nodes cap either the range or the number of logs returned by eth_getLogs
+INITIAL_BLOCK_RANGE = 2000
+MAX_BLOCK_RANGE = 100000
+TARGET_LOGS_PER_REQUEST = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cursors (
+    contract TEXT PRIMARY KEY,
+    next_block INTEGER NOT NULL,
+    block_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS bids (
+    contract TEXT NOT NULL,
+    bidder TEXT NOT NULL,
+    encrypted_bid_amount TEXT NOT NULL,
+    encrypted_max_price TEXT NOT NULL,
+    public_key_x TEXT NOT NULL,
+    public_key_y TEXT NOT NULL,
+    block_number INTEGER NOT NULL,
+    log_index INTEGER NOT NULL,
+    commitment TEXT,
+    PRIMARY KEY (contract, bidder)
+);
+"""
+
+
+class BidIndexer:
+    """ Incrementally indexes BidSubmitted events into a SQLite table
+
+        Only the last bid of every bidder is kept, which matches the bids mapping on chain.
+        The scan cursor is stored with the hash of the last scanned block, if that block is
+        no longer part of the chain (reorg or a restarted devnet) the index is rebuilt.
+    """
+
+    def __init__(self, contract_address, db_path=":memory:", from_block=0):
+        self.contract = DAODutchAuction(contract_address)
+        self.contract_address = self.contract.address
+        self.from_block = from_block
+        self.block_range = INITIAL_BLOCK_RANGE
+
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        # Indexes created before bids carried commitments only hold uncommitted bids
+        if "commitment" not in [column[1] for column in self.db.execute("PRAGMA table_info(bids)")]:
+            self.db.execute("ALTER TABLE bids ADD COLUMN commitment TEXT")
+
+        event_abi = self.contract.events.BidSubmitted._get_event_abi()
+        self.topic = "0x" + event_abi_to_log_topic(event_abi).hex()
+
+    def _cursor(self):
+        row = self.db.execute(
+            "SELECT next_block, block_hash FROM cursors WHERE contract = ?", (self.contract_address,)
+        ).fetchone()
+        return row if row else (self.from_block, None)
+
+    def _reset(self):
+        with self.db:
+            self.db.execute("DELETE FROM bids WHERE contract = ?", (self.contract_address,))
+            self.db.execute("DELETE FROM cursors WHERE contract = ?", (self.contract_address,))
+
+    def _store(self, logs, last_block):
+        rows = []
+        for log in logs:
+            args = self.contract.events.BidSubmitted().processLog(log).args
+            # Keys that are not on the curve are kept as (compressed key, 0), such bids are invalid
+            public_key = decompress_point(args.bidderPublicKey) or (args.bidderPublicKey, 0)
+            rows.append((
+                self.contract_address,
+                args.bidder,
+                str(args.encryptedBidAmount),
+                str(args.encryptedMaxPrice),
+                str(public_key[0]),
+                str(public_key[1]),
+                log["blockNumber"],
+                log["logIndex"],
+                args.commitment.hex() if any(args.commitment) else None,
+            ))
+
+        with self.db:
+            self.db.executemany(
+                """
+                INSERT INTO bids VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (contract, bidder) DO UPDATE SET
+                    encrypted_bid_amount = excluded.encrypted_bid_amount,
+                    encrypted_max_price = excluded.encrypted_max_price,
+                    public_key_x = excluded.public_key_x,
+                    public_key_y = excluded.public_key_y,
+                    block_number = excluded.block_number,
+                    log_index = excluded.log_index,
+                    commitment = excluded.commitment
+                WHERE (excluded.block_number, excluded.log_index) > (bids.block_number, bids.log_index)
+                """,
+                rows,
+            )
+            self.db.execute(
+                "INSERT OR REPLACE INTO cursors VALUES (?, ?, ?)",
+                (self.contract_address, last_block["number"] + 1, last_block["hash"].hex()),
+            )
+
+    def sync(self, to_block=None) -> int:
+        """ Scans all blocks since the last sync, returns the number of new BidSubmitted logs
+        """
+        next_block, block_hash = self._cursor()
+
+        # Fetch the chain head and check the cursor block in one round trip
+        requests = [("eth_blockNumber", [])]
+        if block_hash is not None:
+            requests.append(("eth_getBlockByNumber", [hex(next_block - 1), False]))
+        responses = batch_request(requests)
+
+        if block_hash is not None:
+            cursor_block = responses[1].get("result")
+            if cursor_block is None or cursor_block["hash"] != block_hash:
+                self._reset()
+                next_block = self.from_block
+
+        if to_block is None:
+            to_block = int(responses[0]["result"], 16)
+
+        log_count = 0
+        while next_block <= to_block:
+            end_block = min(next_block + self.block_range - 1, to_block)
+            try:
+                logs = web3.eth.get_logs({
+                    "address": self.contract_address,
+                    "topics": [self.topic],
+                    "fromBlock": next_block,
+                    "toBlock": end_block,
+                })
+            except ValueError:
+                # Range too large for the node, retry with a smaller one
+                if self.block_range == 1:
+                    raise
+                self.block_range = max(1, self.block_range // 2)
+                continue
+
+            self._store(logs, web3.eth.get_block(end_block))
+            log_count += len(logs)
+            next_block = end_block + 1
+
+            if len(logs) < TARGET_LOGS_PER_REQUEST // 2:
+                self.block_range = min(MAX_BLOCK_RANGE, self.block_range * 2)
+            elif len(logs) > TARGET_LOGS_PER_REQUEST:
+                self.block_range = max(1, self.block_range // 2)
+
+        return log_count
+
+    def iter_bids(self) -> Iterator[EncryptedBid]:
+        """ Streams the indexed bids without loading them all into memory
+        """
+        rows = self.db.execute(
+            """
+            SELECT bidder, encrypted_bid_amount, encrypted_max_price, public_key_x, public_key_y, commitment
+            FROM bids WHERE contract = ? ORDER BY block_number, log_index
+            """,
+            (self.contract_address,),
+        )
+        for bidder, amount, max_price, x, y, commitment in rows:
+            yield EncryptedBid(
+                bidder, int(amount), int(max_price), (int(x), int(y)), bytes.fromhex(commitment) if commitment else None
+            )
+
+    def bids(self) -> List[EncryptedBid]:
+        return list(self.iter_bids())
+
+    def close(self):
+        self.db.close()
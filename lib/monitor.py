@@ -0,0 +1,172 @@
+import asyncio
+import json
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from eth_utils import event_abi_to_log_topic
+from hexbytes import HexBytes
+from web3.providers import WebsocketProvider
+
+from bidder import auctioneers
+from client import batch_call, web3
+from contracts import DAODutchAuction
+from settlement import ZERO_ADDRESS
+
+MONITORED_EVENTS = ["BidSubmitted", "PublicKeySet", "PrivateKeyRevealed"]
+# Largest block range scanned with a single eth_getLogs while catching up
+MAX_BLOCK_RANGE = 5000
+# Number of most recent blocks with bids that bids per block is averaged over
+RATE_WINDOW = 100
+
+
+@dataclass
+class AuctionStats:
+    """ Running aggregates, memory use doesn't grow with the number of bids or blocks
+    """
+    auctioneer_count: int
+    bid_count: int = 0
+    locked_wei: int = 0
+    public_keys_set: int = 0
+    private_keys_revealed: int = 0
+    last_block: int = 0
+    # (block number, bids in block) for the last RATE_WINDOW blocks that had bids
+    recent_blocks: deque = field(default_factory=lambda: deque(maxlen=RATE_WINDOW))
+
+    def add_bids(self, block_number: int, count: int):
+        self.bid_count += count
+        if self.recent_blocks and self.recent_blocks[-1][0] == block_number:
+            self.recent_blocks[-1] = (block_number, self.recent_blocks[-1][1] + count)
+        else:
+            self.recent_blocks.append((block_number, count))
+
+    @property
+    def bids_per_block(self) -> float:
+        if not self.recent_blocks:
+            return 0.0
+        blocks = max(self.last_block, self.recent_blocks[-1][0]) - self.recent_blocks[0][0] + 1
+        return sum(count for _, count in self.recent_blocks) / blocks
+
+    def summary(self) -> str:
+        return (
+            f"Block {self.last_block} | {self.bid_count} bids, {self.bids_per_block:.2f} per block | "
+            f"locked {web3.fromWei(self.locked_wei, 'ether')} ETH | "
+            f"keys set {self.public_keys_set}/{self.auctioneer_count}, "
+            f"revealed {self.private_keys_revealed}/{self.auctioneer_count}"
+        )
+
+
+class AuctionMonitor:
+    """ Follows auction events from from_block on, either by polling eth_getLogs with a block
+        cursor or through an eth_subscribe WebSocket subscription
+    """
+
+    def __init__(self, contract_address, from_block=0):
+        self.contract = DAODutchAuction(contract_address)
+        self.contract_address = self.contract.address
+        self.next_block = from_block
+        self.stats = AuctionStats(len(auctioneers(contract_address)))
+
+        self.events = {}
+        for name in MONITORED_EVENTS:
+            event_abi = getattr(self.contract.events, name)._get_event_abi()
+            self.events[HexBytes(event_abi_to_log_topic(event_abi))] = name
+
+    def _filter(self) -> dict:
+        return {"address": self.contract_address, "topics": [[topic.hex() for topic in self.events]]}
+
+    def process(self, logs):
+        """ Folds logs into the aggregates, logs can come from eth_getLogs or a subscription
+        """
+        bids_by_block = {}
+        for log in logs:
+            name = self.events.get(HexBytes(log["topics"][0]))
+            block_number = log["blockNumber"]
+            if isinstance(block_number, str):
+                block_number = int(block_number, 16)
+            # Logs of blocks dropped in a reorg are sent again with removed set
+            sign = -1 if log.get("removed") else 1
+
+            if name == "BidSubmitted":
+                bids_by_block[block_number] = bids_by_block.get(block_number, 0) + sign
+            elif name == "PublicKeySet":
+                self.stats.public_keys_set += sign
+            elif name == "PrivateKeyRevealed":
+                self.stats.private_keys_revealed += sign
+            self.stats.last_block = max(self.stats.last_block, block_number)
+
+        for block_number in sorted(bids_by_block):
+            self.stats.add_bids(block_number, bids_by_block[block_number])
+
+    def refresh_locked(self, block_identifier="latest"):
+        # The auction holds the ETH locked by bidders until it is withdrawn, and the bonds of a
+        # pending settlement proposal and of its dispute
+        balance = web3.eth.get_balance(self.contract_address, block_identifier)
+        proposal, dispute, bond = batch_call([
+            self.contract.functions.proposal(),
+            self.contract.functions.dispute(),
+            self.contract.functions.SETTLEMENT_BOND(),
+        ], block_identifier)
+        bonds = bond * ((proposal[0] != ZERO_ADDRESS) + (dispute[0] != ZERO_ADDRESS))
+        self.stats.locked_wei = balance - bonds
+
+    def poll_once(self) -> bool:
+        """ Processes all blocks since the last poll, returns False if there were none
+        """
+        head = web3.eth.block_number
+        if head < self.next_block:
+            return False
+
+        while self.next_block <= head:
+            end_block = min(self.next_block + MAX_BLOCK_RANGE - 1, head)
+            logs = web3.eth.get_logs(dict(self._filter(), fromBlock=self.next_block, toBlock=end_block))
+            self.process(logs)
+            self.next_block = end_block + 1
+
+        self.stats.last_block = head
+        self.refresh_locked(head)
+        return True
+
+    def poll(self, interval=2.0):
+        while True:
+            if self.poll_once():
+                print(self.stats.summary())
+            time.sleep(interval)
+
+    async def _subscribe(self, endpoint_uri):
+        import websockets
+
+        async with websockets.connect(endpoint_uri) as ws:
+            await ws.send(json.dumps({"jsonrpc": "2.0", "id": 1, "method": "eth_subscribe", "params": ["logs", self._filter()]}))
+            response = json.loads(await ws.recv())
+            if "error" in response:
+                raise Exception(f"Subscription failed: {response['error']}")
+
+            # Catch up on history after subscribing so no block falls in between, logs of
+            # blocks already scanned are skipped below
+            await asyncio.get_running_loop().run_in_executor(None, self.poll_once)
+            print(self.stats.summary())
+
+            async for message in ws:
+                log = json.loads(message)["params"]["result"]
+                if not log.get("removed") and int(log["blockNumber"], 16) < self.next_block:
+                    continue
+                self.process([log])
+                self.refresh_locked()
+                print(self.stats.summary())
+
+    def subscribe(self, endpoint_uri):
+        asyncio.run(self._subscribe(endpoint_uri))
+
+    def run(self, interval=2.0, ws_uri=None):
+        """ Subscribes if a WebSocket endpoint is given or configured, polls otherwise
+        """
+        if ws_uri is None and isinstance(web3.provider, WebsocketProvider):
+            ws_uri = web3.provider.endpoint_uri
+
+        if ws_uri:
+            print(f"Subscribing to auction events over {ws_uri}")
+            self.subscribe(ws_uri)
+        else:
+            print(f"Polling auction events every {interval}s")
+            self.poll(interval)
@@ -0,0 +1,286 @@
+from dataclasses import astuple, dataclass
+from typing import Dict, List, Optional, Tuple
+
+from eth_abi import encode_abi
+from eth_utils import event_abi_to_log_topic
+from web3.exceptions import ContractLogicError
+
+from bidder import RevealedBid, decrypt_bids, rank_bids
+from client import web3, batch_call
+from contracts import DAODutchAuction
+from settlement import ZERO_ADDRESS
+
+LEAF_TYPES = ["uint256", "address", "uint256", "uint256", "bool", "uint256", "uint256"]
+EMPTY_NODE = b"\0" * 32
+
+
+@dataclass
+class SettlementLeaf:
+    """ Entry of the reveal order with the running result revealAllBids has after processing it
+    """
+    index: int
+    bidder: str
+    bid_amount: int
+    max_price: int
+    valid: bool
+    result_max_price: int
+    result_total_bid: int
+
+
+def next_result(result: Tuple[int, int], first: bool, valid: bool, bid_amount: int, max_price: int) -> Tuple[int, int]:
+    """ Mirrors _nextResult, (max price, total bid) after one more bid in reveal order
+    """
+    result_max_price, result_total_bid = result
+    if valid and first:
+        return max_price, bid_amount
+    if valid and result_max_price == max_price:
+        return result_max_price, result_total_bid + bid_amount
+    if valid and result_total_bid < result_max_price:
+        return max_price, result_total_bid + bid_amount
+    return result
+
+
+def final_result(result: Tuple[int, int]) -> Tuple[int, int]:
+    """ Mirrors _finalResult
+    """
+    result_max_price, result_total_bid = result
+    if result_total_bid < result_max_price:
+        return result_total_bid, result_total_bid
+    return result
+
+
+def settlement_leaves(bids: List[RevealedBid], locked_eth: Dict[str, int]) -> List[SettlementLeaf]:
+    result = (0, 0)
+    leaves = []
+    for index, bid in enumerate(rank_bids(bids, locked_eth).ordered_bids):
+        valid = bid.bid_amount <= bid.max_price and bid.bid_amount <= locked_eth[bid.bidder]
+        result = next_result(result, index == 0, valid, bid.bid_amount, bid.max_price)
+        leaves.append(SettlementLeaf(index, bid.bidder, bid.bid_amount, bid.max_price, valid, *result))
+    return leaves
+
+
+def leaf_hash(leaf: SettlementLeaf) -> bytes:
+    return bytes(web3.keccak(encode_abi(LEAF_TYPES, astuple(leaf))))
+
+
+class MerkleTree:
+    """ Tree over the leaf hashes padded with zero hashes to a power of two, as _verifyLeaf expects
+    """
+
+    def __init__(self, leaves: List[SettlementLeaf]):
+        size = 1
+        while size < len(leaves):
+            size *= 2
+        level = [leaf_hash(leaf) for leaf in leaves] + [EMPTY_NODE] * (size - len(leaves))
+        self.levels = [level]
+        while len(level) > 1:
+            level = [bytes(web3.keccak(level[i] + level[i + 1])) for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> List[bytes]:
+        proof = []
+        for level in self.levels[:-1]:
+            proof.append(level[index ^ 1])
+            index //= 2
+        return proof
+
+
+def compute_leaves(contract_address, db_path=":memory:", bids: Optional[List[RevealedBid]] = None) -> List[SettlementLeaf]:
+    """ Reveal order and running results of an auction whose keys are revealed, computed locally
+        unless the decrypted bids are given
+    """
+    contract = DAODutchAuction(contract_address)
+    if bids is None:
+        bids = decrypt_bids(contract_address, local=True, db_path=db_path)
+    locked = batch_call([contract.functions.lockedEth(bid.bidder) for bid in bids])
+    return settlement_leaves(bids, {bid.bidder: locked_eth for bid, locked_eth in zip(bids, locked)})
+
+
+def _leaf_args(leaf: Optional[SettlementLeaf]) -> tuple:
+    # The contract ignores the previous leaf of the first entry
+    return astuple(leaf) if leaf else (0, ZERO_ADDRESS, 0, 0, False, 0, 0)
+
+
+def _wait(function, sender, value=0):
+    tx_hash = function.transact({"from": sender, "value": value})
+    receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+    if receipt["status"] == 0:
+        raise Exception(f"{function.fn_name} failed")
+    return receipt
+
+
+def propose_settlement(contract_address, sender, leaves: List[SettlementLeaf]):
+    """ Posts the result of leaves with a Merkle root over them, bonding SETTLEMENT_BOND
+    """
+    contract = DAODutchAuction(contract_address)
+    max_price, total_bid = final_result((leaves[-1].result_max_price, leaves[-1].result_total_bid))
+    bond = contract.functions.SETTLEMENT_BOND().call()
+    return _wait(contract.functions.proposeSettlement(max_price, total_bid, MerkleTree(leaves).root), sender, bond)
+
+
+class SettlementParty:
+    """ Shared chain state lookups of the proposer and the challenger
+    """
+
+    def __init__(self, contract_address, sender, leaves: List[SettlementLeaf], from_block=0):
+        self.contract = DAODutchAuction(contract_address)
+        self.sender = sender
+        self.leaves = leaves
+        self.from_block = from_block
+
+    def proposal(self):
+        """ (proposer, proposed at, root, max price, total bid), proposer is the zero address if none
+        """
+        return self.contract.functions.proposal().call()
+
+    def dispute(self):
+        """ (challenger, deadline, proposer's turn, leaves requested, index), challenger is the zero address if none
+        """
+        return self.contract.functions.dispute().call()
+
+    def _logs(self, event, from_block):
+        topic = "0x" + event_abi_to_log_topic(event._get_event_abi()).hex()
+        logs = web3.eth.get_logs({"address": self.contract.address, "topics": [topic], "fromBlock": from_block})
+        return [event().processLog(log) for log in logs]
+
+    def opened_leaves(self) -> Dict[int, Tuple[SettlementLeaf, List[bytes]]]:
+        """ Leaves the proposer opened for the current proposal, with their proofs
+        """
+        proposals = self._logs(self.contract.events.SettlementProposed, self.from_block)
+        if not proposals:
+            return {}
+        opened = {}
+        for event in self._logs(self.contract.events.LeafOpened, proposals[-1].blockNumber):
+            args = event.args
+            leaf = SettlementLeaf(
+                args.index, args.bidder, args.bidAmount, args.maxPrice, args.valid, args.resultMaxPrice, args.resultTotalBid,
+            )
+            opened[leaf.index] = (leaf, [bytes(node) for node in args.proof])
+        return opened
+
+    def _now(self) -> int:
+        return web3.eth.get_block("latest")["timestamp"]
+
+
+class SettlementProposer(SettlementParty):
+    def __init__(self, contract_address, sender, leaves: List[SettlementLeaf], from_block=0):
+        super().__init__(contract_address, sender, leaves, from_block)
+        self.tree = MerkleTree(leaves)
+
+    def step(self) -> bool:
+        """ Answers a pending leaf request or finalizes once the challenge period is over,
+            returns False when there is nothing left to do
+        """
+        proposer, proposed_at, _, _, _ = self.proposal()
+        if proposer != self.sender:
+            return False
+
+        challenger, deadline, proposer_turn, _, index = self.dispute()
+        if challenger != ZERO_ADDRESS:
+            if proposer_turn:
+                # challengeSettlement bounds the index by the bid count, a proposal with fewer leaves can't
+                # open the rest and the request is left to time out
+                if index < len(self.leaves):
+                    _wait(self.contract.functions.openLeaf(astuple(self.leaves[index]), self.tree.proof(index)), self.sender)
+            elif self._now() > deadline:
+                # The challenger stopped answering and forfeits their bond
+                _wait(self.contract.functions.resolveTimeout(), self.sender)
+            return True
+
+        if self._now() >= proposed_at + self.contract.functions.CHALLENGE_PERIOD().call():
+            _wait(self.contract.functions.finalizeSettlement(), self.sender)
+            return False
+        return True
+
+
+class SettlementChallenger(SettlementParty):
+    """ Disputes a proposal whose result differs from the locally computed one
+
+        The proposer's leaf at the last index is requested first, then the range between the last
+        leaf known to match the local reveal order and the first known to differ is bisected. At an
+        adjacent pair the differing entry either doesn't follow from the previous one, or the local
+        entry at that index ranks between them and was left out, both provable on chain. That takes
+        at most ceil(log2(bid count)) + 1 requests, the contract's maxLeafRequests.
+    """
+
+    def __init__(self, contract_address, sender, leaves: List[SettlementLeaf], from_block=0):
+        super().__init__(contract_address, sender, leaves, from_block)
+        # Set by step when a differing proposal can no longer be disputed
+        self.challenge_period_over = False
+
+    def expected_result(self) -> Tuple[int, int]:
+        last = self.leaves[-1]
+        return final_result((last.result_max_price, last.result_total_bid))
+
+    def _bisect(self, opened) -> Tuple[int, int, Optional[int]]:
+        """ (lo, hi, index to request), lo is the last matching leaf or -1, hi the first differing one
+        """
+        lo, hi = -1, len(self.leaves) - 1
+        if hi not in opened:
+            return lo, hi, hi
+        while hi - lo > 1:
+            middle = (lo + hi) // 2
+            if middle not in opened:
+                return lo, hi, middle
+            if leaf_hash(opened[middle][0]) == leaf_hash(self.leaves[middle]):
+                lo = middle
+            else:
+                hi = middle
+        return lo, hi, None
+
+    def _prove(self, opened, lo, hi):
+        prev, prev_proof = opened[lo] if lo >= 0 else (None, [])
+        entry, proof = opened[hi]
+        function = self.contract.functions.proveInvalidEntry(_leaf_args(prev), prev_proof, astuple(entry), proof)
+        try:
+            function.call({"from": self.sender})
+        except ContractLogicError:
+            # The entry follows correctly from the previous one, so it skipped the local entry
+            function = self.contract.functions.proveOmission(
+                _leaf_args(prev), prev_proof, astuple(entry), proof, self.leaves[hi].bidder
+            )
+        return _wait(function, self.sender)
+
+    def step(self) -> bool:
+        """ Takes the next action in the dispute, returns False when there is nothing left to do
+        """
+        proposer, proposed_at, _, max_price, total_bid = self.proposal()
+        if proposer == ZERO_ADDRESS or (max_price, total_bid) == self.expected_result():
+            return False
+
+        challenger, deadline, proposer_turn, _, _ = self.dispute()
+        if challenger not in (ZERO_ADDRESS, self.sender):
+            # Another dispute is running, it has to end before a new one can start. Once it times out anyone
+            # can close it, and a proposal that survives it leaves at least RESPONSE_PERIOD to open the next
+            if self._now() > deadline:
+                _wait(self.contract.functions.resolveTimeout(), self.sender)
+            return True
+        if challenger == ZERO_ADDRESS and self._now() >= proposed_at + self.contract.functions.CHALLENGE_PERIOD().call():
+            self.challenge_period_over = True
+            return False
+        if proposer_turn:
+            if self._now() > deadline:
+                _wait(self.contract.functions.resolveTimeout(), self.sender)
+                return False
+            return True
+
+        opened = self.opened_leaves()
+        last_index = len(self.leaves) - 1
+        if last_index in opened:
+            last, proof = opened[last_index]
+            if final_result((last.result_max_price, last.result_total_bid)) != (max_price, total_bid):
+                _wait(self.contract.functions.proveWrongResult(astuple(last), proof), self.sender)
+                return False
+
+        lo, hi, index = self._bisect(opened)
+        if index is not None:
+            bond = 0 if challenger == self.sender else self.contract.functions.SETTLEMENT_BOND().call()
+            _wait(self.contract.functions.challengeSettlement(index), self.sender, bond)
+            return True
+
+        self._prove(opened, lo, hi)
+        return False
@@ -0,0 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Sequence
+
+# Work is split into this many chunks per worker, so uneven chunks don't leave workers idle
+CHUNKS_PER_WORKER = 4
+
+
+def chunked_map(fn: Callable[[Sequence], List], items: Sequence, workers: int = 1) -> List:
+    """ Concatenates fn(chunk) over consecutive chunks of items, in a process pool if workers > 1
+
+        fn has to be a module level function returning one result per item. Results keep the
+        order of items, whatever the number of workers.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return fn(items)
+
+    chunk_size = -(-len(items) // (workers * CHUNKS_PER_WORKER))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [result for chunk_results in pool.map(fn, chunks) for result in chunk_results]
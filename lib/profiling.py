@@ -0,0 +1,165 @@
+# Imported by crypto and bidder, so it only depends on the standard library. web3 is imported
+# once profiling is enabled
+import cProfile
+import json
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache, wraps
+from typing import Callable, Dict, Optional
+
+# Set by enable(), instrumented code checks it first so disabled profiling costs a global lookup
+ENABLED = False
+
+# Phases in summary order, instrumented names are grouped by phase
+PHASES = ["rpc", "contract", "bidder", "crypto"]
+# Methods whose first parameter is a transaction carrying contract call data
+CONTRACT_CALL_METHODS = {"eth_call", "eth_estimateGas", "eth_sendTransaction"}
+
+# (phase, name) -> [calls, seconds]
+_timings: Dict[tuple, list] = defaultdict(lambda: [0, 0.0])
+_lock = threading.Lock()
+# Chrome trace events, only collected when a .json trace is written
+_events: Optional[list] = None
+_profiler: Optional[cProfile.Profile] = None
+_out_path: Optional[str] = None
+_started = 0.0
+
+
+def record(phase: str, name: str, start: float, seconds: float):
+    with _lock:
+        timing = _timings[(phase, name)]
+        timing[0] += 1
+        timing[1] += seconds
+        if _events is not None:
+            _events.append({
+                "name": name, "cat": phase, "ph": "X", "pid": 0, "tid": threading.get_ident(),
+                "ts": (start - _started) * 1e6, "dur": seconds * 1e6,
+            })
+
+
+def timed(phase: str) -> Callable:
+    """ Decorator timing every call of the function under phase while profiling is enabled
+
+        Calls nested in other timed calls are counted in both, times are inclusive.
+    """
+    def decorator(fn):
+        name = fn.__name__
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(phase, name, start, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def _function_names() -> Dict[str, str]:
+    """ 4 byte selector -> "Contract.function" for the contracts in the build artifacts
+    """
+    from eth_utils import function_abi_to_4byte_selector
+    from contracts import CONTRACT_NAMES, contract_factory
+
+    names = {}
+    for contract_name in CONTRACT_NAMES:
+        try:
+            abi = contract_factory(contract_name).abi
+        except OSError:
+            continue
+        for entry in abi:
+            if entry.get("type") == "function":
+                selector = "0x" + function_abi_to_4byte_selector(entry).hex()
+                names[selector] = f"{contract_name}.{entry['name']}"
+    return names
+
+
+def record_rpc(method: str, params, start: float, seconds: float):
+    """ Records a JSON-RPC request, and the contract function it calls if any
+    """
+    record("rpc", method, start, seconds)
+    if method in CONTRACT_CALL_METHODS and params and isinstance(params[0], dict):
+        data = params[0].get("data") or params[0].get("input")
+        if data:
+            selector = data[:10] if isinstance(data, str) else "0x" + bytes(data[:4]).hex()
+            record("contract", _function_names().get(selector, selector), start, seconds)
+
+
+def traced_rpc(make_request: Callable, method: str, params):
+    """ Sends a request through make_request(method, params), recording it while profiling is enabled
+    """
+    if not ENABLED:
+        return make_request(method, params)
+    start = time.perf_counter()
+    try:
+        return make_request(method, params)
+    finally:
+        record_rpc(method, params, start, time.perf_counter() - start)
+
+
+def tracing_middleware(make_request, w3):
+    def middleware(method, params):
+        return traced_rpc(make_request, method, params)
+    return middleware
+
+
+def enable(out_path: Optional[str] = None):
+    """ Starts collecting timings, out_path optionally names a cProfile (.prof) or Chrome trace
+        (.json) file written by finish()
+    """
+    global ENABLED, _events, _profiler, _out_path, _started
+    from client import web3
+
+    _timings.clear()
+    _out_path = out_path
+    _events = [] if out_path and out_path.endswith(".json") else None
+    if "trace" not in web3.middleware_onion:
+        web3.middleware_onion.add(tracing_middleware, "trace")
+
+    _started = time.perf_counter()
+    ENABLED = True
+    if out_path and _events is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def summary() -> str:
+    elapsed = time.perf_counter() - _started
+    lines = [f"Profile: {elapsed:.3f}s wall time"]
+    for phase in PHASES:
+        entries = sorted(
+            ((name, calls, seconds) for (entry_phase, name), (calls, seconds) in _timings.items() if entry_phase == phase),
+            key=lambda entry: -entry[2],
+        )
+        if not entries:
+            continue
+        lines.append(f"{phase:<40} {'calls':>8} {'total s':>10} {'mean ms':>10}")
+        for name, calls, seconds in entries:
+            lines.append(f"  {name:<38} {calls:>8} {seconds:>10.3f} {seconds / calls * 1000:>10.3f}")
+    return "\n".join(lines)
+
+
+def finish():
+    """ Stops profiling, prints the per-phase summary and writes the trace file if requested
+    """
+    global ENABLED, _events, _profiler
+    if not ENABLED:
+        return
+    ENABLED = False
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_out_path)
+        _profiler = None
+    elif _events is not None:
+        with open(_out_path, "w") as f:
+            json.dump({"traceEvents": _events, "displayTimeUnit": "ms"}, f)
+        _events = None
+
+    print(summary())
+    if _out_path:
+        print(f"Wrote profile to {_out_path}")
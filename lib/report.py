@@ -0,0 +1,169 @@
+import csv
+from dataclasses import astuple, dataclass, fields
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+
+from bidder import RevealedBid, decrypt_bid_values, get_master_private_key
+from client import batch_call
+from contracts import DAODutchAuction, TestERC20
+from settlement import ZERO_ADDRESS
+
+# Bids decrypted, priced and written per batch, memory use doesn't depend on the auction size
+REPORT_CHUNK_SIZE = 500
+
+
+@dataclass
+class PayoutRow:
+    bidder: str
+    bid_amount: int
+    max_price: int
+    locked_eth: int
+    valid: bool
+    token_shares: int
+    eth_refund: int
+
+
+REPORT_FIELDS = [f.name for f in fields(PayoutRow)]
+
+
+def payout(bid: RevealedBid, locked_eth: int, realized_price: int, total_bid: int) -> Tuple[bool, int, int]:
+    """ (valid, token shares, ETH refund) for a bid, the integer math of withdrawTo
+
+        Raises for a valid bid of an auction that settled with a total bid of 0, withdrawTo
+        divides by it and reverts, so the bid has no payout to report.
+    """
+    if bid.bid_amount > bid.max_price or bid.max_price < realized_price or bid.bid_amount > locked_eth:
+        return False, 0, locked_eth
+    if total_bid == 0:
+        raise Exception(f"Bid of {bid.bidder} can't be withdrawn, the auction settled with a total bid of 0")
+    token_shares = bid.bid_amount * realized_price // total_bid
+    return True, token_shares, locked_eth - token_shares
+
+
+def settlement_result(contract_address) -> Tuple[int, int]:
+    """ (realized price, total bid) of a settled auction
+    """
+    contract = DAODutchAuction(contract_address)
+    result_submitter = contract.functions.resultSubmitter().call()
+    if result_submitter == ZERO_ADDRESS:
+        raise Exception("Auction not final")
+    return tuple(contract.functions.results(result_submitter).call())
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    items = iter(items)
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def payout_rows(contract_address, db_path=":memory:", block_identifier="latest") -> Iterator[PayoutRow]:
+    """ Streams the payout of every bid, computed locally from the decrypted bids
+
+        lockedEth is read at block_identifier, bidders that already withdrew have none left
+        after it, so pass the settlement block to report on a partially withdrawn auction.
+    """
+    from indexer import BidIndexer
+
+    contract = DAODutchAuction(contract_address)
+    realized_price, total_bid = settlement_result(contract_address)
+    master_private_key = get_master_private_key(contract_address)
+
+    indexer = BidIndexer(contract_address, db_path)
+    indexer.sync()
+    try:
+        for chunk in _chunks(indexer.iter_bids(), REPORT_CHUNK_SIZE):
+            locked = batch_call([contract.functions.lockedEth(bid.bidder) for bid in chunk], block_identifier)
+            for bid, locked_eth in zip(decrypt_bid_values(chunk, master_private_key), locked):
+                valid, token_shares, eth_refund = payout(bid, locked_eth, realized_price, total_bid)
+                yield PayoutRow(bid.bidder, bid.bid_amount, bid.max_price, locked_eth, valid, token_shares, eth_refund)
+    finally:
+        indexer.close()
+
+
+def _is_parquet(path) -> bool:
+    return str(path).endswith(".parquet")
+
+
+def _parquet():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception("Parquet reports need pyarrow, install it with pip install pyarrow")
+    return pyarrow, pyarrow.parquet
+
+
+def write_report(rows: Iterable[PayoutRow], path) -> int:
+    """ Writes rows to a .parquet or otherwise CSV file chunk by chunk, returns the row count
+
+        Amounts are written as decimal strings, wei values don't fit 64 bit columns.
+    """
+    count = 0
+    if not _is_parquet(path):
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(REPORT_FIELDS)
+            for row in rows:
+                writer.writerow(astuple(row))
+                count += 1
+        return count
+
+    pa, pq = _parquet()
+    schema = pa.schema([(name, pa.bool_() if name == "valid" else pa.string()) for name in REPORT_FIELDS])
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _chunks(rows, REPORT_CHUNK_SIZE):
+            columns = [
+                [row.valid if name == "valid" else str(getattr(row, name)) for row in chunk]
+                for name in REPORT_FIELDS
+            ]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+            count += len(chunk)
+    return count
+
+
+def _parse_row(record: dict) -> PayoutRow:
+    valid = record["valid"]
+    return PayoutRow(
+        record["bidder"],
+        int(record["bid_amount"]),
+        int(record["max_price"]),
+        int(record["locked_eth"]),
+        valid if isinstance(valid, bool) else valid == "True",
+        int(record["token_shares"]),
+        int(record["eth_refund"]),
+    )
+
+
+def read_report(path) -> Iterator[PayoutRow]:
+    if not _is_parquet(path):
+        with open(path, newline="") as f:
+            for record in csv.DictReader(f):
+                yield _parse_row(record)
+        return
+
+    _, pq = _parquet()
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=REPORT_CHUNK_SIZE):
+        for record in batch.to_pylist():
+            yield _parse_row(record)
+
+
+def reconcile(contract_address, path) -> Iterator[str]:
+    """ Checks a report against the chain, yields a description of every mismatch
+
+        Bidders that withdrew must hold their token shares, the others must still have
+        the reported lockedEth and no tokens.
+    """
+    contract = DAODutchAuction(contract_address)
+    votes_token = TestERC20(contract.functions.votesToken().call())
+
+    for chunk in _chunks(read_report(path), REPORT_CHUNK_SIZE):
+        balances = batch_call(
+            [contract.functions.lockedEth(row.bidder) for row in chunk]
+            + [votes_token.functions.balanceOf(row.bidder) for row in chunk]
+        )
+        for row, locked_eth, token_balance in zip(chunk, balances[:len(chunk)], balances[len(chunk):]):
+            withdrawn = locked_eth == 0 and row.locked_eth != 0
+            if withdrawn and token_balance != row.token_shares:
+                yield f"{row.bidder}: holds {token_balance} tokens, report says {row.token_shares}"
+            elif not withdrawn and (locked_eth != row.locked_eth or token_balance != 0):
+                yield f"{row.bidder}: {locked_eth} wei locked and {token_balance} tokens, report says {row.locked_eth} wei locked"
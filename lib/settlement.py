@@ -0,0 +1,202 @@
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from client import web3, batch_call
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# Share of the block gas limit a single settlement transaction may use
+BLOCK_GAS_FRACTION = 0.8
+# Number of entries estimated to fit the per-entry gas model
+PROBE_SIZE = 8
+# Chunks spread over the list the model is fitted at, the most expensive fit is used. Entries differ in
+# cost: undecryptable bids skip the ecMul, refunded bids skip the votes token transfer
+PROBE_COUNT = 4
+# Least gas the model charges per entry, every entry reads at least one cold storage slot. Estimates
+# that vary between calls can otherwise fit a per-entry gas of zero or less
+MIN_GAS_PER_ITEM = 2100
+# Headroom on top of the gas model, decryption cost differs slightly between bids
+GAS_MARGIN = 1.2
+# Gas reserved in the last revealAllBids chunk for deploying the votes token
+FINALIZE_GAS = 1500000
+
+
+@dataclass
+class Submission:
+    """ What submit_reveal or submit_withdrawals sent, for the caller to report
+    """
+    receipts: List
+    # Entries sent, and entries left out because they were already posted or paid
+    sent: int
+    skipped: int
+    # submit_reveal: posted bids didn't match the ordered bids and were reset first
+    reset: bool = False
+    # submit_withdrawals: recipients withdrawMany skipped, they have no bid or rejected the ETH
+    unpaid: List[str] = field(default_factory=list)
+
+    @property
+    def gas_used(self) -> int:
+        return sum(receipt["gasUsed"] for receipt in self.receipts)
+
+
+def block_gas_budget() -> int:
+    return int(web3.eth.get_block("latest")["gasLimit"] * BLOCK_GAS_FRACTION)
+
+
+def plan_chunks(
+    items: Sequence, estimate: Callable[[Sequence], int], gas_budget: int, final_reserve: int = 0
+) -> List[Tuple[List, int]]:
+    """ Splits items into the largest chunks whose transaction fits in gas_budget
+
+        estimate(chunk) returns estimated gas for a run of consecutive items against the current
+        chain state, wherever in items the run starts. Gas is modelled as base + per_item * len(chunk),
+        since later chunks can't be estimated before the earlier ones are mined. It is fitted from two
+        estimates at each of PROBE_COUNT probes spread over items, taking the largest base and per_item,
+        so a cheap stretch of entries doesn't size the chunks of an expensive one. The last chunk
+        additionally keeps final_reserve gas free. Returns (chunk, gas_limit) pairs.
+    """
+    items = list(items)
+    if not items:
+        return []
+
+    if len(items) <= PROBE_SIZE:
+        # Estimate covers the whole submission, including finalization
+        return [(items, int(estimate(items) * GAS_MARGIN))]
+
+    base, per_item = 0, MIN_GAS_PER_ITEM
+    last_start = len(items) - PROBE_SIZE
+    for start in sorted({round(index * last_start / (PROBE_COUNT - 1)) for index in range(PROBE_COUNT)}):
+        probe = items[start:start + PROBE_SIZE]
+        single = estimate(probe[:1])
+        probe_per_item = (estimate(probe) - single) / (PROBE_SIZE - 1)
+        base = max(base, single - probe_per_item)
+        per_item = max(per_item, probe_per_item)
+
+    def gas_limit(size, reserve=0):
+        return int((base + per_item * size) * GAS_MARGIN) + reserve
+
+    def max_size(budget):
+        return max(1, int((budget / GAS_MARGIN - base) // per_item))
+
+    chunk_size = max_size(gas_budget)
+    last_size = min(len(items), max_size(gas_budget - final_reserve))
+
+    body, tail = items[:len(items) - last_size], items[len(items) - last_size:]
+    chunks = [(body[i:i + chunk_size], gas_limit(len(body[i:i + chunk_size]))) for i in range(0, len(body), chunk_size)]
+    chunks.append((tail, gas_limit(len(tail), final_reserve)))
+    return chunks
+
+
+def send_pipelined(transactions: Sequence[Tuple[Callable, int]], sender) -> List:
+    """ Sends contract function calls back to back with consecutive nonces, then waits for all receipts
+
+        transactions is a list of (contract function, gas limit) pairs.
+    """
+    nonce = web3.eth.get_transaction_count(sender, "pending")
+    tx_hashes = [
+        function.transact({"from": sender, "nonce": nonce + offset, "gas": gas})
+        for offset, (function, gas) in enumerate(transactions)
+    ]
+    return [web3.eth.wait_for_transaction_receipt(tx_hash) for tx_hash in tx_hashes]
+
+
+def resume_index(contract, ordered_bidders: Sequence[str], sender) -> Optional[int]:
+    """ Number of ordered_bidders already posted on chain by sender
+
+        Returns None if the posted entries don't match ordered_bidders, in which case
+        sender has to reset its buffer before submitting.
+
+        Only the count and the last posted bidder are compared, which is enough: revealAllBids
+        only accepts each entry if it ranks strictly after the previous one, so the posted entries
+        ending at bidder b are distinct bids ranking up to b. If ordered_bidders has b at the same
+        position, exactly that many bids rank up to b, so the posted entries are those bids in the
+        same order. That relies on the local ranking agreeing with the chain's. If it doesn't, say
+        with a stale bid index, the contract still checks every entry, so a wrong resume can fail
+        or leave the reveal unfinished but can't finalize a wrong result.
+    """
+    posted = contract.functions.postedBidCount(sender).call()
+    if posted == 0:
+        return 0
+    if posted > len(ordered_bidders):
+        return None
+
+    last_posted = contract.functions.lastPostedBid(sender).call()
+    return posted if last_posted == ordered_bidders[posted - 1] else None
+
+
+def submit_reveal(
+    contract,
+    ordered_bidders: Sequence[str],
+    sender,
+    gas_budget: Optional[int] = None,
+) -> Submission:
+    """ Posts the ordered bids to revealAllBids in gas-bounded chunks
+
+        Safe to rerun after a crash or failed chunk, submission resumes after the entries
+        that are already posted on chain.
+    """
+    def reveal(chunk):
+        return contract.functions.revealAllBids(list(chunk))
+
+    if contract.functions.resultSubmitter().call() != ZERO_ADDRESS:
+        raise Exception("Result already generated")
+
+    posted = resume_index(contract, ordered_bidders, sender)
+    reset = posted is None
+    if reset:
+        # Posted bids do not match the ordered bids
+        tx_hash = contract.functions.revealAllBids([]).transact({"from": sender})
+        web3.eth.wait_for_transaction_receipt(tx_hash)
+        posted = 0
+
+    if gas_budget is None:
+        gas_budget = block_gas_budget()
+
+    remaining = ordered_bidders[posted:]
+    chunks = plan_chunks(
+        remaining,
+        lambda chunk: reveal(chunk).estimateGas({"from": sender}),
+        gas_budget,
+        FINALIZE_GAS,
+    )
+
+    receipts = send_pipelined([(reveal(chunk), gas) for chunk, gas in chunks], sender)
+    if any(receipt["status"] == 0 for receipt in receipts):
+        raise Exception("Reveal transaction failed, rerun to resume from the posted bids")
+
+    return Submission(receipts, len(remaining), posted, reset)
+
+
+def submit_withdrawals(
+    contract,
+    recipients: Sequence[str],
+    sender,
+    gas_budget: Optional[int] = None,
+) -> Submission:
+    """ Pays out recipients with withdrawMany in gas-bounded chunks
+
+        Recipients without locked ETH already withdrew and are left out, withdrawMany skips them
+        as well, so this is safe to rerun after a failed chunk. Recipients withdrawMany skipped
+        keep their locked ETH and are returned as unpaid.
+    """
+    if contract.functions.resultSubmitter().call() == ZERO_ADDRESS:
+        raise Exception("Auction not final")
+
+    def withdraw(chunk):
+        return contract.functions.withdrawMany(list(chunk))
+
+    locked = batch_call([contract.functions.lockedEth(recipient) for recipient in recipients])
+    pending = [recipient for recipient, locked_eth in zip(recipients, locked) if locked_eth]
+
+    if gas_budget is None:
+        gas_budget = block_gas_budget()
+
+    chunks = plan_chunks(pending, lambda chunk: withdraw(chunk).estimateGas({"from": sender}), gas_budget)
+
+    receipts = send_pipelined([(withdraw(chunk), gas) for chunk, gas in chunks], sender)
+    if any(receipt["status"] == 0 for receipt in receipts):
+        raise Exception("Withdrawal transaction failed, rerun to pay out the remaining bidders")
+
+    still_locked = batch_call([contract.functions.lockedEth(recipient) for recipient in pending]) if receipts else []
+    unpaid = [recipient for recipient, locked_eth in zip(pending, still_locked) if locked_eth]
+    return Submission(receipts, len(pending), len(recipients) - len(pending), unpaid=unpaid)
@@ -0,0 +1,180 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+INT64_MAX = int(np.iinfo(np.int64).max)
+
+
+@dataclass
+class Clearing:
+    realized_price: int
+    total_bid: int
+
+
+@dataclass
+class SimulationResult:
+    """ Outcome of A simulated auctions with up to N bids each
+
+        realized_price and total_bid have shape (A,), the per-bid arrays (A, N). shares are the
+        voting tokens and refunds the ETH each bid receives from withdrawTo.
+    """
+    realized_price: np.ndarray
+    total_bid: np.ndarray
+    valid: np.ndarray
+    shares: np.ndarray
+    refunds: np.ndarray
+
+
+def _int_arrays(*arrays):
+    """ Converts the inputs to one integer dtype, int64 when every value and every row sum fits,
+        Python ints in object arrays otherwise so wei amounts stay exact
+    """
+    converted = [np.asarray(array) for array in arrays]
+    if all(array.dtype.kind in "iu" for array in converted):
+        # Float sums are approximate, the margin keeps borderline cases on the exact path
+        if all(array.size == 0 or array.astype(np.float64).sum(axis=-1).max() < 2 ** 62 for array in converted):
+            return [array.astype(np.int64) for array in converted]
+
+    converted = [np.asarray(array, dtype=object) for array in converted]
+    if all(array.size == 0 or max(sum(row) for row in array.reshape(-1, array.shape[-1])) <= INT64_MAX for array in converted):
+        return [array.astype(np.int64) for array in converted]
+    return converted
+
+
+def _mul_div(a: np.ndarray, b: np.ndarray, c: np.ndarray) -> np.ndarray:
+    """ a * b // c elementwise, c == 0 gives 0, without int64 overflow in a * b
+    """
+    if a.dtype == np.int64 and a.size and int(a.max()) * int(b.max()) > INT64_MAX:
+        a, b, c = a.astype(object), b.astype(object), c.astype(object)
+    safe_c = np.where(c == 0, 1, c)
+    return np.where(c == 0, 0, a * b // safe_c)
+
+
+def simulate_auctions(bid_amounts, max_prices, locked_eth, mask: Optional[np.ndarray] = None) -> SimulationResult:
+    """ Settles many auctions at once with the rules of rank_bids and withdrawTo
+
+        All inputs have shape (A, N), one row per auction. Auctions with fewer bids are padded
+        and the padding excluded with mask, where False marks an entry that is not a bid.
+        Values in wei usually overflow int64 once summed and fall back to exact but slower
+        object arrays, amounts in gwei keep the int64 path.
+    """
+    bid_amounts, max_prices, locked_eth = _int_arrays(bid_amounts, max_prices, locked_eth)
+    auction_count, bid_count = bid_amounts.shape
+    if mask is None:
+        mask = np.ones(bid_amounts.shape, dtype=bool)
+
+    valid = mask & (bid_amounts <= max_prices) & (bid_amounts <= locked_eth)
+
+    # Valid bids by max price descending, ties in any order since a whole price group clears
+    # together, then invalid bids
+    order = np.argsort(np.where(valid, -max_prices, 1), axis=1, kind="stable")
+    sorted_valid = np.take_along_axis(valid, order, axis=1)
+    sorted_prices = np.take_along_axis(max_prices, order, axis=1)
+    totals = np.cumsum(np.where(sorted_valid, np.take_along_axis(bid_amounts, order, axis=1), 0), axis=1)
+
+    # First bid where the running total reaches its max price
+    reached = sorted_valid & (totals >= sorted_prices)
+    has_clearing = reached.any(axis=1)
+    rows = np.arange(auction_count)
+    if bid_count:
+        clearing_price = sorted_prices[rows, reached.argmax(axis=1)]
+    else:
+        clearing_price = np.zeros(auction_count, dtype=bid_amounts.dtype)
+    realized_price = np.where(has_clearing, clearing_price, 0)
+
+    # Every valid bid at or above the clearing price is included
+    included = valid & (max_prices >= realized_price[:, None])
+    total_bid = np.where(included, bid_amounts, 0).sum(axis=1)
+    realized_price = np.where(realized_price == 0, total_bid, realized_price)
+
+    # withdrawTo refunds invalid and excluded bids in full
+    included = valid & (max_prices >= realized_price[:, None])
+    shares = np.where(
+        included,
+        _mul_div(bid_amounts, np.broadcast_to(realized_price[:, None], bid_amounts.shape), np.broadcast_to(total_bid[:, None], bid_amounts.shape)),
+        0,
+    )
+    refunds = np.where(mask, locked_eth - shares, 0)
+
+    return SimulationResult(realized_price, total_bid, valid, shares, refunds)
+
+
+class AuctionBook:
+    """ One auction's valid bids by max price descending with prefix sums of the bid amounts
+
+        Re-prices the auction after adding or removing a single bid with a few binary searches
+        instead of ranking all bids again. Since running totals rise while max prices fall,
+        totals - max_prices is non-decreasing and the clearing bid is the first where it is >= 0.
+    """
+
+    def __init__(self, bid_amounts, max_prices, locked_eth):
+        bid_amounts, max_prices, locked_eth = _int_arrays([bid_amounts], [max_prices], [locked_eth])
+        bid_amounts, max_prices, locked_eth = bid_amounts[0], max_prices[0], locked_eth[0]
+
+        valid = (bid_amounts <= max_prices) & (bid_amounts <= locked_eth)
+        order = np.flatnonzero(valid)[np.argsort(-max_prices[valid], kind="stable")]
+
+        self.amounts = bid_amounts[order]
+        self.prices = max_prices[order]
+        self.neg_prices = -self.prices
+        self.totals = np.cumsum(self.amounts)
+        self.diff = self.totals - self.prices
+        # Input index -> position in the sorted book, invalid bids are not in the book
+        self.position = {int(index): position for position, index in enumerate(order)}
+
+    def _total_through(self, price) -> int:
+        """ Sum of the amounts of all bids with max price >= price
+        """
+        count = int(np.searchsorted(self.neg_prices, -price, side="right"))
+        return int(self.totals[count - 1]) if count else 0
+
+    def _settle(self, realized_price, total_bid) -> Clearing:
+        realized_price, total_bid = int(realized_price), int(total_bid)
+        return Clearing(realized_price if realized_price else total_bid, total_bid)
+
+    def result(self) -> Clearing:
+        index = int(np.searchsorted(self.diff, 0))
+        if index < len(self.prices):
+            return self._settle(self.prices[index], self._total_through(self.prices[index]))
+        return self._settle(0, self.totals[-1] if len(self.totals) else 0)
+
+    def with_bid(self, bid_amount: int, max_price: int, locked_eth: int) -> Clearing:
+        """ Result if one more bid were placed
+        """
+        if bid_amount > max_price or bid_amount > locked_eth:
+            return self.result()
+
+        # The new bid goes after all bids with the same or a higher max price
+        position = int(np.searchsorted(self.neg_prices, -max_price, side="right"))
+        index = int(np.searchsorted(self.diff[:position], 0))
+        if index < position:
+            realized = self.prices[index]
+        elif (self.totals[position - 1] if position else 0) + bid_amount >= max_price:
+            realized = max_price
+        else:
+            # Totals after the new bid all grow by bid_amount
+            index = position + int(np.searchsorted(self.diff[position:], -bid_amount))
+            if index == len(self.prices):
+                return self._settle(0, (self.totals[-1] if len(self.totals) else 0) + bid_amount)
+            realized = self.prices[index]
+
+        return self._settle(realized, self._total_through(realized) + (bid_amount if max_price >= realized else 0))
+
+    def without_bid(self, bid_index: int) -> Clearing:
+        """ Result if the bid at bid_index of the constructor inputs were withdrawn
+        """
+        position = self.position.get(bid_index)
+        if position is None:
+            return self.result()
+
+        bid_amount, max_price = self.amounts[position], self.prices[position]
+        index = int(np.searchsorted(self.diff[:position], 0))
+        if index == position:
+            # Totals after the removed bid all shrink by bid_amount
+            index = position + 1 + int(np.searchsorted(self.diff[position + 1:], bid_amount))
+            if index == len(self.prices):
+                return self._settle(0, self.totals[-1] - bid_amount)
+
+        realized = self.prices[index]
+        return self._settle(realized, self._total_through(realized) - (bid_amount if max_price >= realized else 0))
@@ -0,0 +1,160 @@
+import os
+import random
+import subprocess
+import sys
+import time
+
+import click
+
+
+@click.group()
+def benchmark():
+    pass
+
+
+def timed(label, fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    print(f"{label}: {time.perf_counter() - start:.3f}s")
+    return result
+
+
+def random_address() -> str:
+    return "0x%040x" % random.getrandbits(160)
+
+
+@benchmark.command()
+@click.option("--count", default=1000000, help="Number of decrypted bids to rank")
+def rank(count):
+    from bidder import RevealedBid, rank_bids
+
+    bids = []
+    for _ in range(count):
+        max_price = random.randint(10 ** 15, 10 ** 21)
+        bids.append(RevealedBid(random_address(), max_price, random.randint(0, max_price)))
+    locked_eth = {bid.bidder: bid.bid_amount + random.randint(-10 ** 15, 10 ** 18) for bid in bids}
+
+    result = timed(f"rank_bids ({count} bids)", rank_bids, bids, locked_eth)
+    print(f"Realized price {result.realized_price}, total bid {result.total_bid}")
+
+
+@benchmark.command()
+@click.option("--runs", default=10, help="Number of cold starts to time")
+def startup(runs):
+    lib_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../lib")
+    commands = {
+        "cli.py --help": [sys.executable, os.path.join(lib_dir, "cli.py"), "--help"],
+        "import bidder": [sys.executable, "-c", "import bidder"],
+    }
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([lib_dir, os.environ.get("PYTHONPATH", "")]))
+
+    for label, command in commands.items():
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, env=env, stdout=subprocess.DEVNULL, check=True)
+            durations.append(time.perf_counter() - start)
+        print(f"{label}: best {min(durations):.3f}s, mean {sum(durations) / runs:.3f}s over {runs} runs")
+
+
+@benchmark.command()
+@click.option("--count", default=200, help="Number of scalar multiplications")
+def g1(count):
+    from crypto import G1, multiply, multiply_g1, random_scalar
+
+    scalars = [random_scalar() for _ in range(count)]
+    timed("multiply_g1 table build", multiply_g1, 1)
+    generic = timed(f"multiply(G1, k) x{count}", lambda: [multiply(G1, k) for k in scalars])
+    fixed = timed(f"multiply_g1(k) x{count}", lambda: [multiply_g1(k) for k in scalars])
+    assert all(a[0] * b[2] == b[0] * a[2] and a[1] * b[2] == b[1] * a[2] for a, b in zip(generic, fixed))
+
+
+@benchmark.command()
+@click.option("--sizes", default="4,16,64,256,1000", help="Comma separated numbers of terms")
+def msm(sizes):
+    from crypto import CURVE_ORDER, Z1, add, multiply, multiply_g1, multi_scalar_multiply, random_scalar
+
+    for count in map(int, sizes.split(",")):
+        points = [multiply_g1(random_scalar()) for _ in range(count)]
+        scalars = [random_scalar() for _ in range(count)]
+
+        def naive():
+            result = Z1
+            for point, scalar in zip(points, scalars):
+                result = add(result, multiply(point, scalar % CURVE_ORDER))
+            return result
+
+        timed(f"multiply + add ({count} terms)", naive)
+        timed(f"multi_scalar_multiply ({count} terms)", multi_scalar_multiply, points, scalars)
+
+
+@benchmark.command()
+@click.option("--count", default=1000, help="Number of bidder public keys")
+def ecdh(count):
+    from crypto import bulk_ecdh, multiply_g1, normalize, point_from_affine, random_scalar, symmetric_key
+
+    master_private_key = random_scalar()
+    public_keys = [tuple(int(v) for v in normalize(multiply_g1(random_scalar()))) for _ in range(count)]
+
+    keys = timed(
+        f"symmetric_key x{count}",
+        lambda: [symmetric_key(point_from_affine(pk), master_private_key) for pk in public_keys],
+    )
+    shared = timed(f"bulk_ecdh ({count} points)", bulk_ecdh, public_keys, master_private_key)
+    assert keys == [x for x, _ in shared]
+
+
+@benchmark.command()
+@click.option("--count", default=80, help="Number of bidders")
+@click.option("--workers", default=os.cpu_count(), help="Processes for the parallel run")
+def bidders(count, workers):
+    from bidder import generate_bidders
+    from settlement import ZERO_ADDRESS
+
+    timed(f"generate_bidders ({count} bidders)", generate_bidders, ZERO_ADDRESS, count)
+    timed(f"generate_bidders ({count} bidders, {workers} workers)", generate_bidders, ZERO_ADDRESS, count, workers)
+
+
+@benchmark.command("accounts")
+@click.option("--count", default=1000, help="Number of accounts to derive")
+def accounts_(count):
+    os.environ.setdefault("MAX_ACCOUNTS", str(count))
+    from accounts import get_account, get_mnemonic
+    from client import web3
+
+    timed(
+        f"from_mnemonic x{count}",
+        lambda: [web3.eth.account.from_mnemonic(get_mnemonic(), account_path=f"m/44'/60'/0'/0/{i}") for i in range(count)],
+    )
+    timed(f"get_account x{count}", lambda: [get_account(i) for i in range(count)])
+    timed(f"get_account x{count} (cached)", lambda: [get_account(i) for i in range(count)])
+
+
+@benchmark.command()
+@click.option("--auctions", default=1000, help="Number of simulated auctions")
+@click.option("--bids", default=1000, help="Bids per auction")
+def simulate(auctions, bids):
+    import numpy as np
+    from bidder import RevealedBid, rank_bids
+    from simulation import AuctionBook, simulate_auctions
+
+    # Amounts in gwei keep the simulation on int64
+    rng = np.random.default_rng()
+    max_prices = rng.integers(10 ** 6, 10 ** 9, (auctions, bids))
+    bid_amounts = (max_prices * rng.random((auctions, bids)) / 50).astype(np.int64)
+    locked_eth = bid_amounts + rng.integers(-10 ** 6, 10 ** 8, (auctions, bids))
+
+    def rank_all():
+        for amounts, prices, locked in zip(bid_amounts.tolist(), max_prices.tolist(), locked_eth.tolist()):
+            ranked_bids = [RevealedBid(random_address(), price, amount) for amount, price in zip(amounts, prices)]
+            rank_bids(ranked_bids, {bid.bidder: value for bid, value in zip(ranked_bids, locked)})
+
+    timed(f"rank_bids ({auctions} auctions x {bids} bids)", rank_all)
+    timed(f"simulate_auctions ({auctions} auctions x {bids} bids)", simulate_auctions, bid_amounts, max_prices, locked_eth)
+
+    book = AuctionBook(bid_amounts[0], max_prices[0], locked_eth[0])
+    timed(f"AuctionBook.with_bid x{bids}", lambda: [book.with_bid(10 ** 7, int(price), 10 ** 8) for price in max_prices[1]])
+
+
+if __name__ == "__main__":
+    benchmark()